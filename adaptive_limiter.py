@@ -0,0 +1,165 @@
+"""
+自适应并发控制 - 按模型的AIMD在途请求上限
+Adaptive (AIMD) Concurrency Limit per Model
+
+MAX_WORKERS_3B / MAX_WORKERS_7B 是静态数字，只能看着 nvidia-smi 手动调。
+ollama_router 为每个模型维护一个 AimdLimiter，每次请求前取得名额：
+1. 加性增：一个窗口（OLLAMA_AIMD_WINDOW 次完成）内 p95 延迟没有明显上升（<= 基线 × 容差）
+   且上限确实被用满过 → 上限 +1
+2. 乘性减：p95 超过基线 × 容差，或出现超时/连接失败/5xx/429 → 上限 × OLLAMA_AIMD_BACKOFF
+   （错误引起的下降最多每个p95周期一次，一批并发请求同时失败不会把上限压到底）
+3. 基线 = 平稳时的最小p95；只在延迟尖峰时缓慢上移（换了图像尺寸/prompt后不会永久压低上限）
+
+初始上限默认等于最大值（所有端点 max_concurrency 之和，即启用控制器之前的在途上限），
+先按原来的并发运行，只在延迟/错误出现时回退，之后再加性恢复。
+当前上限在 stats() / print_stats() 中可见，每次调整追加一行到 OLLAMA_AIMD_METRICS_LOG（在锁外写入）。
+同一份配置既适用于以3B为主的 Stage 0，也适用于以7B为主的 Stage 5。
+"""
+
+import csv
+import math
+import time
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from config_pipeline import *
+
+
+class AimdLimiter:
+    """单个模型的在途请求上限"""
+
+    def __init__(self, name, initial=OLLAMA_AIMD_INITIAL, minimum=OLLAMA_AIMD_MIN,
+                 maximum=None, window=OLLAMA_AIMD_WINDOW,
+                 tolerance=OLLAMA_AIMD_LATENCY_TOLERANCE, backoff=OLLAMA_AIMD_BACKOFF,
+                 metrics_log=OLLAMA_AIMD_METRICS_LOG):
+        self.name = name
+        self.minimum = max(1, int(minimum))
+        if maximum is None:
+            maximum = OLLAMA_AIMD_MAX or MAX_WORKERS_3B
+        self.maximum = max(self.minimum, int(maximum))
+        # 默认从上限开始（即启用控制器之前的并发），只在延迟/错误时回退，启动阶段吞吐不下降
+        if initial is None:
+            initial = self.maximum
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.window = max(1, int(window))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.metrics_log = Path(metrics_log) if metrics_log else None
+        self.log_lock = threading.Lock()  # 只保护文件写入，不阻塞 acquire/release
+        self.log_rows = []                # 调整时在 cond 内生成，释放 cond 后写入
+
+        self.cond = threading.Condition()
+        self.inflight = 0
+        self.saturated = False  # 本窗口内在途数是否达到过上限
+        self.samples = []       # 本窗口内成功请求的延迟（秒）
+        self.baseline = None    # 无负载时的p95估计
+        self.last_p95 = None
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.errors = 0
+
+    # ---------- 名额 ----------
+    def acquire(self, expires=None):
+        """取得一个名额；到 expires（time.monotonic）仍未取得时返回False"""
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.saturated = True
+                timeout = None if expires is None else expires - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    return False
+                self.cond.wait(timeout)
+            self.inflight += 1
+            if self.inflight >= int(self.limit):
+                self.saturated = True
+            return True
+
+    def release(self, latency=None, error=False):
+        """
+        归还名额
+        latency: 成功请求的延迟（秒）；error: 超时/连接失败/5xx/429
+        两者都没有（例如模型返回4xx）时只归还名额，不影响上限
+        """
+        with self.cond:
+            self.inflight -= 1
+            if error:
+                self.errors += 1
+                now = time.monotonic()
+                if now - self.last_decrease >= (self.last_p95 or 1.0):
+                    self._decrease('error', now)
+            elif latency is not None:
+                self.samples.append(latency)
+                if len(self.samples) >= self.window:
+                    self._adjust()
+            self.cond.notify_all()
+            rows, self.log_rows = self.log_rows, []
+        if rows:
+            self._write_log(rows)
+
+    # ---------- AIMD ----------
+    def _adjust(self):
+        samples = sorted(self.samples)
+        p95 = samples[max(0, math.ceil(0.95 * len(samples)) - 1)]
+        saturated = self.saturated
+        self.samples = []
+        self.saturated = False
+        self.last_p95 = p95
+
+        if self.baseline is None:
+            self.baseline = p95
+        if p95 <= self.baseline * self.tolerance:
+            # 延迟平稳：基线只向下跟随（否则每次+1后的小幅上升会累积，上限越过拐点），上限被用满时再加1
+            self.baseline = min(self.baseline, p95)
+            if saturated and self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1)
+                self.increases += 1
+                self._log('increase', p95)
+        else:
+            # 延迟尖峰：基线缓慢上移，避免工作负载变化后永久压低上限
+            self.baseline = 0.95 * self.baseline + 0.05 * p95
+            self._decrease('latency', time.monotonic())
+
+    def _decrease(self, reason, now):
+        new_limit = max(self.minimum, math.floor(self.limit * self.backoff))
+        self.last_decrease = now
+        if new_limit < self.limit:
+            self.limit = float(new_limit)
+            self.decreases += 1
+            self._log(reason, self.last_p95)
+
+    def _log(self, reason, p95):
+        """生成一行调整记录（持有 cond 时调用，只入队不写文件）"""
+        if self.metrics_log is None:
+            return
+        self.log_rows.append([
+            datetime.now().isoformat(timespec='seconds'), self.name, int(self.limit), reason,
+            '' if p95 is None else round(p95 * 1000, 1),
+            '' if self.baseline is None else round(self.baseline * 1000, 1),
+        ])
+
+    def _write_log(self, rows):
+        with self.log_lock:
+            try:
+                new_file = not self.metrics_log.exists()
+                self.metrics_log.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.metrics_log, "a", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    if new_file:
+                        writer.writerow(['Time', 'Model', 'Limit', 'Reason', 'P95_ms', 'Baseline_ms'])
+                    writer.writerows(rows)
+            except OSError:
+                pass
+
+    # ---------- 统计 ----------
+    def stats(self):
+        with self.cond:
+            return {
+                'limit': int(self.limit),
+                'inflight': self.inflight,
+                'p95_ms': None if self.last_p95 is None else round(self.last_p95 * 1000, 1),
+                'baseline_ms': None if self.baseline is None else round(self.baseline * 1000, 1),
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'errors': self.errors,
+            }
@@ -0,0 +1,156 @@
+"""
+异步调试产物写入器
+Asynchronous Debug-Artifact Writer
+
+Stage 0 的调试产物（_DEBUG_MAP.jpg、ROI_x.jpg、ROI_x.txt、results.json）
+全部交给后台线程写入，不再占用帧处理的关键路径。
+
+特性 Features:
+1. 有界队列 + 满队列策略：'block'（等待）或 'drop'（丢弃并计数）
+2. 每类产物独立开关：off | sampled | all
+3. sampled 模式按帧目录哈希抽样，同一帧的各类产物要么都写要么都不写
+"""
+
+import json
+import zlib
+import queue
+import threading
+from collections import defaultdict
+
+import cv2
+
+from config_pipeline import *
+
+_STOP = object()
+
+ARTIFACT_KINDS = ('debug_map', 'roi_crop', 'roi_text', 'results_json')
+
+
+class ArtifactWriter:
+    """后台产物写入器"""
+
+    def __init__(self, modes=None, max_queue=ARTIFACT_QUEUE_SIZE,
+                 policy=ARTIFACT_QUEUE_POLICY, workers=ARTIFACT_WRITER_THREADS,
+                 sample_every=ARTIFACT_SAMPLE_EVERY):
+        if policy not in ('block', 'drop'):
+            raise ValueError(f"Unknown artifact queue policy: {policy}")
+        self.modes = dict(ARTIFACT_MODES if modes is None else modes)
+        for kind, mode in self.modes.items():
+            if mode not in ('off', 'sampled', 'all'):
+                raise ValueError(f"Unknown artifact mode for {kind}: {mode}")
+        self.policy = policy
+        self.sample_every = max(1, int(sample_every))
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.written = defaultdict(int)
+        self.dropped = defaultdict(int)
+        self.failed = defaultdict(int)
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"artifact-writer-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    # ---------- 开关 ----------
+    def enabled(self, kind, frame_key):
+        """该帧是否需要写入此类产物"""
+        mode = self.modes.get(kind, 'all')
+        if mode == 'all':
+            return True
+        if mode == 'off':
+            return False
+        key = str(frame_key).encode('utf-8', 'replace')
+        return zlib.crc32(key) % self.sample_every == 0
+
+    # ---------- 提交 ----------
+    def submit(self, kind, fn, *args):
+        """提交一个写入任务；drop策略下队列满时丢弃并返回False"""
+        item = (kind, fn, args)
+        if self.policy == 'drop':
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                with self.lock:
+                    self.dropped[kind] += 1
+                return False
+        else:
+            self.queue.put(item)
+        return True
+
+    def write_bytes(self, kind, path, data):
+        return self.submit(kind, _write_bytes, path, data)
+
+    def write_text(self, kind, path, text):
+        return self.submit(kind, _write_text, path, text)
+
+    def write_json(self, kind, path, obj):
+        return self.submit(kind, _write_json, path, obj)
+
+    def write_image(self, kind, path, img):
+        """在写入线程中编码图像（调用方不要再修改img）"""
+        return self.submit(kind, _write_image, path, img)
+
+    # ---------- 后台线程 ----------
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                kind, fn, args = item
+                try:
+                    fn(*args)
+                    with self.lock:
+                        self.written[kind] += 1
+                except Exception:
+                    with self.lock:
+                        self.failed[kind] += 1
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """等待队列中的所有产物写完"""
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def stats(self):
+        """各类产物的写入/丢弃/失败计数"""
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'written': dict(self.written),
+                'dropped': dict(self.dropped),
+                'failed': dict(self.failed),
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"🗂️  Artifacts: queued={s['queued']}, written={s['written']}, "
+              f"dropped={s['dropped']}, failed={s['failed']}")
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _write_json(path, obj):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2, ensure_ascii=False)
+
+
+def _write_image(path, img):
+    if not cv2.imwrite(str(path), img):
+        raise IOError(f"cv2.imwrite failed: {path}")
@@ -0,0 +1,77 @@
+"""
+Stage 2 / Stage 5 异步执行路径 - asyncio + 有界并发
+Asyncio Execution Path for Stage 2 and Stage 5 Model Calls
+
+原来 process_abnormal_log / process_mismatch_log 用 df.iterrows() 逐行阻塞调用模型，
+GPU 大部分时间在等下一次请求；MAX_WORKERS_7B 定义了却没有被使用。
+
+AsyncModelClient 是共享推理客户端（cached_chat → ollama_router）的协程接口：
+1. 每次调用在专用线程池中执行，推理缓存、重试、时限、熔断全部照常生效
+2. asyncio.Semaphore 限制在途调用数（按模型取 MAX_WORKERS_3B / MAX_WORKERS_7B）
+3. 调用方用 asyncio.gather 并发派发，结果按原始行号写回，输出CSV行顺序不变
+
+用法 Usage:
+    async def main(client):
+        text = await client.chat(model=..., messages=..., options=...)
+        value = await client.run(stage.run_7b_inference, image_path, prompt, roi_type)
+    run_with_client(main, model=OLLAMA_MODEL_7B)
+"""
+
+import asyncio
+import functools
+import concurrent.futures
+
+from config_pipeline import *
+from inference_cache import cached_chat
+
+
+def workers_for_model(model):
+    """模型对应的并发上限"""
+    return MAX_WORKERS_3B if model == OLLAMA_MODEL_3B else MAX_WORKERS_7B
+
+
+class AsyncModelClient:
+    """协程接口的模型客户端（在事件循环内创建）"""
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="async-infer")
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, fn, *args, **kwargs):
+        """在客户端线程池中执行一次阻塞的模型调用（可以是带清理逻辑的阶段方法）"""
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(
+                    self.executor, functools.partial(fn, *args, **kwargs))
+            except Exception:
+                self.failed += 1
+                raise
+            self.completed += 1
+            return result
+
+    async def chat(self, **kwargs):
+        """与 cached_chat 参数相同的协程版本"""
+        return await self.run(cached_chat, **kwargs)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def run_with_client(main, model=OLLAMA_MODEL_7B, max_concurrency=None):
+    """
+    创建事件循环和客户端，执行 main(client) 并返回其结果
+    max_concurrency: None = 按模型取 MAX_WORKERS_3B / MAX_WORKERS_7B
+    """
+    async def runner():
+        client = AsyncModelClient(max_concurrency or workers_for_model(model))
+        try:
+            return await main(client)
+        finally:
+            client.close()
+
+    return asyncio.run(runner())
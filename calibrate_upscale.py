@@ -0,0 +1,293 @@
+"""
+按ROI校准上采样倍数和边距
+Per-ROI Upscale/Pad Calibration for Stage 0
+
+roi.json 中的框从 4x1 到 50x27 像素不等，却统一使用 UPSCALE = 2.0 / ROI_PAD = 2。
+图像越大，视觉token越多，模型延迟越高。
+
+本工具对每个ROI扫描 CALIBRATION_SCALES × CALIBRATION_PADS：
+1. 标注样本：人工标注CSV（--labels / CALIBRATION_LABELS）或 Stage 6 最终数据集（*_Final.csv）
+   中该ROI的非NA值 + SOURCE_DIR 中的原始截图
+2. 用与 Stage 0 相同的prompt和清理逻辑调用3B模型（不经过推理缓存，延迟是真实的）
+3. 记录每种组合的准确率和平均延迟
+4. 选择准确率不低于 max(最佳 - 容差, 当前全局设置) 的组合中延迟最低的一个
+
+标签偏差：*_Final.csv 本身是在 UPSCALE = 2.0 / ROI_PAD = 2 下读出来的，与当前设置读错的地方
+"一致"，扫描结果会偏向当前设置。有条件时用人工核对过的样本（格式与 *_Final.csv 相同：
+Filename 列 + ROI_<id> 列，空白/NA 的单元格忽略）。
+
+结果写入 ROI_UPSCALE_TABLE（roi_upscale_table.json），Stage 0 和恢复裁剪工具自动使用；
+完整扫描结果另存为同目录下的 *_sweep.csv。
+
+用法 Usage:
+    python calibrate_upscale.py
+    python calibrate_upscale.py --rois 12 13 23 --samples 30
+    python calibrate_upscale.py --labels hand_labels.csv
+    python calibrate_upscale.py --scales 1 1.5 2 --pads 0 2 --dry-run
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import pandas as pd
+
+from config_pipeline import *
+from ollama_router import get_router
+from roi_table import RoiTable
+from output_schema import value_request, parse_value
+from stage0_prompts import STAGE0_PROMPTS, clean_output, load_rois
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+
+# ================= 标注样本 =================
+def load_labelled_frames(final_dir, roi_ids):
+    """
+    从 *_Final.csv 读取 {filename: {roi_id: label}}（只保留非NA的值）
+    同一帧在多个CSV中出现时合并
+    """
+    frames = {}
+    for csv_path in sorted(Path(final_dir).glob("*_Final.csv")):
+        read_label_csv(csv_path, roi_ids, frames)
+    return frames
+
+
+def read_label_csv(csv_path, roi_ids, frames=None):
+    """读取一个 Filename + ROI_<id> 格式的标签CSV，合并进 frames 并返回"""
+    frames = {} if frames is None else frames
+    df = pd.read_csv(csv_path, dtype=str)
+    if 'Filename' not in df.columns:
+        return frames
+    cols = [f"ROI_{r}" for r in roi_ids if f"ROI_{r}" in df.columns]
+    for row in df[['Filename'] + cols].itertuples(index=False):
+        labels = frames.setdefault(row[0], {})
+        for col, value in zip(cols, row[1:]):
+            if isinstance(value, str) and value.strip() and value.strip().upper() not in ('NA', 'NAN'):
+                labels[col[4:]] = value.strip()
+    return frames
+
+
+def index_source_images(source_dir):
+    """文件名 -> 原始截图路径（只扫描一次）"""
+    return {p.name: p for p in Path(source_dir).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES}
+
+
+def sample_frames(frames, sources, roi_ids, per_roi, seed):
+    """
+    为每个ROI随机抽 per_roi 个有标注且能找到原图的帧
+    返回 {filename: {roi_id: label}}（只含被抽中的ROI）
+    """
+    rng = random.Random(seed)
+    names = sorted(f for f in frames if f in sources)
+    picked = {}
+    for roi_id in roi_ids:
+        candidates = [f for f in names if roi_id in frames[f]]
+        for f in rng.sample(candidates, min(per_roi, len(candidates))):
+            picked.setdefault(f, {})[roi_id] = frames[f][roi_id]
+    return picked
+
+
+def same_value(pred, label, roi_type):
+    """数值类型按数值比较（"1.250" == "1.25"），其余忽略大小写和空格"""
+    if roi_type in ('INTEGER', 'FLOAT'):
+        try:
+            return abs(float(pred) - float(label)) < 1e-9
+        except (TypeError, ValueError):
+            return False
+    return str(pred).replace(' ', '').upper() == str(label).replace(' ', '').upper()
+
+
+# ================= 扫描 =================
+def ask_model(crop, roi_id):
+    """与 Stage 0 ask_ollama_simple 相同的调用（不经过缓存），返回 (清理后的读数, 秒)"""
+    roi_type = get_roi_type(roi_id, default=None)
+    ok, buf = cv2.imencode(".jpg", crop)
+    if not ok:
+        return "NA", 0.0
+    prompt, output_format = value_request(
+        STAGE0_PROMPTS.get(roi_type, "Read the text. Output only the value."), roi_type)
+    start = time.perf_counter()
+    response = get_router().chat(
+        model=OLLAMA_MODEL_3B,
+        messages=[{
+            'role': 'user',
+            'content': prompt,
+            'images': [buf.tobytes()]
+        }],
+        options={
+            'temperature': 0.0,
+            'num_predict': 30
+        },
+        **output_format
+    )
+    elapsed = time.perf_counter() - start
+    raw = parse_value(response['message']['content'].strip())
+    return clean_output(raw, roi_type), elapsed
+
+
+def sweep(rois, samples, sources, scales, pads):
+    """对每个 (scale, pad) 组合裁剪全部样本并调用模型，返回扫描记录列表"""
+    roi_ids = [name for name, *_ in rois]
+    stats = {}  # (roi, scale, pad) -> [正确数, 样本数, 总延迟, 像素数]
+    tables = {(s, p): RoiTable(rois, pad=p, upscale=s) for s in scales for p in pads}
+
+    total = len(samples)
+    for i, (filename, labels) in enumerate(sorted(samples.items()), 1):
+        img = cv2.imread(str(sources[filename]))
+        if img is None:
+            print(f"  ⚠️  Cannot read {filename}")
+            continue
+        print(f"[{i}/{total}] {filename}: {len(labels)} ROIs", flush=True)
+        for (scale, pad), table in tables.items():
+            crops = table.crop_all(img, skip=set(roi_ids) - set(labels))
+            for roi_id, label in labels.items():
+                crop = crops.get(roi_id)
+                if crop is None:
+                    continue
+                try:
+                    pred, elapsed = ask_model(crop, roi_id)
+                except Exception as e:
+                    print(f"  ❌ ROI_{roi_id} x{scale} pad {pad}: {e}")
+                    continue
+                entry = stats.setdefault((roi_id, scale, pad), [0, 0, 0.0, 0])
+                entry[0] += same_value(pred, label, get_roi_type(roi_id))
+                entry[1] += 1
+                entry[2] += elapsed
+                entry[3] += crop.shape[0] * crop.shape[1]
+
+    records = []
+    for (roi_id, scale, pad), (correct, n, latency, pixels) in stats.items():
+        records.append({
+            'roi': roi_id, 'upscale': scale, 'pad': pad, 'samples': n,
+            'accuracy': round(correct / n, 4),
+            'latency_ms': round(latency / n * 1000, 1),
+            'pixels': round(pixels / n),
+        })
+    return records
+
+
+def choose(records, tolerance, min_samples):
+    """
+    每个ROI：准确率 >= max(最佳 - 容差, 全局设置的准确率) 的组合中选延迟最低的（再比像素数）
+    样本不足的ROI不写入（继续使用全局设置）
+    """
+    by_roi = {}
+    for r in records:
+        by_roi.setdefault(r['roi'], []).append(r)
+
+    chosen = {}
+    for roi_id, rows in by_roi.items():
+        rows = [r for r in rows if r['samples'] >= min_samples]
+        if not rows:
+            continue
+        best = max(r['accuracy'] for r in rows)
+        baseline = next((r for r in rows if r['upscale'] == UPSCALE and r['pad'] == ROI_PAD), None)
+        floor = best - tolerance
+        if baseline is not None:
+            floor = max(floor, baseline['accuracy'])
+        pick = min((r for r in rows if r['accuracy'] >= floor),
+                   key=lambda r: (r['latency_ms'], r['pixels']))
+        chosen[roi_id] = {
+            'upscale': pick['upscale'], 'pad': pick['pad'],
+            'accuracy': pick['accuracy'], 'latency_ms': pick['latency_ms'],
+            'samples': pick['samples'],
+        }
+        if baseline is not None:
+            chosen[roi_id]['baseline_accuracy'] = baseline['accuracy']
+            chosen[roi_id]['baseline_latency_ms'] = baseline['latency_ms']
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate per-ROI upscale and pad for Stage 0')
+    parser.add_argument('--rois', nargs='+', metavar='ID', help='ROI ids to calibrate (default: all in roi.json)')
+    parser.add_argument('--samples', type=int, default=CALIBRATION_SAMPLES_PER_ROI, help='Labelled samples per ROI')
+    parser.add_argument('--scales', type=float, nargs='+', default=CALIBRATION_SCALES)
+    parser.add_argument('--pads', type=int, nargs='+', default=CALIBRATION_PADS)
+    parser.add_argument('--tolerance', type=float, default=CALIBRATION_ACCURACY_TOLERANCE,
+                        help='Accuracy allowed below the best setting in exchange for lower latency')
+    parser.add_argument('--min-samples', type=int, default=5, help='Skip ROIs with fewer labelled samples')
+    parser.add_argument('--final-dir', type=Path, default=STAGE_6_FINAL)
+    parser.add_argument('--labels', type=Path, nargs='+', default=CALIBRATION_LABELS,
+                        help='Hand-checked label CSV(s) (Filename + ROI_<id> columns) instead of *_Final.csv')
+    parser.add_argument('--source-dir', type=Path, default=SOURCE_DIR)
+    parser.add_argument('--output', type=Path, default=ROI_UPSCALE_TABLE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dry-run', action='store_true', help='Print the chosen table without writing it')
+    args = parser.parse_args()
+
+    rois = load_rois(ROI_JSON)
+    if args.rois:
+        wanted = {r.replace('ROI_', '') for r in args.rois}
+        rois = [r for r in rois if r[0] in wanted]
+    if not rois:
+        print("❌ No ROIs to calibrate (roi.json missing or --rois not found)")
+        return 1
+    roi_ids = [name for name, *_ in rois]
+
+    # 扫描中必须包含全局设置，作为准确率下限
+    scales = sorted(set(args.scales) | {UPSCALE})
+    pads = sorted(set(args.pads) | {ROI_PAD})
+
+    if args.labels:
+        labels = [args.labels] if isinstance(args.labels, (str, Path)) else args.labels
+        print(f"📚 Loading hand-checked labels from {', '.join(str(p) for p in labels)}")
+        frames = {}
+        for csv_path in labels:
+            read_label_csv(csv_path, roi_ids, frames)
+    else:
+        print(f"📚 Loading labels from {args.final_dir}")
+        print(f"   ⚠️  Stage 6 labels were read at x{UPSCALE} pad {ROI_PAD}: the sweep is biased "
+              f"towards that setting (use --labels for hand-checked samples)")
+        frames = load_labelled_frames(args.final_dir, roi_ids)
+    sources = index_source_images(args.source_dir)
+    samples = sample_frames(frames, sources, roi_ids, args.samples, args.seed)
+    if not samples:
+        print("❌ No labelled frames with source images found")
+        return 1
+    calls = sum(len(v) for v in samples.values()) * len(scales) * len(pads)
+    print(f"🔬 {len(roi_ids)} ROIs, {len(samples)} frames, scales={scales}, pads={pads} "
+          f"-> {calls} model calls")
+
+    records = sweep(rois, samples, sources, scales, pads)
+    chosen = choose(records, args.tolerance, args.min_samples)
+
+    print("\n" + "=" * 60)
+    for roi_id in roi_ids:
+        c = chosen.get(roi_id)
+        if c is None:
+            print(f"  ROI_{roi_id}: not enough samples - keeps x{UPSCALE} pad {ROI_PAD}")
+            continue
+        base = (f" (baseline {c['baseline_accuracy']:.2f} / {c['baseline_latency_ms']:.0f}ms)"
+                if 'baseline_accuracy' in c else "")
+        print(f"  ROI_{roi_id}: x{c['upscale']} pad {c['pad']} -> "
+              f"acc {c['accuracy']:.2f}, {c['latency_ms']:.0f}ms{base}")
+    print("=" * 60)
+
+    if args.dry_run:
+        return 0
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            'generated': datetime.now().isoformat(timespec='seconds'),
+            'model': OLLAMA_MODEL_3B,
+            'default': {'upscale': UPSCALE, 'pad': ROI_PAD},
+            'labels': [str(p) for p in labels] if args.labels else str(args.final_dir),
+            'rois': chosen,
+        }, f, indent=2)
+    sweep_csv = args.output.with_name(args.output.stem + "_sweep.csv")
+    order = {roi_id: i for i, roi_id in enumerate(roi_ids)}
+    records.sort(key=lambda r: (order[r['roi']], r['upscale'], r['pad']))
+    pd.DataFrame(records).to_csv(sweep_csv, index=False)
+    print(f"✅ Wrote {len(chosen)} ROIs to {args.output} (sweep: {sweep_csv})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
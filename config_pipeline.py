@@ -2,6 +2,7 @@
 数据处理管道的统一配置文件
 Unified Configuration for Data Processing Pipeline
 """
+import json
 from pathlib import Path
 
 # ================= 目录配置 / Directory Configuration =================
@@ -59,19 +60,179 @@ MAX_WORKERS_3B = 16  # 4 GPUs * 4 workers = 16 (保守配置)
 MAX_WORKERS_7B = 12   # 4 GPUs * 2 workers = 8 (保守配置)
                      # 可以尝试 12 如果显存充足
 
-# 性能调优建议：
+# 性能调优建议（OLLAMA_ADAPTIVE_CONCURRENCY = True 时在途请求数自动调整，这里只是上限）：
 # - 监控GPU使用率：nvidia-smi -l 1
 # - 如果GPU利用率 < 80%，可以增加workers
 # - 如果出现OOM错误，减少workers
 # - 3B模型处理速度快，可以设置更多workers
 # - 7B模型显存需求大，workers数量要保守
 
+# Stage 2 / Stage 5 / Stage 6格式修复 异步执行（async_inference.py）：按调用的模型取 MAX_WORKERS_3B / MAX_WORKERS_7B 并发
+# False = 旧的逐行阻塞调用
+ASYNC_CORRECTION_ENABLED = True
+STAGE6_REPAIR_DEADLINE = 300.0   # Stage 6 每个格式修复调用的时限（秒，含重试）；
+                                 # 大于 OLLAMA_REQUEST_TIMEOUT，第一次请求很慢时仍留有重试的时间
+
+# Stage 2 动态median上下文（每行修正后 median = median×0.9 + 修正值×0.1）：
+#   'sequential' = 逐行更新（原语义；各ROI之间仍可并发）
+#   'block'      = 每个ROI按 STAGE2_MEDIAN_BLOCK 行分块，块内用块开始时的median快照并发修正，块结束后按行顺序更新
+#   'static'     = 只用清理后CSV算出的median，不更新，全部行并发
+# 块的划分只取决于行顺序，结果与并发数无关
+# 默认 'sequential'（与原来的逐行循环结果相同）；'block' / 'static' 需要时手动开启
+STAGE2_MEDIAN_MODE = 'sequential'
+STAGE2_MEDIAN_BLOCK = 16
+
+# ================= Ollama端点配置 / Ollama Endpoint Configuration =================
+# 客户端路由器（ollama_router.py）在这些端点之间按最少在途请求分配调用
+# 每块GPU一个实例的示例（各自设置 CUDA_VISIBLE_DEVICES 和 OLLAMA_HOST 启动）：
+# OLLAMA_ENDPOINTS = [
+#     {"host": "http://127.0.0.1:11434", "max_concurrency": 4},
+#     {"host": "http://127.0.0.1:11435", "max_concurrency": 4},
+#     {"host": "http://127.0.0.1:11436", "max_concurrency": 4},
+#     {"host": "http://127.0.0.1:11437", "max_concurrency": 4},
+# ]
+OLLAMA_ENDPOINTS = [
+    {"host": "http://127.0.0.1:11434", "max_concurrency": MAX_WORKERS_3B},
+]
+OLLAMA_REQUEST_TIMEOUT = 120.0   # 单次请求超时（秒）
+OLLAMA_HEALTH_INTERVAL = 10.0    # 健康检查间隔（秒）；0 = 关闭后台检查
+OLLAMA_HEALTH_TIMEOUT = 2.0      # 健康检查请求超时（秒）
+OLLAMA_CALL_DEADLINE = 600.0     # 单次调用总时限（秒，含排队、重试和退避）；None = 不限
+OLLAMA_MAX_RETRIES = 4           # 连接失败/超时/5xx/429 的最多重试次数（4xx不重试）
+OLLAMA_RETRY_BACKOFF = 0.5       # 退避基数（秒）：第n次重试等待 random(0, 基数 × 2^(n-1))
+OLLAMA_RETRY_BACKOFF_MAX = 10.0  # 单次退避上限（秒）
+OLLAMA_BREAKER_FAILURES = 5      # 端点连续失败多少次后熔断
+OLLAMA_BREAKER_COOLDOWN = 30.0   # 熔断后多少秒放行一个试探请求
+OLLAMA_KEEP_ALIVE = "30m"        # 请求未指定 keep_alive 时使用（模型常驻显存时长）；None = 服务端默认
+
+# 自适应并发（adaptive_limiter.py）：每个模型一个AIMD在途上限，p95延迟尖峰/超时/5xx时×0.7，延迟平稳时+1恢复
+# MAX_WORKERS_3B / MAX_WORKERS_7B 仍是调用方线程数（上限的上限），实际在途请求数由控制器决定
+OLLAMA_ADAPTIVE_CONCURRENCY = True
+OLLAMA_AIMD_INITIAL = None       # 初始上限；None = 从最大值开始（与关闭控制器时的并发相同），只在延迟/错误时回退
+OLLAMA_AIMD_MIN = 1
+OLLAMA_AIMD_MAX = None           # None = 所有端点 max_concurrency 之和
+OLLAMA_AIMD_WINDOW = 20          # 每完成多少次请求评估一次p95
+OLLAMA_AIMD_LATENCY_TOLERANCE = 1.5  # p95 <= 基线 × 该值视为平稳
+OLLAMA_AIMD_BACKOFF = 0.7        # 乘性减系数
+OLLAMA_AIMD_METRICS_LOG = OUTPUT_BASE / "concurrency_limits.csv"  # 每次调整追加一行；None = 不写
+
+# 推理结果缓存（inference_cache.py）：键 = (图像内容哈希, 模型, prompt哈希, options)，所有阶段共享
+INFERENCE_CACHE_ENABLED = True
+INFERENCE_CACHE_PATH = OUTPUT_BASE / "inference_cache.sqlite3"
+INFERENCE_CACHE_MAX_ENTRIES = 2_000_000   # LRU淘汰上限（条目数）；0 = 不限制
+INFERENCE_CACHE_TOUCH_INTERVAL = 3600.0   # 命中时最多每隔多少秒更新一次LRU时间戳
+
+# 结构化输出（output_schema.py）：Stage 0/2/5 调用带按ROI类型生成的JSON schema，服务端约束解码
+# 需要 Ollama >= 0.5；旧版本忽略schema时自动回退到原有的文本清理
+STRUCTURED_OUTPUT_ENABLED = True
+# STATUS 的枚举约束会把数字误读强行归为 OK/NG：按此比例抽样再做一次不带schema的调用，统计不一致（0 = 关闭）
+STRUCTURED_STATUS_AUDIT_RATE = 0.02
+
+# 本地替身模型服务（mock_ollama_server.py）：录制真实服务的输出，在无GPU机器上回放，用于吞吐基准和回归测试
+# 使用时把 OLLAMA_ENDPOINTS 指向 http://127.0.0.1:MOCK_OLLAMA_PORT
+MOCK_OLLAMA_PORT = 11500
+MOCK_OLLAMA_RECORDINGS = OUTPUT_BASE / "mock_ollama_recordings.jsonl"
+MOCK_OLLAMA_LATENCY = 'recorded'     # recorded / fixed / uniform / lognormal
+MOCK_OLLAMA_LATENCY_MS = 300.0       # fixed值 / uniform均值 / lognormal中位数（毫秒）
+MOCK_OLLAMA_LATENCY_JITTER = 0.3     # uniform相对半宽 / lognormal对数标准差
+
+# ================= Stage 0 流水线配置 / Stage 0 Pipeline Configuration =================
+# 解码 → 裁剪 → 推理 → 写入 四个阶段由有界队列连接，
+# 第N帧和第N+1帧的ROI可以同时在GPU上推理
+STAGE0_PIPELINED = True          # False = 单帧模式（逐张处理，同样经过接收队列去重/就绪检查/背压）
+STAGE0_DECODE_WORKERS = 2        # 图像解码线程数
+STAGE0_DECODE_PROCESSES = 0      # > 0 = 解码+裁剪+上采样在这么多个子进程中完成（共享内存传回裁剪，不受GIL限制）
+STAGE0_MAX_INFLIGHT_FRAMES = 4   # 已解码但尚未写入CSV的最大帧数
+
+# watchdog事件接收队列 / Ingest Queue (dedupe + readiness + backpressure)
+INGEST_MAX_BACKLOG = 256         # 等待就绪+等待解码的路径上限（满时watchdog回调阻塞）
+INGEST_POLL_INTERVAL = 0.5       # 文件大小检查间隔（秒）
+INGEST_STABLE_CHECKS = 2         # 文件大小连续不变的次数，达到后视为写完
+INGEST_READY_TIMEOUT = 60.0      # 超过此时间仍不稳定则放弃该文件（秒）
+INGEST_SETTLE_SECONDS = 5.0      # 修改时间早于此秒数的文件直接视为已写完（批量回填）
+INGEST_RECENT_LIMIT = 4096       # 已写完的路径最多记住这么多个（拦截迟到的重复事件），超出按LRU淘汰
+
+# 进程级共享推理线程池（批量回填和watchdog回调共用）
+INFERENCE_POOL_WORKERS = MAX_WORKERS_3B           # GPU推理线程数
+INFERENCE_POOL_MAX_PENDING = MAX_WORKERS_3B * 4   # 排队+运行中的ROI上限（满时提交阻塞）
+
+# 裁剪交给模型的方式 / Crop hand-off to the model
+STAGE0_INMEMORY_CROPS = True     # True = 裁剪在内存中编码一次，字节直接发给模型（不经过磁盘）
+
+# 调试产物后台写入 / Asynchronous Debug Artifacts
+# 每类产物: 'off' = 不写, 'sampled' = 每 ARTIFACT_SAMPLE_EVERY 帧抽样写, 'all' = 每帧都写
+# 默认全部 'all'（与原来相同）；需要提速时可选择把 debug_map 改为 'sampled' 或 'off'
+ARTIFACT_MODES = {
+    'debug_map': 'all',         # _DEBUG_MAP.jpg（整帧副本+ROI框，最贵；可选 'sampled'）
+    'roi_crop': 'all',          # ROI_x.jpg（Stage 1-6 人工检查和7B复核需要，建议保持 all）
+    'roi_text': 'all',          # ROI_x.txt
+    'results_json': 'all',      # results.json
+}
+ARTIFACT_SAMPLE_EVERY = 50       # sampled 模式的抽样间隔（按帧）
+ARTIFACT_QUEUE_SIZE = 4096       # 后台写入队列上限
+ARTIFACT_QUEUE_POLICY = 'block'  # 队列满时: 'block' = 等待（不丢产物）, 'drop' = 丢弃并计数（不拖慢帧）
+ARTIFACT_WRITER_THREADS = 2
+
+# CSV结果缓冲写入 / Buffered CSV Sink
+CSV_SINK_FLUSH_ROWS = 64         # 缓冲行数达到此值时刷盘（4个CSV组 → 约16帧）
+CSV_SINK_FLUSH_INTERVAL = 2.0    # 最长刷盘间隔（秒），0 = 只按行数刷盘
+CSV_SINK_FSYNC = False           # 刷盘后是否 os.fsync（网络共享盘上较慢）
+CSV_SINK_MAX_OPEN_FILES = 64     # 同时保持打开的CSV句柄上限
+
+# 已处理帧清单（重启续跑）：SQLite，记录每帧/每个ROI的完成状态；None = 关闭
+STAGE0_MANIFEST = STAGE_1_OCR / "stage0_manifest.sqlite3"
+STAGE0_MANIFEST_SEAL_AGE = 5.0     # 目录 mtime 早于此秒数且没有待处理帧时记为已完成，重启扫描时整个跳过
+STAGE0_WRITE_FAILED_FRAMES = False  # 有ROI推理失败的帧：False = 暂不写CSV，下次启动只重试失败的ROI
+
+# ROI像素差分短路：与上一帧相同的ROI复用上一次读数，不调用模型（roi_reuse.py）
+ROI_REUSE_ENABLED = True
+ROI_REUSE_PIXEL_THRESHOLD = 0    # 单像素最大绝对差阈值（0-255）；0 = 只复用逐像素相同的裁剪
+                                 # 屏幕截图是无损PNG，静止画面差分为0；不用平均差：小数点移动、
+                                 # 单个低对比度数字变化在整个裁剪上平均后远小于1，会被误判为相同
+ROI_REUSE_MAX_CONSECUTIVE = 200  # 连续复用次数上限，达到后强制重新推理一次；0 = 不限制
+FRAME_DEDUP_ENABLED = True       # 整帧去重：ROI并集像素与上一帧完全相同时沿用上一帧全部读数
+FRAME_DEDUP_MAX_CONSECUTIVE = 200  # 连续沿用次数上限，达到后强制重新处理一帧；0 = 不限制
+STAGE0_SOURCE_LOG = True         # 写 CSV_Results/Stage0_Value_Source_Log.csv（每个ROI读数的来源）
+
+# 推理方式（stitched_inference.py）：
+#   'per_roi'  = 每个ROI一次模型调用（默认）
+#   'stitched' = 每个CSV组拼成一张带ID标签的图，一次调用返回JSON；缺失/格式不对的ID回退到单ROI调用
+STAGE0_INFERENCE_MODE = 'per_roi'
+STAGE0_STITCH_COLS = 5           # 拼图列数（与 qwenocrbatch.py 相同）
+STAGE0_STITCH_MAX_ROIS = 24      # 单张拼图最多ROI数，超过则拆分
+
+# STATUS ROI 颜色分类快速通道（status_classifier.py）：绿色=OK / 红色=NG，高置信度时不调用模型
+STATUS_CLASSIFIER_ENABLED = True
+STATUS_CLASSIFIER_MIN_CONFIDENCE = 0.9   # 默认置信度阈值（0-1）
+STATUS_CLASSIFIER_ROI_THRESHOLDS = {}    # 按ROI覆盖阈值，例如 {'17': 0.97}；设为 > 1 即对该ROI关闭
+STATUS_CLASSIFIER_MIN_COVERAGE = 0.01    # 有色像素占比下限（低于此视为没有彩色文字）
+STATUS_CLASSIFIER_MAX_COVERAGE = 0.5     # 有色像素占比上限（高于此是色块/背景，不是文字）
+STATUS_CLASSIFIER_MAX_COMPONENTS = 8     # 主色连通域数量上限（"OK"/"NG" 通常 2-4 个）
+
+# 分级OCR（ocr_cascade.py）：INTEGER/FLOAT/TIME ROI 先用CPU上的RapidOCR，
+# 读数通过 DataValidator 校验且置信度足够时不调用模型；未安装 rapidocr_onnxruntime 时自动关闭
+CASCADE_ENABLED = True
+CASCADE_TYPES = ['INTEGER', 'FLOAT', 'TIME']
+CASCADE_MIN_CONFIDENCE = 0.95    # 默认识别置信度阈值（0-1）
+CASCADE_ROI_THRESHOLDS = {}      # 按ROI覆盖阈值，例如 {'23': 0.98}；设为 > 1 即对该ROI关闭
+CASCADE_ENGINES = 4              # RapidOCR 引擎实例数（推理线程共享）
+
 # ================= ROI配置 / ROI Configuration =================
 ROI_JSON = Path("roi.json")
 ROI_PAD = 2
 UPSCALE = 2.0
 DARKNESS_THRESHOLD = 15
 
+# 按ROI的上采样倍数/边距表（calibrate_upscale.py 生成），Stage 0 和恢复裁剪工具自动使用
+# 表中没有的ROI（或文件不存在）使用上面的 UPSCALE / ROI_PAD
+ROI_UPSCALE_TABLE = Path("roi_upscale_table.json")
+CALIBRATION_SCALES = [1.0, 1.5, 2.0, 3.0]   # 校准时扫描的上采样倍数
+CALIBRATION_PADS = [0, 2, 4]                # 校准时扫描的边距
+CALIBRATION_SAMPLES_PER_ROI = 20            # 每个ROI的标注样本数
+CALIBRATION_LABELS = None                   # 人工核对的标签CSV（Filename + ROI_<id> 列）；None = 用 Stage 6 最终数据集
+                                            # （后者在当前 UPSCALE/ROI_PAD 下读出，会偏向当前设置）
+CALIBRATION_ACCURACY_TOLERANCE = 0.0        # 允许比最佳准确率低多少来换取更低延迟
+
 # ROI数据类型映射 / ROI Data Type Mapping
 ROI_CONFIGS = [
     {
@@ -412,9 +573,43 @@ def get_similarity_threshold(csv_name: str) -> float:
             return SIMILARITY_THRESHOLDS[key]
     return DEFAULT_SIMILARITY_THRESHOLD
 
-def get_roi_type(roi_id: str) -> str:
-    """获取ROI的数据类型"""
-    return ROI_TYPE_MAP.get(roi_id, 'STATUS')
+def get_roi_type(roi_id: str, default='STATUS') -> str:
+    """
+    获取ROI的数据类型（接受 "ROI_12" 或 "12"）
+    default: ROI_CONFIGS 中没有配置的ROI（例如机器时间戳51、ROI 0）返回的值
+    注意：早期版本只接受 "ROI_12"，传入 "12" 的调用（Stage 0 等）全部得到 STATUS，见 PIPELINE_README 更新日志
+    """
+    roi_id = str(roi_id)
+    if roi_id in ROI_TYPE_MAP:
+        return ROI_TYPE_MAP[roi_id]
+    return ROI_TYPE_MAP.get(f"ROI_{roi_id}", default)
+
+_roi_upscale_table = None
+
+def load_roi_upscale_table() -> dict:
+    """读取按ROI的上采样/边距表 {roi_id: {'upscale': ..., 'pad': ...}}；文件不存在时为空"""
+    global _roi_upscale_table
+    if _roi_upscale_table is None:
+        table = {}
+        try:
+            with open(ROI_UPSCALE_TABLE, "r", encoding="utf-8") as f:
+                table = json.load(f).get('rois', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Cannot read {ROI_UPSCALE_TABLE}: {e} - using global UPSCALE/ROI_PAD")
+        _roi_upscale_table = {str(k).replace('ROI_', ''): v for k, v in table.items()}
+    return _roi_upscale_table
+
+def get_roi_upscale(roi_id: str, default: float = None) -> float:
+    """ROI的上采样倍数（接受 "ROI_12" 或 "12"）；表中没有时用 default（默认 UPSCALE）"""
+    entry = load_roi_upscale_table().get(str(roi_id).replace('ROI_', ''), {})
+    return float(entry.get('upscale', UPSCALE if default is None else default))
+
+def get_roi_pad(roi_id: str, default: int = None) -> int:
+    """ROI的裁剪边距（接受 "ROI_12" 或 "12"）；表中没有时用 default（默认 ROI_PAD）"""
+    entry = load_roi_upscale_table().get(str(roi_id).replace('ROI_', ''), {})
+    return int(entry.get('pad', ROI_PAD if default is None else default))
 
 def get_field_hint(roi_id: str) -> str:
     """获取字段特定的提示信息"""
@@ -0,0 +1,151 @@
+"""
+缓冲式CSV结果写入器
+Buffered CSV Result Sink
+
+每个CSV文件保持一个打开的句柄，行先进入缓冲区，
+按行数或时间间隔批量刷盘（可选 fsync）。
+使用独立的锁，不和控制台打印共用 print_lock。
+
+write_row 可附带一个 token：该行真正写入文件后，token 会传给 on_flush 回调
+（用于“CSV已刷盘”之后再在清单中标记帧完成）。
+"""
+
+import os
+import csv
+import time
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+from config_pipeline import *
+
+
+class BufferedCSVSink:
+    """按CSV文件缓冲追加行"""
+
+    def __init__(self, flush_rows=CSV_SINK_FLUSH_ROWS,
+                 flush_interval=CSV_SINK_FLUSH_INTERVAL,
+                 fsync=CSV_SINK_FSYNC, max_open_files=CSV_SINK_MAX_OPEN_FILES,
+                 on_flush=None):
+        self.flush_rows = max(1, int(flush_rows))
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_open_files = max(1, int(max_open_files))
+        self.on_flush = on_flush  # 回调(tokens)：这些token对应的行已写入文件
+
+        self.lock = threading.Lock()
+        self.handles = OrderedDict()  # path -> file（LRU顺序）
+        self.buffers = OrderedDict()  # path -> [row, ...]
+        self.pending_rows = 0
+        self.tokens = []              # 缓冲区中行附带的token
+        self.flushed_tokens = []      # 已刷盘、等待回调的token
+        self.rows_written = 0
+        self.flush_count = 0
+        self.closed = False
+
+        self.wakeup = threading.Event()
+        self.flusher = None
+        if flush_interval and flush_interval > 0:
+            self.flusher = threading.Thread(target=self._flush_loop, name="csv-sink-flusher", daemon=True)
+            self.flusher.start()
+
+    # ---------- 写入 ----------
+    def write_row(self, csv_path, header, row, token=None):
+        """追加一行；新文件（或空文件）首次打开时写表头"""
+        csv_path = Path(csv_path)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("CSV sink is closed")
+            self._open(csv_path, header)
+            self.buffers.setdefault(csv_path, []).append(row)
+            self.pending_rows += 1
+            if token is not None:
+                self.tokens.append(token)
+            if self.pending_rows >= self.flush_rows:
+                self._flush_locked()
+        self._notify()
+
+    def _open(self, csv_path, header):
+        f = self.handles.get(csv_path)
+        if f is not None:
+            self.handles.move_to_end(csv_path)
+            return f
+
+        # 超过句柄上限：先刷盘再关闭最久未用的文件
+        if len(self.handles) >= self.max_open_files:
+            self._flush_locked()
+            _, old = self.handles.popitem(last=False)
+            old.close()
+
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(csv_path, 'a', newline='', encoding='utf-8')
+        if f.tell() == 0 and header:
+            csv.writer(f).writerow(header)
+        self.handles[csv_path] = f
+        return f
+
+    # ---------- 刷盘 ----------
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+        self._notify()
+
+    def _notify(self):
+        """在锁外调用 on_flush（回调可能较慢，例如写SQLite）"""
+        if self.on_flush is None:
+            return
+        with self.lock:
+            tokens, self.flushed_tokens = self.flushed_tokens, []
+        if tokens:
+            self.on_flush(tokens)
+
+    def _flush_locked(self):
+        if not self.pending_rows:
+            return
+        for csv_path, rows in self.buffers.items():
+            if not rows:
+                continue
+            f = self.handles.get(csv_path)
+            if f is None:
+                f = self._open(csv_path, None)
+            csv.writer(f).writerows(rows)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.rows_written += len(rows)
+        self.buffers.clear()
+        self.pending_rows = 0
+        self.flushed_tokens.extend(self.tokens)
+        self.tokens = []
+        self.flush_count += 1
+
+    def _flush_loop(self):
+        while not self.wakeup.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"  ❌ CSV Write Error: {e}")
+
+    def close(self):
+        """刷盘并关闭所有句柄"""
+        self.wakeup.set()
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self._flush_locked()
+            finally:
+                for f in self.handles.values():
+                    f.close()
+                self.handles.clear()
+                self.closed = True
+        self._notify()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'open_files': len(self.handles),
+                'pending_rows': self.pending_rows,
+                'rows_written': self.rows_written,
+                'flushes': self.flush_count,
+            }
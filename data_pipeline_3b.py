@@ -22,15 +22,18 @@ import glob
 import shutil
 import re
 import cv2
-import ollama
 from pathlib import Path
 from datetime import datetime
+import asyncio
 import concurrent.futures
 import threading
 from collections import defaultdict
 
 # 导入配置
 from config_pipeline import *
+from inference_cache import cached_chat
+from output_schema import value_request, parse_value
+from async_inference import run_with_client
 
 print_lock = threading.Lock()
 
@@ -436,19 +439,21 @@ class Stage2_3BCorrection:
         """使用7B模型重新识别"""
         try:
             prompt = get_prompt(roi_id, 'correction', ocr_value, median_val)
-            roi_type = get_roi_type(roi_id)
+            roi_type = get_roi_type(roi_id, default=None)  # 未配置的ROI不加schema
+            prompt, output_format = value_request(prompt, roi_type)
             
-            response = ollama.chat(
+            response = cached_chat(
                 model=OLLAMA_MODEL_7B,  # Using 7B for better accuracy
                 messages=[{
                     'role': 'user',
                     'content': prompt,
                     'images': [str(image_path)]
                 }],
-                options={'temperature': 0.0, 'num_predict': 30}
+                options={'temperature': 0.0, 'num_predict': 30},
+                **output_format
             )
             
-            text = response['message']['content']
+            text = parse_value(response['message']['content'])
             
             # 使用增强的清理函数
             text = self.clean_model_output(text, roi_type)
@@ -525,6 +530,103 @@ class Stage2_3BCorrection:
                 return img_path
         return None
     
+    def correct_row(self, csv_base, idx, total, row, curr_median):
+        """
+        用给定的median上下文修正一行异常值
+        返回修正值（找不到图像时为 "Image Not Found"）
+        """
+        roi_id = row['ROI_ID']
+        
+        # 查找图像
+        img_path = self.find_crop_image(csv_base, row['Filename'], roi_id)
+        
+        if not img_path:
+            return "Image Not Found"
+        
+        # 3B推理
+        fixed_val = self.run_3b_inference(img_path, roi_id, curr_median, row['Value'])
+        
+        with print_lock:
+            print(f"  [{idx+1}/{total}] {roi_id}: {row['Value']} → {fixed_val} (Median: {curr_median})")
+        
+        return fixed_val
+    
+    @staticmethod
+    def update_running_median(roi_medians, roi_id, fixed_val):
+        """动态更新median（加权平均）"""
+        curr_median = roi_medians.get(roi_id, None)
+        try:
+            val_num = float(fixed_val)
+            if val_num > 0:
+                if curr_median:
+                    roi_medians[roi_id] = (curr_median * 0.9) + (val_num * 0.1)
+                else:
+                    roi_medians[roi_id] = val_num
+        except:
+            pass
+    
+    def median_blocks(self, df_bad, mode=STAGE2_MEDIAN_MODE, block_size=STAGE2_MEDIAN_BLOCK):
+        """
+        按ROI分组（保持原顺序）并切块，同一块内的行使用块开始时的median快照
+        - sequential: 每块1行，与原来逐行更新median完全相同
+        - block:      每块 block_size 行，块内并发，块结束后按行顺序更新median
+        - static:     整个ROI一块，只用清理后CSV算出的median，不更新
+        返回 {roi_id: [[(idx, row), ...], ...]}
+        """
+        if mode not in ('sequential', 'block', 'static'):
+            raise ValueError(f"Unknown STAGE2_MEDIAN_MODE: {mode}")
+        chains = defaultdict(list)
+        for idx, row in df_bad.iterrows():
+            chains[row['ROI_ID']].append((idx, row))
+        
+        blocks = {}
+        for roi_id, rows in chains.items():
+            size = {'sequential': 1, 'static': len(rows)}.get(mode, max(1, int(block_size)))
+            blocks[roi_id] = [rows[i:i + size] for i in range(0, len(rows), size)]
+        return blocks
+    
+    def correct_rows(self, df_bad, csv_base, roi_medians, mode=STAGE2_MEDIAN_MODE):
+        """
+        修正全部异常行，返回 {行号: 修正值}
+        块的划分只取决于行和 mode，与并发数无关，结果可复现
+        """
+        blocks = self.median_blocks(df_bad, mode)
+        update = mode != 'static'
+        total = len(df_bad)
+        results = {}
+        
+        def finish_block(roi_id, block):
+            if update:
+                for idx, _ in block:
+                    self.update_running_median(roi_medians, roi_id, results[idx])
+        
+        if not ASYNC_CORRECTION_ENABLED:
+            for roi_id, roi_blocks in blocks.items():
+                for block in roi_blocks:
+                    curr_median = roi_medians.get(roi_id, None)
+                    for idx, row in block:
+                        results[idx] = self.correct_row(csv_base, idx, total, row, curr_median)
+                    finish_block(roi_id, block)
+            return results
+        
+        # 异步：不同ROI并发；同一ROI的块依次执行，块内并发
+        async def correct_chain(client, roi_id, roi_blocks):
+            for block in roi_blocks:
+                curr_median = roi_medians.get(roi_id, None)
+                fixed = await asyncio.gather(*(
+                    client.run(self.correct_row, csv_base, idx, total, row, curr_median)
+                    for idx, row in block))
+                for (idx, _), fixed_val in zip(block, fixed):
+                    results[idx] = fixed_val
+                finish_block(roi_id, block)
+        
+        async def main(client):
+            await asyncio.gather(*(correct_chain(client, roi_id, roi_blocks)
+                                   for roi_id, roi_blocks in blocks.items()))
+        
+        run_with_client(main, model=OLLAMA_MODEL_7B)
+        return results
+    
     def process_abnormal_log(self, log_path, cleaned_csv_path):
         """处理异常日志"""
         filename = log_path.name
@@ -550,36 +652,9 @@ class Stage2_3BCorrection:
         
         df_bad['AI_3B_Corrected'] = ""
         
-        for idx, row in df_bad.iterrows():
-            roi_id = row['ROI_ID']
-            
-            # 查找图像
-            img_path = self.find_crop_image(csv_base, row['Filename'], roi_id)
-            
-            if not img_path:
-                df_bad.at[idx, 'AI_3B_Corrected'] = "Image Not Found"
-                continue
-            
-            # 获取median
-            curr_median = roi_medians.get(roi_id, None)
-            
-            # 3B推理
-            fixed_val = self.run_3b_inference(img_path, roi_id, curr_median, row['Value'])
-            
-            print(f"  [{idx+1}/{len(df_bad)}] {roi_id}: {row['Value']} → {fixed_val} (Median: {curr_median})")
-            
-            df_bad.at[idx, 'AI_3B_Corrected'] = fixed_val
-            
-            # 动态更新median（加权平均）
-            try:
-                val_num = float(fixed_val)
-                if val_num > 0:
-                    if curr_median:
-                        roi_medians[roi_id] = (curr_median * 0.9) + (val_num * 0.1)
-                    else:
-                        roi_medians[roi_id] = val_num
-            except:
-                pass
+        results = self.correct_rows(df_bad, csv_base, roi_medians)
+        for idx in df_bad.index:
+            df_bad.at[idx, 'AI_3B_Corrected'] = results[idx]
         
         # 保存
         out_name = filename.replace(".csv", "_AI_3B_Fixed.csv")
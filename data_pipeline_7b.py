@@ -22,13 +22,16 @@ import json
 import glob
 import shutil
 import re
-import ollama
 from pathlib import Path
 from datetime import datetime
+import asyncio
 import threading
 
 # 导入配置
 from config_pipeline import *
+from inference_cache import cached_chat
+from output_schema import value_request, parse_value
+from async_inference import run_with_client
 
 print_lock = threading.Lock()
 
@@ -369,38 +372,43 @@ class Stage5_7BVerification:
         """
         使用7B模型推理（双图像输入）
         """
+        prompt, output_format = value_request(prompt, roi_type)
         try:
-            response = ollama.chat(
+            response = cached_chat(
                 model=OLLAMA_MODEL_7B,
                 messages=[{
                     'role': 'user',
                     'content': prompt,
                     'images': [str(image_path_prev), str(image_path_curr)]
                 }],
-                options={'temperature': 0.1, 'num_predict': 30}
+                options={'temperature': 0.1, 'num_predict': 30},
+                **output_format
             )
             
-            text = response['message']['content']
+            text = parse_value(response['message']['content'])
             return self.clean_model_output(text, roi_type)
             
         except Exception as e:
             print(f"  [7B Dual Error] {e}")
             return "ERROR"
     
-    def run_7b_inference(self, image_path, prompt, roi_type='FLOAT'):
-        """使用7B模型推理"""
+    def run_7b_inference(self, image_path, prompt, roi_type='FLOAT', deadline=None):
+        """使用7B模型推理（deadline: 调用时限，None = OLLAMA_CALL_DEADLINE）"""
+        prompt, output_format = value_request(prompt, roi_type)
         try:
-            response = ollama.chat(
+            response = cached_chat(
                 model=OLLAMA_MODEL_7B,
                 messages=[{
                     'role': 'user',
                     'content': prompt,
                     'images': [str(image_path)]
                 }],
-                options={'temperature': 0.1, 'num_predict': 30}
+                options={'temperature': 0.1, 'num_predict': 30},
+                deadline=deadline,
+                **output_format
             )
             
-            text = response['message']['content']
+            text = parse_value(response['message']['content'])
             return self.clean_model_output(text, roi_type)
             
         except Exception as e:
@@ -418,6 +426,113 @@ class Stage5_7BVerification:
                 return img_path
         return None
     
+    def verify_row(self, csv_base, idx, total, row, roi_medians):
+        """
+        7B验证一行不匹配记录，返回要写入的列 {列名: 值}
+        """
+        fields = {}
+        roi_id = str(row['ROI_ID'])
+        roi_type = get_roi_type(roi_id, default=None)  # 未配置的ROI不加schema
+        current_filename = str(row['Filename_Current'])
+        compared_filename = str(row['Filename_Compared'])
+        
+        # 查找两张图像（prev和current）
+        img_path_prev = self.find_crop_image(csv_base, compared_filename, roi_id)
+        img_path_curr = self.find_crop_image(csv_base, current_filename, roi_id)
+        
+        # 检查图像是否都找到
+        if not img_path_prev or not img_path_curr:
+            fields['AI_7B_Read'] = "Image Not Found"
+            fields['Image_Source_Prev'] = str(img_path_prev) if img_path_prev else "Missing"
+            fields['Image_Source_Curr'] = str(img_path_curr) if img_path_curr else "Missing"
+            print(f"  [{idx+1}/{total}] {roi_id}: ❌ Image(s) missing")
+            return fields
+        
+        # 获取median值
+        median_val = roi_medians.get(roi_id, None)
+        fields['Median_Context'] = str(median_val) if median_val is not None else "N/A"
+        
+        # 获取当前值和比较值
+        val_curr = row['Value_Current']
+        val_prev = row['Value_Compared']
+        
+        # 只对INTEGER和FLOAT使用双图像比较
+        if roi_type in ['INTEGER', 'FLOAT']:
+            # 生成包含双图像信息的prompt
+            prompt = self.get_prompt_7b_enhanced(
+                roi_id, val_curr, val_prev, median_val,
+                prev_filename=compared_filename,
+                curr_filename=current_filename
+            )
+        
+            # 7B双图像推理
+            ai_result = self.run_7b_inference_dual(img_path_prev, img_path_curr, prompt, roi_type)
+            fields['Comparison_Mode'] = "Dual Image"
+        else:
+            # STATUS和TIME只用单图像（current）
+            prompt = self.get_prompt_7b_enhanced(
+                roi_id, val_curr, val_prev, median_val,
+                prev_filename=compared_filename,
+                curr_filename=current_filename
+            )
+            ai_result = self.run_7b_inference(img_path_curr, prompt, roi_type)
+            fields['Comparison_Mode'] = "Single Image"
+        
+        # 显示详细信息
+        median_str = f"Median={median_val:.3f}" if isinstance(median_val, (int, float)) else f"Mode={median_val}"
+        mode_icon = "🔬" if roi_type in ['INTEGER', 'FLOAT'] else "📷"
+        print(f"  [{idx+1}/{total}] {mode_icon} {roi_id}: Prev={val_prev} | Curr={val_curr} | {median_str} | 7B={ai_result}")
+        
+        # 保存结果
+        fields['AI_7B_Read'] = ai_result
+        fields['Image_Source_Prev'] = str(img_path_prev)
+        fields['Image_Source_Curr'] = str(img_path_curr)
+        
+        # 判定（增强版：考虑median）
+        ai_clean = str(ai_result).strip().lower()
+        prev_clean = str(val_prev).strip().lower()
+        curr_clean = str(val_curr).strip().lower()
+        
+        if ai_clean == prev_clean:
+            fields['Verdict'] = "Confirmed Redundant (OCR Error)"
+        elif ai_clean == curr_clean:
+            fields['Verdict'] = "Genuine Change (OCR Correct)"
+        else:
+            # 如果7B给出新值，检查是否接近median
+            verdict = "New Value (7B Disagrees)"
+            if median_val is not None and roi_type in ['INTEGER', 'FLOAT']:
+                try:
+                    ai_num = float(ai_clean)
+                    median_num = float(median_val)
+                    if abs(ai_num - median_num) / median_num < 0.1:  # 10%以内
+                        verdict += " - Close to Median"
+                    else:
+                        # 检查哪个读数更接近median
+                        try:
+                            prev_diff = abs(float(prev_clean) - median_num) / median_num
+                            curr_diff = abs(float(curr_clean) - median_num) / median_num
+                            if prev_diff < curr_diff:
+                                verdict += f" - Prev closer to median"
+                            else:
+                                verdict += f" - Curr closer to median"
+                        except:
+                            pass
+                except:
+                    pass
+            fields['Verdict'] = verdict
+        
+        return fields
+    
+    def verify_rows_async(self, df, csv_base, roi_medians):
+        """异步验证：各行互相独立，按 MAX_WORKERS_7B 并发调用7B，返回 {行号: 列值}"""
+        async def main(client):
+            fields = await asyncio.gather(*(
+                client.run(self.verify_row, csv_base, idx, len(df), row, roi_medians)
+                for idx, row in df.iterrows()))
+            return dict(zip(df.index, fields))
+        
+        return run_with_client(main, model=OLLAMA_MODEL_7B)
+    
     def process_mismatch_log(self, log_path):
         """处理冗余不匹配日志（增强版：带median计算和双图像比较）"""
         filename = log_path.name
@@ -453,96 +568,16 @@ class Stage5_7BVerification:
         df['Median_Context'] = ""
         df['Comparison_Mode'] = ""
         
-        for idx, row in df.iterrows():
-            roi_id = str(row['ROI_ID'])
-            roi_type = get_roi_type(roi_id)
-            current_filename = str(row['Filename_Current'])
-            compared_filename = str(row['Filename_Compared'])
-            
-            # 查找两张图像（prev和current）
-            img_path_prev = self.find_crop_image(csv_base, compared_filename, roi_id)
-            img_path_curr = self.find_crop_image(csv_base, current_filename, roi_id)
-            
-            # 检查图像是否都找到
-            if not img_path_prev or not img_path_curr:
-                df.at[idx, 'AI_7B_Read'] = "Image Not Found"
-                df.at[idx, 'Image_Source_Prev'] = str(img_path_prev) if img_path_prev else "Missing"
-                df.at[idx, 'Image_Source_Curr'] = str(img_path_curr) if img_path_curr else "Missing"
-                print(f"  [{idx+1}/{len(df)}] {roi_id}: ❌ Image(s) missing")
-                continue
-            
-            # 获取median值
-            median_val = roi_medians.get(roi_id, None)
-            df.at[idx, 'Median_Context'] = str(median_val) if median_val is not None else "N/A"
-            
-            # 获取当前值和比较值
-            val_curr = row['Value_Current']
-            val_prev = row['Value_Compared']
-            
-            # 只对INTEGER和FLOAT使用双图像比较
-            if roi_type in ['INTEGER', 'FLOAT']:
-                # 生成包含双图像信息的prompt
-                prompt = self.get_prompt_7b_enhanced(
-                    roi_id, val_curr, val_prev, median_val,
-                    prev_filename=compared_filename,
-                    curr_filename=current_filename
-                )
-                
-                # 7B双图像推理
-                ai_result = self.run_7b_inference_dual(img_path_prev, img_path_curr, prompt, roi_type)
-                df.at[idx, 'Comparison_Mode'] = "Dual Image"
-            else:
-                # STATUS和TIME只用单图像（current）
-                prompt = self.get_prompt_7b_enhanced(
-                    roi_id, val_curr, val_prev, median_val,
-                    prev_filename=compared_filename,
-                    curr_filename=current_filename
-                )
-                ai_result = self.run_7b_inference(img_path_curr, prompt, roi_type)
-                df.at[idx, 'Comparison_Mode'] = "Single Image"
-            
-            # 显示详细信息
-            median_str = f"Median={median_val:.3f}" if isinstance(median_val, (int, float)) else f"Mode={median_val}"
-            mode_icon = "🔬" if roi_type in ['INTEGER', 'FLOAT'] else "📷"
-            print(f"  [{idx+1}/{len(df)}] {mode_icon} {roi_id}: Prev={val_prev} | Curr={val_curr} | {median_str} | 7B={ai_result}")
-            
-            # 保存结果
-            df.at[idx, 'AI_7B_Read'] = ai_result
-            df.at[idx, 'Image_Source_Prev'] = str(img_path_prev)
-            df.at[idx, 'Image_Source_Curr'] = str(img_path_curr)
-            
-            # 判定（增强版：考虑median）
-            ai_clean = str(ai_result).strip().lower()
-            prev_clean = str(val_prev).strip().lower()
-            curr_clean = str(val_curr).strip().lower()
-            
-            if ai_clean == prev_clean:
-                df.at[idx, 'Verdict'] = "Confirmed Redundant (OCR Error)"
-            elif ai_clean == curr_clean:
-                df.at[idx, 'Verdict'] = "Genuine Change (OCR Correct)"
-            else:
-                # 如果7B给出新值，检查是否接近median
-                verdict = "New Value (7B Disagrees)"
-                if median_val is not None and roi_type in ['INTEGER', 'FLOAT']:
-                    try:
-                        ai_num = float(ai_clean)
-                        median_num = float(median_val)
-                        if abs(ai_num - median_num) / median_num < 0.1:  # 10%以内
-                            verdict += " - Close to Median"
-                        else:
-                            # 检查哪个读数更接近median
-                            try:
-                                prev_diff = abs(float(prev_clean) - median_num) / median_num
-                                curr_diff = abs(float(curr_clean) - median_num) / median_num
-                                if prev_diff < curr_diff:
-                                    verdict += f" - Prev closer to median"
-                                else:
-                                    verdict += f" - Curr closer to median"
-                            except:
-                                pass
-                    except:
-                        pass
-                df.at[idx, 'Verdict'] = verdict
+        if ASYNC_CORRECTION_ENABLED:
+            results = self.verify_rows_async(df, csv_base, roi_medians)
+        else:
+            results = {idx: self.verify_row(csv_base, idx, len(df), row, roi_medians)
+                       for idx, row in df.iterrows()}
+        
+        # 按原始行号写回
+        for idx in df.index:
+            for col, value in results[idx].items():
+                df.at[idx, col] = value
         
         # 保存
         out_name = filename.replace(".csv", "_AI_7B_Verified.csv")
@@ -573,10 +608,38 @@ class Stage5_7BVerification:
         
         print("\n✅ Stage 5 Complete")
 
+class CropIndex:
+    """
+    DEBUG_CROPS_BASE 裁剪图查找：每个帧目录只列一次文件（不再对每个ROI依次 exists() .jpg/.png）
+    """
+    
+    def __init__(self, crops_base):
+        self.crops_base = Path(crops_base)
+        self.folders = {}
+    
+    def find(self, filename, roi_id):
+        folder_name = Path(str(filename)).stem
+        names = self.folders.get(folder_name)
+        if names is None:
+            try:
+                names = set(os.listdir(self.crops_base / folder_name))
+            except OSError:
+                names = set()
+            self.folders[folder_name] = names
+        for ext in ['jpg', 'png']:
+            name = f"{roi_id}.{ext}"
+            if name in names:
+                return self.crops_base / folder_name / name
+        return None
+
 # ================= 阶段6: 应用7B修正并消除冗余 =================
 class Stage6_FinalConsolidation:
     """阶段6: 应用7B修正并消除冗余行，生成最终数据集"""
     
+    # 与 Stage 5 共用7B调用和输出清理（格式修复原来调用的 run_7b_inference 在本类中不存在）
+    run_7b_inference = Stage5_7BVerification.run_7b_inference
+    clean_model_output = Stage5_7BVerification.clean_model_output
+    
     def __init__(self, labeled_dir, verified_logs_dir, output_dir):
         self.labeled_dir = Path(labeled_dir)
         self.verified_logs_dir = Path(verified_logs_dir)
@@ -629,6 +692,21 @@ class Stage6_FinalConsolidation:
         
         return None
     
+    @staticmethod
+    def format_issue_candidates(series, roi_type):
+        """
+        向量化预筛：返回可能有格式问题的行号（detect_format_issues 只可能对这些返回问题）
+        特殊token、多个小数点、FLOAT超过3位小数
+        """
+        present = series.notna()
+        text = series[present].astype(str).str.strip()
+        mask = (text.str.contains('<|', regex=False) | text.str.contains('|>', regex=False)
+                | (text.str.count(r'\.') > 1))
+        if roi_type == 'FLOAT':
+            decimals = text.str.split('.').str[-1]
+            mask |= text.str.contains('.', regex=False) & (decimals.str.len() > 3) & decimals.str.isdigit()
+        return text.index[mask.to_numpy()]
+    
     def fix_format_issues_with_7b(self, df, csv_base):
         """使用7B模型修复格式问题"""
         print(f"  🔍 Checking for format issues...")
@@ -652,7 +730,9 @@ class Stage6_FinalConsolidation:
         for col in roi_cols:
             roi_type = get_roi_type(col)
             median_val = roi_medians.get(col)
-            for idx, value in df[col].items():
+            # 先按列向量化筛出可能有问题的单元格，只对这些逐个判断
+            for idx in self.format_issue_candidates(df[col], roi_type):
+                value = df.at[idx, col]
                 issue = self.detect_format_issues(value, roi_type, median_val)
                 if issue:
                     filename = df.at[idx, 'Filename'] if 'Filename' in df.columns else f"Row_{idx}"
@@ -671,53 +751,63 @@ class Stage6_FinalConsolidation:
         
         print(f"  ⚠️  Found {len(issues_found)} format issues, re-verifying with 7B...")
         
-        # 使用7B重新验证有问题的值
-        fixed_count = 0
+        # 查找图片（每个帧目录只列一次）
+        crop_index = CropIndex(DEBUG_CROPS_BASE)
+        jobs = []
         for item in issues_found:
-            idx = item['idx']
-            roi = item['roi']
-            filename = item['filename']
-            roi_type = item['roi_type']
-            median_val = roi_medians.get(roi)
-            
-            # 查找图片
-            folder_name = Path(filename).stem
-            
-            image_path = None
-            for ext in ['jpg', 'png']:
-                test_path = DEBUG_CROPS_BASE / folder_name / f"{roi}.{ext}"
-                if test_path.exists():
-                    image_path = test_path
-                    break
-            
-            if not image_path:
+            image_path = crop_index.find(item['filename'], item['roi'])
+            if image_path:
+                jobs.append((item, image_path, roi_medians.get(item['roi'])))
+        
+        # 使用7B重新验证有问题的值（有界并发，重试/时限由共享推理客户端负责）
+        if ASYNC_CORRECTION_ENABLED:
+            async def main(client):
+                return await asyncio.gather(*(
+                    client.run(self.repair_format_issue, item, image_path, median_val)
+                    for item, image_path, median_val in jobs))
+            new_values = run_with_client(main, model=OLLAMA_MODEL_7B)
+        else:
+            new_values = [self.repair_format_issue(item, image_path, median_val)
+                          for item, image_path, median_val in jobs]
+        
+        # 按检测顺序写回
+        fixed_count = 0
+        for (item, _, _), new_value in zip(jobs, new_values):
+            if new_value is None:
                 continue
-            
-            # 生成prompt
-            prompt = (
-                f"Task: Extract the {'number' if roi_type in ['FLOAT', 'INTEGER'] else 'value'} from this image.\n"
-                f"⚠️ The previous OCR result '{item['value']}' has formatting errors.\n"
-                f"STRICT RULES:\n"
-                f"1. Output ONLY the clean value you see.\n"
-                f"2. For decimals: ONLY ONE decimal point, MAXIMUM 3 digits after.\n"
-                f"3. NO special tokens like <|im_start|>, NO HTML.\n"
-                f"Output format: Just the number (e.g., 9.128, 1.823, 0)"
-            )
-            
-            try:
-                new_value = self.run_7b_inference(image_path, prompt, roi_type)
-                if new_value and new_value not in ["ERROR", "Image Not Found"]:
-                    # 验证新值是否有效（传入中位数用于INTEGER检测）
-                    if not self.detect_format_issues(new_value, roi_type, median_val):
-                        df.at[idx, roi] = new_value
-                        fixed_count += 1
-                        print(f"    ✓ Fixed {roi} in {filename}: '{item['value']}' → '{new_value}'")
-            except Exception as e:
-                pass
+            df.at[item['idx'], item['roi']] = new_value
+            fixed_count += 1
+            print(f"    ✓ Fixed {item['roi']} in {item['filename']}: '{item['value']}' → '{new_value}'")
         
         print(f"  ✅ Fixed {fixed_count}/{len(issues_found)} format issues")
         return df
     
+    def repair_format_issue(self, item, image_path, median_val):
+        """用7B重新读取一个格式有问题的值；新值仍有问题或调用失败时返回None"""
+        roi_type = item['roi_type']
+        
+        # 生成prompt
+        prompt = (
+            f"Task: Extract the {'number' if roi_type in ['FLOAT', 'INTEGER'] else 'value'} from this image.\n"
+            f"⚠️ The previous OCR result '{item['value']}' has formatting errors.\n"
+            f"STRICT RULES:\n"
+            f"1. Output ONLY the clean value you see.\n"
+            f"2. For decimals: ONLY ONE decimal point, MAXIMUM 3 digits after.\n"
+            f"3. NO special tokens like <|im_start|>, NO HTML.\n"
+            f"Output format: Just the number (e.g., 9.128, 1.823, 0)"
+        )
+        
+        try:
+            new_value = self.run_7b_inference(image_path, prompt, roi_type,
+                                              deadline=STAGE6_REPAIR_DEADLINE)
+            if new_value and new_value not in ["ERROR", "Image Not Found"]:
+                # 验证新值是否有效（传入中位数用于INTEGER检测）
+                if not self.detect_format_issues(new_value, roi_type, median_val):
+                    return new_value
+        except Exception as e:
+            pass
+        return None
+    
     def apply_7b_corrections(self, labeled_csv_path, verified_log_path):
         """应用7B修正"""
         print(f"\n🔧 Applying 7B corrections: {labeled_csv_path.name}")
@@ -0,0 +1,209 @@
+"""
+Stage 0 多进程解码+裁剪 - 共享内存传递ROI裁剪
+Process-based Decode/Crop Stage with Shared-memory Buffers
+
+PNG解码(cv2.imread)和2倍INTER_CUBIC上采样与驱动模型HTTP调用的线程在同一进程、
+同一把GIL下运行。STAGE0_DECODE_PROCESSES > 0 时这部分移到子进程：
+
+1. 子进程：解码 → 调试地图 → 暗ROI筛查 → 整帧指纹 → 裁剪+上采样非暗ROI
+   （暗ROI只在需要保存裁剪或要走颜色通道时才裁剪，与单进程路径相同）
+2. 全部裁剪写入一块 multiprocessing.shared_memory，只把句柄（名称+偏移+形状）传回
+3. 主进程把该共享内存段映射进来，裁剪直接是指向它的 numpy 视图（不再复制），交给推理线程；
+   段名随即删除，映射在最后一个引用它的裁剪被释放时自动解除（推理、产物写入完成后）。
+   ROI复用缓存保存参考裁剪时会复制一份，不会让整段映射长期驻留。
+   没有 /dev/shm 的平台退回到逐个复制出裁剪。整帧图像从不跨进程复制
+4. 子进程崩溃（BrokenProcessPool）时重建进程池并重试该帧一次
+
+spawn方式启动（不继承主进程的线程/文件句柄），但子进程会把主脚本作为 __mp_main__ 重新导入：
+ocrserver_enhanced 因此在模块级不做任何初始化（median加载器、写入线程都在首次使用时创建）。
+"""
+
+import os
+import mmap
+import threading
+import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from config_pipeline import *
+from roi_table import RoiTable
+from roi_reuse import FrameDedup
+
+SHM_ROOT = Path("/dev/shm")  # POSIX共享内存段在Linux上的挂载点
+
+
+def render_debug_map(img, rois, out_path):
+    """在整帧副本上绘制所有ROI框并保存"""
+    vis_img = img.copy()
+    for name, x, y, w, h in rois:
+        cv2.rectangle(vis_img, (x, y), (x+w, y+h), (0, 0, 255), 2)
+        cv2.putText(vis_img, name, (x, y-5),
+                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+    cv2.imwrite(str(out_path), vis_img)
+
+
+class PreparedFrame:
+    """
+    已在子进程中完成的一帧：{roi: crop 或 None}、暗ROI集合、整帧指纹
+    EnhancedGPUHandler 用它代替整帧图像（不再裁剪/筛查/计算指纹）
+    """
+
+    def __init__(self, crops, dark, fingerprint):
+        self.crops = crops
+        self.dark = dark
+        self.fingerprint = fingerprint
+
+
+class SharedFrameHandle:
+    """子进程返回的句柄：共享内存名称 + 每个ROI裁剪的 (偏移, 形状)"""
+
+    def __init__(self, shm_name, layout, dark, fingerprint):
+        self.shm_name = shm_name
+        self.layout = layout  # [(name, offset 或 None, shape)]
+        self.dark = dark
+        self.fingerprint = fingerprint
+
+    def open(self):
+        """
+        返回 PreparedFrame，裁剪是共享内存上的视图（不复制）
+        共享内存段名立即删除；映射由裁剪数组持有，最后一个裁剪释放时解除
+        """
+        segment = map_segment(self.shm_name)
+        shm = shared_memory.SharedMemory(name=self.shm_name)
+        try:
+            crops = {}
+            for name, offset, shape in self.layout:
+                if offset is None:
+                    crops[name] = None
+                elif segment is not None:
+                    crops[name] = np.ndarray(shape, dtype=np.uint8, buffer=segment, offset=offset)
+                else:
+                    # 无法独立映射时复制出来：SharedMemory 关闭后其缓冲区不能再被引用
+                    view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+                    crops[name] = view.copy()
+                    del view
+        finally:
+            shm.close()
+            shm.unlink()
+        return PreparedFrame(crops, self.dark, self.fingerprint)
+
+
+def map_segment(shm_name):
+    """
+    把共享内存段映射为独立的 mmap（与 SharedMemory 对象的生命周期无关）
+    不支持时（没有 /dev/shm）返回None
+    """
+    try:
+        fd = os.open(SHM_ROOT / shm_name.lstrip("/"), os.O_RDWR)
+    except OSError:
+        return None
+    try:
+        return mmap.mmap(fd, os.fstat(fd).st_size)
+    except (OSError, ValueError):
+        return None
+    finally:
+        os.close(fd)
+
+
+# ================= 子进程 =================
+_worker = {}
+
+
+def _init_worker(rois, pad, upscale, dedup):
+    table = RoiTable(rois)
+    table.pads[:] = pad
+    table.upscales.update(upscale)
+    _worker['rois'] = rois
+    _worker['table'] = table
+    _worker['dedup'] = FrameDedup(table) if dedup else None
+
+
+def _decode_frame(img_path, debug_map_path, keep_dark=None):
+    """
+    子进程：解码并准备一帧；无法读取时返回None
+    keep_dark: 仍需裁剪的暗ROI名集合；None = 全部裁剪（需要保存ROI裁剪时）
+    """
+    img = cv2.imread(str(img_path))
+    if img is None:
+        return None
+    table = _worker['table']
+    if debug_map_path is not None:
+        render_debug_map(img, _worker['rois'], debug_map_path)
+    dark = table.dark_rois(img)
+    dedup = _worker['dedup']
+    fingerprint = dedup.fingerprint(img) if dedup is not None else None
+    crops = table.crop_all(img, skip=dark - keep_dark if keep_dark is not None else ())
+
+    size = sum(c.nbytes for c in crops.values() if c is not None)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    layout = []
+    offset = 0
+    try:
+        for name, crop in crops.items():
+            if crop is None:
+                layout.append((name, None, None))
+                continue
+            np.ndarray(crop.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)[...] = crop
+            layout.append((name, offset, crop.shape))
+            offset += crop.nbytes
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()  # 由主进程 open() 负责 unlink
+    return SharedFrameHandle(shm.name, layout, dark, fingerprint)
+
+
+# ================= 主进程 =================
+class ProcessFrameDecoder:
+    """子进程池：decode() 阻塞等待一帧准备完成，返回 PreparedFrame 或 None"""
+
+    def __init__(self, rois, processes=STAGE0_DECODE_PROCESSES, table=None):
+        # 子进程使用与主进程相同的边距/上采样（不各自重新读表）
+        table = table if table is not None else RoiTable(rois)
+        self.processes = max(1, int(processes))
+        self.initargs = (list(rois), table.pads.tolist(), table.upscales, FRAME_DEDUP_ENABLED)
+        self.lock = threading.Lock()
+        self.restarts = 0
+        self.executor = self._create_pool()
+
+    def _create_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=self.initargs,
+        )
+
+    def decode(self, img_path, debug_map_path=None, keep_dark=None):
+        """keep_dark: 仍需裁剪的暗ROI名集合；None = 全部裁剪"""
+        args = (str(img_path), None if debug_map_path is None else str(debug_map_path),
+                None if keep_dark is None else set(keep_dark))
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                handle = executor.submit(_decode_frame, *args).result()
+            except BrokenProcessPool:
+                # 子进程崩溃后进程池不再可用：重建并重试该帧一次（再次崩溃则只有这一帧失败）
+                self._restart(executor)
+                if attempt:
+                    raise
+                continue
+            return None if handle is None else handle.open()
+
+    def _restart(self, broken):
+        with self.lock:
+            if self.executor is not broken:
+                return  # 其他解码线程已经重建
+            self.restarts += 1
+            print(f"\n⚠️  Decode process crashed, restarting pool (#{self.restarts})")
+            broken.shutdown(wait=False)
+            self.executor = self._create_pool()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
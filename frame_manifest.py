@@ -0,0 +1,198 @@
+"""
+Stage 0 已处理帧清单 - 重启后即时续跑
+Persistent Processed-frame Manifest for Instant Resume
+
+SQLite 文件（默认在 STAGE_1_OCR 下）记录：
+- frames: 每帧的状态  'done'（CSV已刷盘） / 'partial'（有ROI推理失败，CSV尚未写入）
+- rois:   每帧每个ROI的值和状态 'ok' / 'failed'
+- dirs:   已全部完成的目录的高水位标记（目录 mtime + 子目录列表）
+
+重启后：
+1. scan_new_frames 遍历 SOURCE_DIR：mtime 与标记相同的目录（没有增删文件）不再列目录、不检查文件，
+   只进入记录下的子目录；扫描代价 = 目录数 + 有变化的目录中的文件数，而不是全部文件数
+2. 其余目录中 'done' 的帧直接跳过（一次查询载入内存集合）；没有待处理帧的目录记下新的高水位
+3. 'partial' 的帧重新入队，只对失败的ROI调用模型，成功的ROI直接取清单中的值
+4. 已写入的CSV行不会被重写或重复追加
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from config_pipeline import *
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+
+def frame_key(img_path):
+    """帧的清单键：相对 SOURCE_DIR 的路径（目录搬迁后仍然有效）"""
+    img_path = Path(img_path)
+    try:
+        return img_path.relative_to(SOURCE_DIR).as_posix()
+    except ValueError:
+        return img_path.name
+
+
+class FrameManifest:
+    """基于SQLite的帧/ROI完成记录"""
+
+    def __init__(self, db_path=STAGE0_MANIFEST):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS frames (
+                path    TEXT PRIMARY KEY,
+                status  TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rois (
+                path    TEXT NOT NULL,
+                roi     TEXT NOT NULL,
+                value   TEXT,
+                status  TEXT NOT NULL,
+                PRIMARY KEY (path, roi)
+            );
+            CREATE TABLE IF NOT EXISTS dirs (
+                path     TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                subdirs  TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+        self.done = {row[0] for row in self.conn.execute(
+            "SELECT path FROM frames WHERE status = 'done'")}
+        self.sealed = {path: (mtime_ns, json.loads(subdirs)) for path, mtime_ns, subdirs
+                       in self.conn.execute("SELECT path, mtime_ns, subdirs FROM dirs")}
+
+    # ---------- 查询 ----------
+    def is_done(self, img_path):
+        with self.lock:
+            return frame_key(img_path) in self.done
+
+    def completed_keys(self):
+        """所有已完成帧的键（启动时过滤批量扫描用）"""
+        with self.lock:
+            return set(self.done)
+
+    def sealed_dir(self, key, mtime_ns):
+        """目录自上次标记后没有变化时返回其子目录名列表，否则返回None"""
+        with self.lock:
+            entry = self.sealed.get(key)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        return entry[1]
+
+    def incomplete_keys(self):
+        """有失败ROI、需要重试的帧"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT path FROM frames WHERE status = 'partial' ORDER BY path")]
+
+    def load_ok_rois(self, img_path):
+        """该帧已成功识别的ROI {roi: value}（重试时跳过这些ROI）"""
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT roi, value FROM rois WHERE path = ? AND status = 'ok'",
+                (frame_key(img_path),)))
+
+    # ---------- 写入 ----------
+    def record_frame(self, img_path, results, failed):
+        """
+        记录一帧的ROI结果
+        results: {roi: value}; failed: 推理失败的ROI名集合
+        有失败ROI时帧状态为 'partial'，否则保持/设为 'pending'（等待CSV刷盘后 mark_done）
+        """
+        key = frame_key(img_path)
+        rows = [(key, roi, value, 'failed' if roi in failed else 'ok')
+                for roi, value in results.items()]
+        status = 'partial' if failed else 'pending'
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO rois (path, roi, value, status) VALUES (?, ?, ?, ?)",
+                    rows)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO frames (path, status, updated) VALUES (?, ?, ?)",
+                    (key, status, time.time()))
+
+    def mark_done(self, img_paths):
+        """CSV行已刷盘的帧标记为完成（批量）"""
+        keys = [frame_key(p) for p in img_paths]
+        if not keys:
+            return
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO frames (path, status, updated) VALUES (?, 'done', ?)",
+                    [(k, now) for k in keys])
+            self.done.update(keys)
+
+    def seal_dirs(self, rows):
+        """记录已全部完成的目录 [(key, mtime_ns, [子目录名])]（批量）"""
+        if not rows:
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO dirs (path, mtime_ns, subdirs) VALUES (?, ?, ?)",
+                    [(key, mtime_ns, json.dumps(subdirs)) for key, mtime_ns, subdirs in rows])
+            for key, mtime_ns, subdirs in rows:
+                self.sealed[key] = (mtime_ns, subdirs)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def scan_new_frames(root=SOURCE_DIR, manifest=None, suffixes=IMAGE_SUFFIXES):
+    """
+    启动时的批量扫描：返回 (待处理图像路径列表, 跳过的已完成目录数)
+    manifest 为None时等同于原来的 rglob 全量扫描
+    """
+    root = Path(root)
+    done = manifest.completed_keys() if manifest is not None else set()
+    found, seal, skipped = [], [], 0
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            st = directory.stat()
+        except OSError:
+            continue
+        key = frame_key(directory)
+        if manifest is not None:
+            subdirs = manifest.sealed_dir(key, st.st_mtime_ns)
+            if subdirs is not None:
+                skipped += 1
+                stack.extend(directory / name for name in subdirs)
+                continue
+        subdirs, pending = [], 0
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+                continue
+            path = Path(entry.path)
+            if (path.suffix.lower() in suffixes and not entry.name.startswith(".")
+                    and frame_key(path) not in done):
+                found.append(path)
+                pending += 1
+        stack.extend(directory / name for name in subdirs)
+        # 目录里没有待处理帧、且 mtime 已足够久（粗粒度时钟下之后的新增文件一定会改变 mtime）时标记
+        if manifest is not None and not pending and time.time() - st.st_mtime > STAGE0_MANIFEST_SEAL_AGE:
+            seal.append((key, st.st_mtime_ns, sorted(subdirs)))
+    if manifest is not None:
+        manifest.seal_dirs(seal)
+    found.sort()
+    return found, skipped
@@ -0,0 +1,186 @@
+"""
+持久化内容寻址推理缓存 - 所有阶段共享
+Persistent Content-addressed Inference Cache - Shared by All Stages
+
+同一个裁剪会被反复识别：Stage 0、Stage 2 纠错、Stage 5 验证、Stage 6 格式修复，
+修改配置后重跑整个管道时还会再来一遍。
+
+缓存键 = sha256(模型, prompt哈希, options, 每张图像的内容哈希)
+- 图像按内容哈希（JPEG字节或文件字节），与文件路径无关
+- 只缓存模型的原始输出，清理/后处理逻辑修改后仍然生效
+- SQLite 文件（默认在 OUTPUT_BASE 下），多个进程可同时使用
+- 按最近使用时间(LRU)淘汰，条目数上限 INFERENCE_CACHE_MAX_ENTRIES
+
+用法 Usage:
+    from inference_cache import cached_chat
+    response = cached_chat(model=..., messages=..., options=...)  # 参数同 ollama.chat
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+from config_pipeline import *
+from ollama_router import get_router
+
+
+class InferenceCache:
+    """SQLite 键值缓存：key -> 模型原始输出"""
+
+    def __init__(self, db_path=INFERENCE_CACHE_PATH, max_entries=INFERENCE_CACHE_MAX_ENTRIES,
+                 touch_interval=INFERENCE_CACHE_TOUCH_INTERVAL):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key       TEXT PRIMARY KEY,
+                model     TEXT NOT NULL,
+                content   TEXT NOT NULL,
+                created   REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used);
+        """)
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evicted = 0
+        if self.max_entries:
+            with self.lock:
+                self._evict_locked()
+
+    # ---------- 键 ----------
+    @staticmethod
+    def image_digest(image):
+        """图像内容哈希：bytes直接哈希，路径读取文件内容"""
+        if isinstance(image, (bytes, bytearray)):
+            data = bytes(image)
+        else:
+            path = Path(image)
+            try:
+                data = path.read_bytes()
+            except OSError:
+                return None  # 读不到的图像不缓存
+        return hashlib.sha256(data).hexdigest()
+
+    def make_key(self, model, messages, options=None):
+        """计算缓存键；有图像无法读取时返回None（不缓存）"""
+        parts = [model, json.dumps(options or {}, sort_keys=True)]
+        for msg in messages:
+            content = msg.get('content', '')
+            parts.append(msg.get('role', ''))
+            parts.append(hashlib.sha256(content.encode('utf-8')).hexdigest())
+            for image in msg.get('images') or []:
+                digest = self.image_digest(image)
+                if digest is None:
+                    return None
+                parts.append(digest)
+        return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+    # ---------- 读写 ----------
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content, last_used FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # 限制LRU时间戳的写入频率
+            if now - row[1] > self.touch_interval:
+                with self.conn:
+                    self.conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, model, content):
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, model, content, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)", (key, model, content, now, now))
+            self.inserts += 1
+            if self.max_entries and self.inserts % 1000 == 0:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        """超过条目上限时删除最久未使用的条目"""
+        count = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY last_used LIMIT ?)", (excess,))
+        self.evicted += excess
+
+    # ---------- 统计 ----------
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'evicted': self.evicted,
+            }
+
+    def print_stats(self):
+        print(f"🗃️  Inference cache: {self.stats()}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ================= 进程级共享缓存 =================
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_inference_cache():
+    """返回进程级共享缓存；INFERENCE_CACHE_ENABLED = False 时返回None"""
+    global _cache
+    if not INFERENCE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = InferenceCache()
+        return _cache
+
+
+def cached_chat(model, messages, options=None, deadline=None, **kwargs):
+    """
+    带缓存的 chat 调用（参数同 ollama.chat）
+    命中时不调用模型，返回 {'message': {'role': 'assistant', 'content': ...}}
+    deadline: 传给路由器的调用时限（秒），不影响缓存键
+    """
+    cache = get_inference_cache()
+    key = None
+    if cache is not None:
+        key_options = dict(options or {})
+        if kwargs:
+            key_options['_kwargs'] = kwargs  # 例如 format='json' 也会改变输出
+        key = cache.make_key(model, messages, key_options)
+    if key is not None:
+        content = cache.get(key)
+        if content is not None:
+            return {'model': model, 'message': {'role': 'assistant', 'content': content}}
+
+    response = get_router().chat(model=model, messages=messages, options=options,
+                                 deadline=deadline, **kwargs)
+    if key is not None:
+        cache.put(key, model, response['message']['content'])
+    return response
@@ -0,0 +1,102 @@
+"""
+进程级共享推理线程池
+Process-wide Shared Inference Worker Pool
+
+批量回填（main扫描）和 watchdog 回调都提交到同一个线程池，
+GPU 工作线程在帧与帧之间不会降到0。
+
+特性 Features:
+1. 长期存活的线程池（不再每张图像创建/销毁 ThreadPoolExecutor）
+2. 每个ROI返回一个 Future
+3. 有界积压：待处理任务超过上限时 submit 阻塞（背压）
+4. 队列深度 / 运行中 / 已完成 统计
+"""
+
+import threading
+import concurrent.futures
+
+from config_pipeline import *
+
+
+class InferencePool:
+    """共享推理线程池"""
+
+    def __init__(self, max_workers=INFERENCE_POOL_WORKERS,
+                 max_pending=INFERENCE_POOL_MAX_PENDING, name="infer"):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name)
+        # 积压上限 = 排队 + 运行中
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """提交一个推理任务，返回 Future（积压满时阻塞）"""
+        self.slots.acquire()
+        with self.lock:
+            self.queued += 1
+        try:
+            future = self.executor.submit(self._run, fn, args, kwargs)
+        except Exception:
+            with self.lock:
+                self.queued -= 1
+            self.slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _run(self, fn, args, kwargs):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                if not ok:
+                    self.failed += 1
+
+    def _release(self, _future):
+        self.slots.release()
+
+    def queue_depth(self):
+        """等待执行的任务数"""
+        with self.lock:
+            return self.queued
+
+    def stats(self):
+        """线程池统计"""
+        with self.lock:
+            return {
+                'workers': self.max_workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_inference_pool():
+    """获取进程级共享线程池（首次调用时创建）"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = InferencePool()
+        return _shared_pool
@@ -0,0 +1,227 @@
+"""
+watchdog 事件接收队列 - 去重 + 就绪检查 + 有界积压
+Ingest Queue for Watchdog Events - Dedupe, Readiness and Backpressure
+
+watchdog 线程只负责把路径放进队列，不再在回调里直接处理图像：
+1. 路径去重：on_created / on_moved 对同一文件的重复事件只处理一次
+   （处理中的路径全部记住；已写完的路径只保留最近 INGEST_RECENT_LIMIT 个，长期运行内存有界）
+2. 就绪检查：文件大小连续 INGEST_STABLE_CHECKS 次不变才交给解码（避免读到写了一半的PNG）
+3. 有界积压：未就绪+已就绪的路径数达到上限时 offer 阻塞（背压）
+4. 队列深度统计
+"""
+
+import time
+import threading
+from pathlib import Path
+from collections import OrderedDict, deque
+
+from config_pipeline import *
+
+
+class IngestQueue:
+    """去重、就绪感知的有界路径队列"""
+
+    def __init__(self, max_backlog=INGEST_MAX_BACKLOG,
+                 poll_interval=INGEST_POLL_INTERVAL,
+                 stable_checks=INGEST_STABLE_CHECKS,
+                 ready_timeout=INGEST_READY_TIMEOUT,
+                 settle_seconds=INGEST_SETTLE_SECONDS,
+                 recent_limit=INGEST_RECENT_LIMIT,
+                 on_discard=None):
+        self.max_backlog = max(1, int(max_backlog))
+        self.poll_interval = poll_interval
+        self.stable_checks = max(1, int(stable_checks))
+        self.ready_timeout = ready_timeout
+        self.settle_seconds = settle_seconds
+        self.recent_limit = max(0, int(recent_limit))
+        self.on_discard = on_discard  # 回调(path, reason)：路径被放弃时通知调用方
+
+        self.cond = threading.Condition()
+        self.seen = set()               # 已接收、尚未处理完的路径（去重）
+        self.recent = OrderedDict()     # 最近处理完的路径（LRU，拦截迟到的重复事件）
+        self.pending = OrderedDict()    # path -> [last_size, stable_count, first_seen]
+        self.ready = deque()
+        self.next_ticket = 0
+        self.closed = False
+
+        self.accepted = 0
+        self.duplicates = 0
+        self.timeouts = 0
+        self.vanished = 0
+
+        self.checker = threading.Thread(target=self._readiness_loop, name="ingest-ready", daemon=True)
+        self.checker.start()
+
+    # ---------- 生产者 ----------
+    def offer(self, path, ready=False):
+        """
+        接收一个路径；重复路径返回False
+        ready=True 表示调用方确定文件已写完（跳过就绪检查）
+        """
+        path = Path(path)
+        key = str(path)
+        if not ready:
+            ready = self._is_settled(path)
+        with self.cond:
+            if self._is_duplicate(key):
+                return False
+            # 背压：积压满时等待消费者取走
+            while not self.closed and self._depth() >= self.max_backlog:
+                self.cond.wait()
+            if self.closed:
+                return False
+            # 等待期间同一路径可能已被另一个线程接收：醒来后再查一次
+            if self._is_duplicate(key):
+                return False
+            self.seen.add(key)
+            self.accepted += 1
+            if ready:
+                self.ready.append(path)
+                self.cond.notify_all()
+            else:
+                self.pending[key] = [-1, 0, time.monotonic()]
+            return True
+
+    def _is_duplicate(self, key):
+        """调用方持有 self.cond"""
+        if key in self.recent:
+            self.recent.move_to_end(key)
+        elif key not in self.seen:
+            return False
+        self.duplicates += 1
+        return True
+
+    def done(self, path):
+        """
+        一帧处理完毕：路径移出处理中集合，只在最近完成的LRU里保留一段时间
+        （seen 不再随运行时间无限增长）
+        """
+        key = str(path)
+        with self.cond:
+            self.seen.discard(key)
+            if self.recent_limit:
+                self.recent[key] = None
+                self.recent.move_to_end(key)
+                while len(self.recent) > self.recent_limit:
+                    self.recent.popitem(last=False)
+
+    def forget(self, path):
+        """允许同一路径再次被接收（例如需要重新处理时）"""
+        key = str(path)
+        with self.cond:
+            self.seen.discard(key)
+            self.recent.pop(key, None)
+
+    def _is_settled(self, path):
+        """最后修改时间足够久远的文件视为已写完（批量回填的旧文件）"""
+        if self.settle_seconds is None:
+            return False
+        try:
+            st = path.stat()
+        except OSError:
+            return False
+        return st.st_size > 0 and (time.time() - st.st_mtime) > self.settle_seconds
+
+    # ---------- 消费者 ----------
+    def get(self, timeout=None):
+        """
+        取出下一个就绪路径，返回 (ticket, path)
+        ticket 按就绪顺序递增；队列关闭且为空时返回 None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while not self.ready:
+                if self.closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            path = self.ready.popleft()
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.cond.notify_all()  # 唤醒等待空位的 offer
+            return ticket, path
+
+    # ---------- 就绪检查 ----------
+    def _readiness_loop(self):
+        while True:
+            with self.cond:
+                if self.closed:
+                    return
+                items = [(key, state[0]) for key, state in self.pending.items()]
+            if items:
+                self._check_sizes(items)
+            with self.cond:
+                if self.closed:
+                    return
+                self.cond.wait(self.poll_interval)
+
+    def _check_sizes(self, items):
+        now = time.monotonic()
+        discarded = []
+        for key, last_size in items:
+            try:
+                size = Path(key).stat().st_size
+            except OSError:
+                size = None
+            with self.cond:
+                state = self.pending.get(key)
+                if state is None:
+                    continue
+                if size is None:
+                    # 文件已被移走/改名（改名会触发新的 on_moved 事件）
+                    del self.pending[key]
+                    self.seen.discard(key)
+                    self.vanished += 1
+                    discarded.append((key, 'vanished'))
+                    continue
+                if size > 0 and size == last_size:
+                    state[1] += 1
+                else:
+                    state[1] = 0
+                state[0] = size
+                if state[1] >= self.stable_checks:
+                    del self.pending[key]
+                    self.ready.append(Path(key))
+                    self.cond.notify_all()
+                elif self.ready_timeout and now - state[2] > self.ready_timeout:
+                    del self.pending[key]
+                    self.seen.discard(key)
+                    self.timeouts += 1
+                    self.cond.notify_all()
+                    discarded.append((key, 'timeout'))
+        for key, reason in discarded:
+            if reason == 'timeout':
+                print(f"\n  ⚠️  File never became stable, skipped: {Path(key).name}")
+            if self.on_discard is not None:
+                self.on_discard(Path(key), reason)
+
+    # ---------- 统计 / 关闭 ----------
+    def _depth(self):
+        return len(self.pending) + len(self.ready)
+
+    def depth(self):
+        """队列深度 = 等待就绪 + 已就绪未取走"""
+        with self.cond:
+            return self._depth()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'pending': len(self.pending),
+                'ready': len(self.ready),
+                'seen': len(self.seen),
+                'recent': len(self.recent),
+                'accepted': self.accepted,
+                'duplicates': self.duplicates,
+                'timeouts': self.timeouts,
+                'vanished': self.vanished,
+            }
+
+    def close(self):
+        """停止接收；已就绪的路径仍可被取走"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.checker.join()
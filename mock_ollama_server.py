@@ -0,0 +1,340 @@
+"""
+本地替身模型服务 - 录制/回放 Ollama chat API
+Local Record/Replay Stand-in for the Ollama Server
+
+没有跑着 qwen2.5vl 的GPU机器就无法测吞吐、也无法做回归测试。
+本服务实现流水线用到的 Ollama API 子集（POST /api/chat、GET /api/tags、GET /api/version），
+可以在任何只有CPU的Linux机器上代替真实服务：
+
+1. 录制（--upstream）：把请求原样转发给真实服务，返回其响应，
+   同时把 (键 → 模型输出, 实测延迟) 追加到录制文件（JSONL）
+2. 回放：按键查找录制的输出，按延迟分布等待后返回；找不到时返回 NA（或 404，--on-miss error）
+   键 = 模型 + 每条消息的 role/内容哈希 + 图像内容哈希（与 InferenceCache 相同） + format
+   options（num_predict、temperature 等）不参与键，调整这些参数后录制仍可使用
+3. 延迟分布：recorded（录制时的实测值）/ fixed / uniform / lognormal；
+   --slots N 模拟GPU并行槽位，超出的请求排队，延迟随并发上升
+4. 错误注入：--error-rate 返回503，--stall-rate 挂起 --stall-seconds 后才响应（触发客户端超时）
+
+基准测试时把 OLLAMA_ENDPOINTS 指向本服务，并设置 INFERENCE_CACHE_ENABLED = False
+（否则推理缓存命中，测到的不是模型路径）。
+
+用法 Usage:
+    # 在GPU机器上跑一遍正常流水线，同时录制
+    python mock_ollama_server.py --upstream http://127.0.0.1:11434 --port 11500
+    # 在任意机器上回放（OLLAMA_ENDPOINTS = [{"host": "http://127.0.0.1:11500", ...}]）
+    python mock_ollama_server.py --latency lognormal --latency-ms 350 --slots 4
+    python mock_ollama_server.py --error-rate 0.05 --stall-rate 0.01 --seed 1
+"""
+
+import sys
+import json
+import math
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import httpx
+
+from config_pipeline import *
+from inference_cache import InferenceCache
+
+
+def recording_key(model, messages, fmt=None):
+    """录制键；图像是请求中的base64字符串"""
+    parts = [model or '', json.dumps(fmt, sort_keys=True)]
+    for msg in messages or []:
+        parts.append(msg.get('role', ''))
+        parts.append(hashlib.sha256((msg.get('content') or '').encode('utf-8')).hexdigest())
+        for image in msg.get('images') or []:
+            parts.append(InferenceCache.image_digest(base64.b64decode(image)))
+    return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+
+def miss_content(fmt):
+    """没有录制时的占位输出（NA，符合请求的format）"""
+    if isinstance(fmt, dict):
+        props = fmt.get('properties') or {'value': None}
+        return json.dumps({name: 'NA' for name in props})
+    if fmt == 'json':
+        return '{}'
+    return 'NA'
+
+
+class RecordingStore:
+    """JSONL录制文件：启动时全部载入内存，录制时追加（同一键以最后一条为准）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 录制中断留下的半行
+                    self.entries[entry['key']] = entry
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, model, content, latency_ms, prompt=''):
+        entry = {
+            'key': key,
+            'model': model,
+            'content': content,
+            'latency_ms': round(latency_ms, 1),
+            'prompt': prompt[:80],  # 只为人工查看
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def models(self):
+        with self.lock:
+            return sorted({e['model'] for e in self.entries.values() if e.get('model')})
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class LatencyModel:
+    """回放延迟（毫秒）"""
+
+    def __init__(self, kind, mean_ms, jitter, rng):
+        self.kind = kind
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.rng = rng
+        self.lock = threading.Lock()
+
+    def sample(self, recorded_ms=None):
+        with self.lock:
+            if self.kind == 'recorded':
+                return recorded_ms if recorded_ms is not None else self.mean_ms
+            if self.kind == 'uniform':
+                spread = self.mean_ms * self.jitter
+                return max(0.0, self.rng.uniform(self.mean_ms - spread, self.mean_ms + spread))
+            if self.kind == 'lognormal':
+                # mean_ms 是中位数，jitter 是对数标准差
+                return self.rng.lognormvariate(math.log(max(self.mean_ms, 1e-3)), self.jitter)
+            return self.mean_ms
+
+    def roll(self, rate):
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+
+class MockOllama:
+    """服务状态：录制文件、延迟/错误配置、统计"""
+
+    def __init__(self, args):
+        self.store = RecordingStore(args.recordings)
+        self.upstream = httpx.Client(base_url=args.upstream, timeout=OLLAMA_REQUEST_TIMEOUT) if args.upstream else None
+        self.latency = LatencyModel(args.latency, args.latency_ms, args.latency_jitter, random.Random(args.seed))
+        self.slots = threading.BoundedSemaphore(args.slots) if args.slots > 0 else None
+        self.error_rate = args.error_rate
+        self.stall_rate = args.stall_rate
+        self.stall_seconds = args.stall_seconds
+        self.on_miss = args.on_miss
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'hits': 0, 'misses': 0, 'recorded': 0, 'errors': 0, 'stalls': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def print_stats(self):
+        with self.lock:
+            c = dict(self.counts)
+        print(f"\n📊 Mock Ollama: {c['requests']} requests, hits={c['hits']}, misses={c['misses']}, "
+              f"recorded={c['recorded']}, injected errors={c['errors']}, stalls={c['stalls']} "
+              f"({len(self.store)} recordings)")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockOllama/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def _send(self, obj, code=200, content_type="application/json"):
+        body = obj if isinstance(obj, bytes) else json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # ---------- GET ----------
+    def do_GET(self):
+        if self.path == '/api/version':
+            return self._send({'version': '0.0.0-mock'})
+        if self.path == '/api/tags':
+            names = set(self.mock.store.models())
+            if self.mock.upstream is not None:
+                try:
+                    upstream = self.mock.upstream.get('/api/tags').json()
+                    names.update(m.get('name') or m.get('model') for m in upstream.get('models', []))
+                except (httpx.HTTPError, ValueError):
+                    pass
+            return self._send({'models': [
+                {'name': name, 'model': name, 'modified_at': '1970-01-01T00:00:00Z',
+                 'size': 0, 'digest': '', 'details': {}} for name in sorted(n for n in names if n)]})
+        if self.path == '/':
+            return self._send(b"Ollama is running", content_type="text/plain")
+        self._send({'error': f'mock: unsupported endpoint {self.path}'}, 404)
+
+    # ---------- POST /api/chat ----------
+    def do_POST(self):
+        if self.path != '/api/chat':
+            return self._send({'error': f'mock: unsupported endpoint {self.path}'}, 404)
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            request = json.loads(raw)
+        except ValueError:
+            return self._send({'error': 'mock: invalid JSON body'}, 400)
+        mock = self.mock
+        mock.count('requests')
+        model = request.get('model')
+        messages = request.get('messages') or []
+        fmt = request.get('format')
+        key = recording_key(model, messages, fmt)
+
+        if mock.upstream is not None:
+            return self._record(request, key)
+
+        if mock.latency.roll(mock.error_rate):
+            mock.count('errors')
+            return self._send({'error': 'mock: injected server error'}, 503)
+
+        entry = mock.store.get(key)
+        if entry is None:
+            mock.count('misses')
+            if mock.on_miss == 'error':
+                return self._send({'error': f'mock: no recording for {model} ({key[:12]})'}, 404)
+            content, recorded_ms = miss_content(fmt), None
+        else:
+            mock.count('hits')
+            content, recorded_ms = entry['content'], entry.get('latency_ms')
+
+        start = time.monotonic()
+        if mock.slots is not None:
+            mock.slots.acquire()
+        try:
+            if mock.latency.roll(mock.stall_rate):
+                mock.count('stalls')
+                time.sleep(mock.stall_seconds)
+            time.sleep(mock.latency.sample(recorded_ms) / 1000.0)
+        finally:
+            if mock.slots is not None:
+                mock.slots.release()
+        self._reply(request, model, content, time.monotonic() - start)
+
+    def _record(self, request, key):
+        """转发给真实服务并录制输出"""
+        mock = self.mock
+        wants_stream = request.get('stream', True)
+        request = dict(request, stream=False)
+        start = time.monotonic()
+        try:
+            response = mock.upstream.post('/api/chat', json=request)
+        except httpx.HTTPError as e:
+            return self._send({'error': f'mock: upstream unavailable: {e}'}, 502)
+        latency_ms = (time.monotonic() - start) * 1000
+        body = None
+        if response.status_code == 200:
+            try:
+                body = response.json()
+                content = body['message']['content']
+            except (ValueError, KeyError, TypeError):
+                content = None
+            if content is not None:
+                prompt = next((m.get('content') or '' for m in request.get('messages') or []
+                               if m.get('role') == 'user'), '')
+                mock.store.put(key, request.get('model'), content, latency_ms, prompt)
+                mock.count('recorded')
+        if wants_stream and isinstance(body, dict):
+            # 上游按非流式调用；客户端要的是流式，包装成唯一的（done）ndjson分块
+            body['done'] = True
+            return self._send((json.dumps(body) + "\n").encode('utf-8'),
+                              content_type="application/x-ndjson")
+        self._send(response.content, response.status_code,
+                   response.headers.get('Content-Type', 'application/json'))
+
+    def _reply(self, request, model, content, elapsed):
+        body = {
+            'model': model,
+            'created_at': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            'message': {'role': 'assistant', 'content': content},
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': int(elapsed * 1e9),
+        }
+        if request.get('stream', True):
+            # 流式请求：一次性返回唯一的（done）分块
+            return self._send((json.dumps(body) + "\n").encode('utf-8'),
+                              content_type="application/x-ndjson")
+        self._send(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record/replay stand-in for the Ollama chat API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=MOCK_OLLAMA_PORT)
+    parser.add_argument('--recordings', type=Path, default=MOCK_OLLAMA_RECORDINGS)
+    parser.add_argument('--upstream', help='Record mode: real Ollama server to proxy to, e.g. http://127.0.0.1:11434')
+    parser.add_argument('--latency', choices=['recorded', 'fixed', 'uniform', 'lognormal'],
+                        default=MOCK_OLLAMA_LATENCY)
+    parser.add_argument('--latency-ms', type=float, default=MOCK_OLLAMA_LATENCY_MS,
+                        help='fixed value / uniform mean / lognormal median; also used for misses in recorded mode')
+    parser.add_argument('--latency-jitter', type=float, default=MOCK_OLLAMA_LATENCY_JITTER,
+                        help='uniform: relative half-width; lognormal: sigma of log latency')
+    parser.add_argument('--slots', type=int, default=0, help='Concurrent "GPU" slots, extra requests queue (0 = unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--stall-rate', type=float, default=0.0, help='Fraction of requests that stall')
+    parser.add_argument('--stall-seconds', type=float, default=OLLAMA_REQUEST_TIMEOUT + 5)
+    parser.add_argument('--on-miss', choices=['na', 'error'], default='na',
+                        help='Unrecorded request: answer NA, or 404 (not retried by the router)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    mock = MockOllama(args)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+
+    mode = f"recording from {args.upstream}" if args.upstream else f"replaying ({args.latency} latency)"
+    print(f"🧪 Mock Ollama on http://{args.host}:{args.port} - {mode}")
+    print(f"📼 {len(mock.store)} recordings in {args.recordings}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        mock.print_stats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Stage 0 分级OCR：先用CPU上的RapidOCR，不确定时再交给Qwen
+Tiered OCR Cascade: RapidOCR on the CPU First, Qwen on Escalation
+
+ocr_monitor.py 已经在用 rapidocr_onnxruntime（也在 requirements.txt 中），
+主管道却把每个数字ROI都送给Qwen。
+
+第1层 RapidOCR（仅识别，不做文字检测）读取 INTEGER / FLOAT / TIME ROI，
+读数同时满足以下条件才被采用：
+1. 通过 DataValidator.validate_value（与 Stage 1 相同的校验）
+2. 没有被校验"修正"过（例如 INTEGER 中夹杂的字母被删掉），FLOAT 必须读到小数点
+3. 识别置信度 >= 阈值（可按ROI设置）
+否则升级到第2层 ask_ollama_simple。
+
+未安装 rapidocr_onnxruntime 时整个级联自动关闭。
+"""
+
+import re
+import queue
+import threading
+from collections import defaultdict
+
+from config_pipeline import *
+from data_pipeline_3b import DataValidator
+
+try:
+    from rapidocr_onnxruntime import RapidOCR
+except ImportError:
+    RapidOCR = None
+
+
+class RapidOCRTier:
+    """RapidOCR 识别层：少量引擎实例供推理线程借用"""
+
+    def __init__(self, types=CASCADE_TYPES, min_confidence=CASCADE_MIN_CONFIDENCE,
+                 roi_thresholds=None, engines=CASCADE_ENGINES):
+        if RapidOCR is None:
+            raise ImportError("rapidocr_onnxruntime is not installed")
+        self.types = set(types)
+        self.min_confidence = min_confidence
+        self.roi_thresholds = dict(CASCADE_ROI_THRESHOLDS if roi_thresholds is None
+                                   else roi_thresholds)
+        self.validator = DataValidator()
+
+        # 引擎池：onnxruntime 会话较大，不为每个推理线程各建一个
+        self.engines = queue.Queue()
+        for _ in range(max(1, int(engines))):
+            self.engines.put(RapidOCR())
+
+        self.lock = threading.Lock()
+        self.accepted = defaultdict(int)
+        self.escalated = defaultdict(int)  # 升级原因 -> 次数
+
+    def handles(self, roi_id):
+        """该ROI是否由级联先处理"""
+        return get_roi_type(roi_id) in self.types
+
+    def threshold(self, roi_id):
+        return self.roi_thresholds.get(str(roi_id), self.min_confidence)
+
+    def recognize(self, crop):
+        """仅识别（use_det=False），返回 (text, confidence)"""
+        engine = self.engines.get()
+        try:
+            result, _ = engine(crop, use_det=False, use_cls=False, use_rec=True)
+        finally:
+            self.engines.put(engine)
+        if not result:
+            return "", 0.0
+        # 仅识别模式的格式为 [[text, score]]；兼容带检测框的 [box, text, score]
+        item = result[0]
+        if len(item) >= 3:
+            item = item[1:]
+        return str(item[0]).strip(), float(item[1])
+
+    def read(self, roi_id, crop):
+        """
+        返回通过校验的读数；需要升级到模型时返回None
+        """
+        roi_type = get_roi_type(roi_id)
+        try:
+            text, confidence = self.recognize(crop)
+        except Exception:
+            return self._escalate('error')
+        text = re.sub(r'\s+', '', text)
+        if not text:
+            return self._escalate('empty')
+
+        is_valid, clean_val, _ = self.validator.validate_value(text, roi_type)
+        if not is_valid:
+            return self._escalate('invalid')
+        # INTEGER 校验会删掉非数字字符，这里要求原文本身就是整数
+        if roi_type == 'INTEGER' and str(clean_val) != text.lstrip('+'):
+            return self._escalate('invalid')
+        # 小数点很细，RapidOCR 偶尔漏读（"1.25" -> "125"），没有小数点的 FLOAT 交给模型
+        if roi_type == 'FLOAT' and '.' not in text:
+            return self._escalate('no_decimal_point')
+        if confidence < self.threshold(roi_id):
+            return self._escalate('low_confidence')
+
+        with self.lock:
+            self.accepted[roi_type] += 1
+        return text
+
+    def _escalate(self, reason):
+        with self.lock:
+            self.escalated[reason] += 1
+        return None
+
+    def stats(self):
+        with self.lock:
+            accepted = sum(self.accepted.values())
+            escalated = sum(self.escalated.values())
+            return {
+                'accepted': dict(self.accepted),
+                'escalated': dict(self.escalated),
+                'accept_rate': round(accepted / (accepted + escalated), 3)
+                               if accepted + escalated else 0.0,
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"🔤 RapidOCR tier: accepted={s['accepted']}, escalated={s['escalated']} "
+              f"(accept rate {s['accept_rate']})")
+
+
+def create_cascade():
+    """按配置创建 RapidOCR 层；关闭或未安装时返回None"""
+    if not CASCADE_ENABLED:
+        return None
+    if RapidOCR is None:
+        print("⚠️  rapidocr_onnxruntime not installed - OCR cascade disabled")
+        return None
+    return RapidOCRTier()
@@ -4,7 +4,7 @@ import json
 import csv
 import shutil
 import cv2
-import ollama
+from ollama_router import get_router
 import os
 import numpy as np
 import concurrent.futures
@@ -216,7 +216,7 @@ class GPUHandler(FileSystemEventHandler):
         # On server, this hits localhost:11434, which manages the GPU
         prompt = "Read the text in this image. Return ONLY the value. No extra words."
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL,
                 messages=[{'role': 'user', 'content': prompt, 'images': [str(image_path)]}],
                 options={'num_predict': 20} 
@@ -9,7 +9,7 @@ import time
 import json
 import csv
 import cv2
-import ollama
+from ollama_router import get_router
 import os
 import re
 import numpy as np
@@ -311,7 +311,7 @@ class GPUHandler(FileSystemEventHandler):
         prompt = STAGE0_PROMPTS.get(roi_type, "Read the text. Return ONLY the value.")
         
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL_3B,
                 messages=[{'role': 'user', 'content': prompt, 'images': [str(image_path)]}],
                 options={
@@ -11,10 +11,10 @@ Enhanced OCR Server with Dynamic Prompts and Real-time Median Calculation
 
 import sys
 import time
+import atexit
 import json
 import csv
 import cv2
-import ollama
 import os
 import numpy as np
 import pandas as pd
@@ -28,17 +28,20 @@ from collections import defaultdict
 
 # 导入配置
 from config_pipeline import *
-
-# ================= Stage 0 专用简单Prompts =================
-# Simple prompts for Stage 0 OCR - based only on data field type
-# These are separate from Stage 1-6 prompts in config_pipeline.py
-STAGE0_PROMPTS = {
-    'STATUS': "What text do you see in this image? Reply with exactly one word: OK or NG or NA",
-    'INTEGER': "What integer number is shown? Reply with only the number, nothing else.",
-    'FLOAT': "What decimal number is shown? Reply with only the number (like 1.234), nothing else.",
-    'TIME': "What time is shown? Reply with only HH:MM:SS format, nothing else.",
-    'DATE': "What date/time is shown? Reply with only the text, nothing else.",
-}
+from inference_cache import cached_chat, get_inference_cache
+from inference_pool import get_inference_pool
+from artifact_writer import ArtifactWriter
+from csv_sink import BufferedCSVSink
+from frame_manifest import FrameManifest, scan_new_frames
+from roi_table import RoiTable
+from frame_decoder import render_debug_map
+from roi_reuse import RoiDiffCache, FrameDedup, completed_future
+from status_classifier import StatusColorClassifier
+from ocr_cascade import create_cascade
+from output_schema import value_request, parse_value, group_schema, get_status_audit
+from stage0_prompts import STAGE0_PROMPTS, clean_output, load_rois
+from stitched_inference import (build_stitch_groups, create_stitched_image, build_batch_prompt,
+                                parse_batch_json, is_well_formed, split_group_future)
 
 # ================= 预计算Median加载器 =================
 class PrecomputedMedianLoader:
@@ -154,15 +157,61 @@ class PrecomputedMedianLoader:
                       f"Range=[{stats['min']:.3f}, {stats['max']:.3f}], N={stats['count']}")
         print("="*60 + "\n")
 
-# 全局median加载器（使用预计算值）
-median_tracker = PrecomputedMedianLoader()
 print_lock = threading.Lock()
 
+# ================= 进程级单例（首次使用时创建） =================
+# 模块级不做任何初始化：STAGE0_DECODE_PROCESSES > 0 时spawn子进程会把本脚本作为 __mp_main__
+# 重新导入，不能在每个解码进程里读取全部 _Final.csv、启动写入线程或注册atexit
+_singleton_lock = threading.Lock()
+_median_tracker = None
+_artifact_writer = None
+_csv_sink = None
+
+
+def get_median_tracker():
+    """全局median加载器（使用预计算值）"""
+    global _median_tracker
+    with _singleton_lock:
+        if _median_tracker is None:
+            _median_tracker = PrecomputedMedianLoader()
+        return _median_tracker
+
+
+def get_artifact_writer():
+    """调试产物后台写入（不阻塞帧处理）"""
+    global _artifact_writer
+    with _singleton_lock:
+        if _artifact_writer is None:
+            _artifact_writer = ArtifactWriter()
+        return _artifact_writer
+
+
+def get_csv_sink():
+    """CSV结果缓冲写入（每个CSV一个常开句柄，按行数/时间刷盘），进程退出时关闭"""
+    global _csv_sink
+    with _singleton_lock:
+        if _csv_sink is None:
+            _csv_sink = BufferedCSVSink()
+            atexit.register(_csv_sink.close)
+        return _csv_sink
+
+
 # ================= 增强的GPU处理器 =================
 class EnhancedGPUHandler(FileSystemEventHandler):
-    def __init__(self, rois):
+    def __init__(self, rois, engine=None, manifest=None):
         self.rois = rois
         self.processed_count = 0
+        self.engine = engine  # PipelinedStage0Engine / SerialStage0Engine（None = 在调用线程里同步处理）
+        self.manifest = manifest  # FrameManifest（None = 不记录完成状态）
+        self.roi_table = RoiTable(rois)  # 预编译裁剪边界（每种帧尺寸一次）
+        self.roi_cache = RoiDiffCache() if ROI_REUSE_ENABLED else None
+        self.frame_dedup = FrameDedup(self.roi_table) if FRAME_DEDUP_ENABLED else None
+        self.status_classifier = StatusColorClassifier() if STATUS_CLASSIFIER_ENABLED else None
+        self.cascade = create_cascade()  # RapidOCR 第1层（None = 全部交给模型）
+        self.stitch_groups = build_stitch_groups([name for name, *_ in rois])
+        self.stitch_lock = threading.Lock()
+        self.stitch_calls = 0
+        self.stitch_fallbacks = 0
         
     def on_created(self, event):
         if not event.is_directory: 
@@ -178,10 +227,25 @@ class EnhancedGPUHandler(FileSystemEventHandler):
             return
         if file_path.name.startswith("."): 
             return
+        if self.manifest is not None and self.manifest.is_done(file_path):
+            return
         
+        # 交给引擎排队（去重 + 就绪检查 + 背压），立即返回
+        if self.engine is not None:
+            self.engine.submit(file_path)
+            return
+        self.process_frame(file_path)
+    
+    def process_frame(self, file_path: Path):
+        """单帧同步处理一张图像（SerialStage0Engine 的工作线程，或没有引擎时直接调用）"""
         self.processed_count += 1
         print(f"\n⚡ [{self.processed_count}] Processing: {file_path.name}")
         
+        target_image_folder, relative_parent = self.prepare_output_dirs(file_path)
+        self.run_parallel_pipeline(file_path, target_image_folder, relative_parent)
+    
+    def prepare_output_dirs(self, file_path: Path):
+        """计算相对路径并创建调试目录，返回 (调试目录, 相对父目录)"""
         try:
             relative_path = file_path.relative_to(SOURCE_DIR)
         except ValueError:
@@ -193,8 +257,7 @@ class EnhancedGPUHandler(FileSystemEventHandler):
         image_folder_name = file_path.stem
         target_image_folder = STAGE_1_OCR / "debug_crops" / relative_parent / image_folder_name
         target_image_folder.mkdir(parents=True, exist_ok=True)
-        
-        self.run_parallel_pipeline(file_path, target_image_folder, relative_parent)
+        return target_image_folder, relative_parent
     
     def parse_filename_time(self, filename):
         """从文件名解析时间"""
@@ -217,161 +280,119 @@ class EnhancedGPUHandler(FileSystemEventHandler):
         except: 
             return text_str
     
-    def is_image_too_dark(self, img):
-        """简单检查图像是否太暗"""
-        if img is None or img.size == 0:
-            return True
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        mean_brightness = np.mean(gray)
-        if mean_brightness < DARKNESS_THRESHOLD:
-            bright_pixels = np.sum(gray > 100)
-            if bright_pixels < (img.size * 0.01):
-                return True
-        return False
-    
-    def ask_ollama_simple(self, image_path, roi_id):
+    def ask_ollama_simple(self, image, roi_id, raise_errors=False):
         """
         Stage 0 专用简单OCR调用 - 仅基于ROI类型
         Simple OCR for Stage 0 - based only on ROI field type
+        
+        image: 裁剪图像路径，或已编码的JPEG字节（内存模式）
+        raise_errors: 调用失败时抛出异常而不是返回"NA"（供清单区分失败和真实NA）
+        未配置类型的ROI（机器时间戳 51、ROI 0）用通用prompt，不加schema
         """
-        roi_type = get_roi_type(roi_id)
+        roi_type = get_roi_type(roi_id, default=None)
         
         # 使用Stage 0专用简单prompt
         prompt = STAGE0_PROMPTS.get(roi_type, "Read the text. Output only the value.")
+        prompt, output_format = value_request(prompt, roi_type)
         
         try:
-            response = ollama.chat(
+            response = cached_chat(
                 model=OLLAMA_MODEL_3B,
                 messages=[{
                     'role': 'user', 
                     'content': prompt, 
-                    'images': [str(image_path)]
+                    'images': [image if isinstance(image, bytes) else str(image)]
                 }],
                 options={
                     'temperature': 0.0,
                     'num_predict': 30
-                }
+                },
+                **output_format
             )
-            raw = response['message']['content'].strip()
+            raw = parse_value(response['message']['content'].strip())
             
             # 清理输出
             clean = self.clean_output(raw, roi_type)
-            return clean
             
         except Exception as e:
             with print_lock:
                 print(f"c", end="", flush=True)
+            if raise_errors:
+                raise
             return "NA"
+        
+        if output_format and roi_type == 'STATUS':
+            self.audit_status(image, roi_id, clean)
+        return clean
     
-    def clean_output(self, raw_text, roi_type):
+    def audit_status(self, image, roi_id, constrained):
         """
-        清理模型输出 - 仅移除特殊tokens，严格解析
-        Clean model output - remove special tokens, strict parsing
+        抽样：同一裁剪不带schema再问一次，记录约束答案是否掩盖了误读
+        只统计和告警，不改变写出的读数
         """
-        import re
-        
-        if not raw_text:
-            return "NA"
-        
-        # 移除模型特殊tokens
-        special_tokens = [
-            r'<\|im_start\|>', r'<\|im_end\|>', r'<\|endoftext\|>',
-            r'<\|pad\|>', r'<\|assistant\|>', r'<\|user\|>', r'<\|system\|>',
-        ]
-        text = raw_text
-        for token in special_tokens:
-            text = re.sub(token, '', text)
-        
-        # 移除HTML标签和markdown
-        text = re.sub(r'<[^>]+>', '', text)
-        text = text.replace('```', '').replace('`', '').strip()
-        
-        # 只取第一行第一个词
-        text = text.split('\n')[0].strip()
-        text = text.split()[0] if text.split() else text
-        
-        # 根据类型处理 - 严格解析
-        if roi_type == 'STATUS':
-            upper = text.upper().strip()
-            # 严格匹配：只有当文本就是OK或NG时才返回
-            if upper == 'OK':
-                return 'OK'
-            if upper == 'NG':
-                return 'NG'
-            if upper == 'NA':
-                return 'NA'
-            # 检查是否是数字（说明这不是STATUS字段的图像）
-            if re.match(r'^-?\d+\.?\d*$', text.strip()):
-                return text  # 返回数字本身，不是OK
-            # 如果文本包含NG（严格一点）
-            if upper.startswith('NG') or upper == 'N':
-                return 'NG'
-            # 如果文本包含OK（严格一点）  
-            if upper.startswith('OK') or upper == 'O':
-                return 'OK'
-            return text  # 返回原始文本
-        
-        elif roi_type == 'INTEGER':
-            match = re.search(r'-?\d+', text)
-            return match.group(0) if match else text
-        
-        elif roi_type == 'FLOAT':
-            match = re.search(r'-?\d+\.?\d*', text)
-            if match:
-                try:
-                    val = float(match.group(0))
-                    return f"{val:.3f}".rstrip('0').rstrip('.')
-                except:
-                    pass
-            return text
-        
-        elif roi_type == 'TIME':
-            match = re.search(r'\d{1,2}:\d{2}:\d{2}', text)
-            return match.group(0) if match else text
-        
-        return text
+        audit = get_status_audit()
+        if audit is None or not audit.should_check():
+            return
+        try:
+            response = cached_chat(
+                model=OLLAMA_MODEL_3B,
+                messages=[{
+                    'role': 'user',
+                    'content': STAGE0_PROMPTS['STATUS'],
+                    'images': [image if isinstance(image, bytes) else str(image)]
+                }],
+                options={
+                    'temperature': 0.0,
+                    'num_predict': 30
+                },
+            )
+            free = self.clean_output(response['message']['content'].strip(), 'STATUS')
+        except Exception:
+            audit.record_error()
+            return
+        if audit.record(roi_id, constrained, free):
+            with print_lock:
+                print(f"\n  🔎 STATUS ROI_{roi_id}: schema answer {constrained}, "
+                      f"unconstrained answer {free}")
     
-    def process_single_roi(self, args):
-        """并行处理单个ROI - Stage 0简化版"""
-        name, x, y, w, h, img, save_dir = args
-        H, W = img.shape[:2]
-        
-        # 1. 边界检查
-        if x >= W or y >= H: 
-            return name, "NA"
-        
-        # 2. 裁剪
-        x0, y0 = max(0, x - ROI_PAD), max(0, y - ROI_PAD)
-        x1, y1 = min(W, x + w + ROI_PAD), min(H, y + h + ROI_PAD)
-        crop = img[y0:y1, x0:x1]
-        
-        if crop.size == 0: 
-            return name, "NA"
-        
-        # 3. 上采样
-        if UPSCALE != 1.0:
-            crop = cv2.resize(crop, None, fx=UPSCALE, fy=UPSCALE, 
-                            interpolation=cv2.INTER_CUBIC)
+    clean_output = staticmethod(clean_output)
+    
+    def infer_roi(self, name, crop, save_dir, raise_errors=False, tier=None):
+        """
+        对已裁剪的ROI执行保存、亮度检查和OCR
+        tier: 可选Future，设为产生读数的层级（'rapidocr' / 'model'）
+        """
+        try:
+            return self._infer_roi(name, crop, save_dir, raise_errors, tier)
+        finally:
+            set_tier(tier, 'model')
+    
+    def _infer_roi(self, name, crop, save_dir, raise_errors, tier):
+        if crop is None:
+            return "NA"
         
         # 4. 保存裁剪
         crop_filename = save_dir / f"ROI_{name}.jpg"
-        cv2.imwrite(str(crop_filename), crop)
+        if STAGE0_INMEMORY_CROPS:
+            model_input = self.encode_crop(name, crop, save_dir)
+            if model_input is None:
+                return "NA"
+        else:
+            cv2.imwrite(str(crop_filename), crop)
+            model_input = crop_filename
         
-        # 5. 简单亮度检查（无颜色分析）
-        if self.is_image_too_dark(crop):
-            with print_lock:
-                print("D", end="", flush=True)
-            return name, "NA"
+        # 5. 亮度检查已在裁剪前完成（RoiTable.dark_rois），暗ROI不会到这里
         
-        # 6. OCR识别（简单prompt，无颜色逻辑）
-        text_val = self.ask_ollama_simple(crop_filename, name)
+        # 6. OCR识别：数字/时间ROI先走RapidOCR，不通过校验再用简单prompt问模型
+        text_val = self.read_cascade(name, crop)
+        if text_val is not None:
+            set_tier(tier, 'rapidocr')
+        else:
+            text_val = self.ask_ollama_simple(model_input, name, raise_errors=raise_errors)
         
-        # 7. 保存文本结果
-        try:
-            with open(save_dir / f"ROI_{name}.txt", "w", encoding="utf-8") as f:
-                f.write(text_val)
-        except: 
-            pass
+        # 7. 保存文本结果（后台写入）
+        if get_artifact_writer().enabled('roi_text', save_dir):
+            get_artifact_writer().write_text('roi_text', save_dir / f"ROI_{name}.txt", text_val)
         
         # 8. 输出进度
         with print_lock:
@@ -380,49 +401,456 @@ class EnhancedGPUHandler(FileSystemEventHandler):
             else:
                 print(".", end="", flush=True)
         
-        return name, text_val
+        return text_val
+    
+    def read_cascade(self, name, crop):
+        """RapidOCR 第1层：读数通过校验时返回清理后的值，否则返回None（升级到模型）"""
+        if self.cascade is None or not self.cascade.handles(name):
+            return None
+        text = self.cascade.read(name, crop)
+        if text is None:
+            return None
+        with print_lock:
+            print("o", end="", flush=True)
+        return self.clean_output(text, get_roi_type(name))
+    
+    def classify_status(self, name, crop, save_dir):
+        """
+        STATUS ROI 颜色快速通道：高置信度时保存产物并返回 'OK'/'NG'，否则返回None
+        只处理 ROI_CONFIGS 中明确标为 STATUS 的ROI（未配置的ROI如时间戳51、ROI 0不参与）
+        """
+        if not self.color_applies(name):
+            return None
+        label, _ = self.status_classifier.classify(name, crop)
+        if label is None:
+            return None
+        if get_artifact_writer().enabled('roi_crop', save_dir):
+            get_artifact_writer().write_image('roi_crop', save_dir / f"ROI_{name}.jpg", crop)
+        if get_artifact_writer().enabled('roi_text', save_dir):
+            get_artifact_writer().write_text('roi_text', save_dir / f"ROI_{name}.txt", label)
+        with print_lock:
+            print("+" if label == 'OK' else "-", end="", flush=True)
+        return label
+    
+    def color_applies(self, name):
+        """该ROI是否走 STATUS 颜色快速通道"""
+        return self.status_classifier is not None and get_roi_type(name, default=None) == 'STATUS'
+    
+    def settle_dark_roi(self, name, crop, save_dir):
+        """
+        暗ROI不送推理，返回 (读数, 来源)
+        STATUS ROI 仍先试颜色快速通道（与原来"先颜色、后亮度检查"的顺序一致）
+        """
+        if crop is not None:
+            label = self.classify_status(name, crop, save_dir)
+            if label is not None:
+                return label, 'color'
+            if get_artifact_writer().enabled('roi_crop', save_dir):
+                get_artifact_writer().write_image('roi_crop', save_dir / f"ROI_{name}.jpg", crop)
+        with print_lock:
+            print("D", end="", flush=True)
+        return "NA", 'dark'
+    
+    def encode_crop(self, name, crop, save_dir):
+        """只编码一次：同一份JPEG字节既发给模型，也（异步）写入调试目录"""
+        ok, buf = cv2.imencode(".jpg", crop)
+        if not ok:
+            return None
+        data = buf.tobytes()
+        if get_artifact_writer().enabled('roi_crop', save_dir):
+            get_artifact_writer().write_bytes('roi_crop', save_dir / f"ROI_{name}.jpg", data)
+        return data
+    
+    def ask_ollama_stitched(self, crops):
+        """
+        拼图识别：[(name, crop), ...] 拼成一张图，一次调用返回 {id: 原始文本}
+        只包含JSON中存在且格式正确的ID
+        """
+        ids = [name for name, _ in crops]
+        canvas = create_stitched_image(crops)
+        ok, buf = cv2.imencode(".png", canvas)
+        if not ok:
+            return {}
+        response = cached_chat(
+            model=OLLAMA_MODEL_3B,
+            messages=[{
+                'role': 'user',
+                'content': build_batch_prompt(ids),
+                'images': [buf.tobytes()]
+            }],
+            options={
+                'temperature': 0.0,
+                'num_predict': 16 * len(ids) + 32
+            },
+            format=group_schema(ids) if STRUCTURED_OUTPUT_ENABLED else 'json'
+        )
+        return parse_batch_json(response['message']['content'], ids)
+    
+    def infer_group(self, items, save_dir, raise_errors=False, tiers=None):
+        """
+        拼图模式：一组ROI [(name, crop), ...] 一次模型调用
+        RapidOCR 已读出的ROI不进拼图；缺失或格式不对的ID回退到单ROI调用
+        返回 {name: text 或 Exception}；tiers: {name: Future}，设为产生读数的层级
+        """
+        tiers = tiers or {}
+        try:
+            return self._infer_group(items, save_dir, raise_errors, tiers)
+        finally:
+            for future in tiers.values():
+                set_tier(future, 'stitched')
+    
+    def _infer_group(self, items, save_dir, raise_errors, tiers):
+        results = {}
+        encoded = {}
+        stitch = []
+        for name, crop in items:
+            data = self.encode_crop(name, crop, save_dir)
+            if data is None:
+                results[name] = "NA"
+            else:
+                text_val = self.read_cascade(name, crop)
+                if text_val is not None:
+                    results[name] = text_val
+                    set_tier(tiers.get(name), 'rapidocr')
+                    continue
+                encoded[name] = data
+                stitch.append((name, crop))
+        
+        # 只有一个ROI时直接单ROI调用（prompt更简单）
+        parsed = {}
+        if len(stitch) > 1:
+            try:
+                parsed = self.ask_ollama_stitched(stitch)
+            except Exception:
+                parsed = {}
+            with self.stitch_lock:
+                self.stitch_calls += 1
+        
+        for name, _ in stitch:
+            roi_type = get_roi_type(name, default=None)
+            if name in parsed:
+                text_val = self.clean_output(parsed[name], roi_type)
+                if is_well_formed(text_val, roi_type):
+                    results[name] = text_val
+                    continue
+            with self.stitch_lock:
+                self.stitch_fallbacks += 1
+            set_tier(tiers.get(name), 'model')
+            try:
+                results[name] = self.ask_ollama_simple(encoded[name], name, raise_errors=raise_errors)
+            except Exception as e:
+                results[name] = e
+        
+        # 保存文本结果（后台写入）并输出进度
+        if get_artifact_writer().enabled('roi_text', save_dir):
+            for name, text_val in results.items():
+                if not isinstance(text_val, Exception):
+                    get_artifact_writer().write_text('roi_text', save_dir / f"ROI_{name}.txt", text_val)
+        with print_lock:
+            print(f"[{len(stitch)}]", end="", flush=True)
+        return results
+    
+    def crop_frame(self, img, save_dir, skip=(), prepared=None):
+        """
+        暗ROI筛查（积分图，O(1)/ROI）+ 一次裁剪全部ROI，返回 ({name: crop 或 None}, 暗ROI集合)
+        暗ROI不送推理；只有需要保存ROI裁剪（后续阶段按帧查找）或要走颜色通道时才为它们裁剪
+        prepared: 子进程已完成的 PreparedFrame（frame_decoder），此时 img 为None
+        """
+        skip = set(skip)
+        if prepared is not None:
+            return ({name: crop for name, crop in prepared.crops.items() if name not in skip},
+                    prepared.dark - skip)
+        dark = self.roi_table.dark_rois(img) - skip
+        keep = self.dark_crops_needed(save_dir)
+        if keep is not None:
+            skip |= dark - keep
+        return self.roi_table.crop_all(img, skip=skip), dark
+    
+    def dark_crops_needed(self, save_dir):
+        """仍需裁剪的暗ROI：需要保存ROI裁剪时全部（None），否则只有走颜色通道的ROI"""
+        if get_artifact_writer().enabled('roi_crop', save_dir):
+            return None
+        return {name for name in self.roi_table.names if self.color_applies(name)}
+    
+    def submit_frame(self, img, save_dir, pool, known=None, raise_errors=False, prepared=None):
+        """
+        裁剪一帧的所有ROI并提交推理，返回 ({roi: Future}, {roi: 来源})（按roi.json顺序）
+        known: 已知读数（清单重试）；与上一帧相同的ROI复用上一次的Future
+        STAGE0_INFERENCE_MODE = 'stitched' 时每个拼图组提交一个任务
+        """
+        known = known or {}
+        futures, sources = {}, {}
+        pending = []  # 需要推理的 (name, crop, reuse_key)
+        crops, dark = self.crop_frame(img, save_dir, skip=known, prepared=prepared)
+        for name in self.roi_table.names:
+            if name in known:
+                futures[name] = completed_future(known[name])
+                sources[name] = 'resumed'
+                continue
+            if name in dark:
+                value, sources[name] = self.settle_dark_roi(name, crops.get(name), save_dir)
+                futures[name] = completed_future(value)
+                continue
+            crop = crops[name]
+            if crop is None:
+                # 越界/空裁剪：不占用推理线程池
+                futures[name] = completed_future("NA")
+                sources[name] = 'no_crop'
+                continue
+            
+            # 与上一帧的参考裁剪相同：复用那次推理的Future
+            key = None
+            if self.roi_cache is not None:
+                key = self.reuse_key(save_dir, name)
+                previous = self.roi_cache.match(key, crop)
+                if previous is not None:
+                    self.reuse_roi(name, crop, save_dir, previous)
+                    futures[name] = previous
+                    sources[name] = 'reused'
+                    continue
+            
+            # STATUS 颜色快速通道：高置信度 OK/NG 不调用模型
+            label = self.classify_status(name, crop, save_dir)
+            if label is not None:
+                futures[name] = completed_future(label)
+                sources[name] = 'color'
+                if self.roi_cache is not None:
+                    self.roi_cache.remember(key, crop, futures[name])
+                continue
+            pending.append((name, crop, key))
+        
+        if STAGE0_INFERENCE_MODE == 'stitched':
+            by_name = {name: (crop, key) for name, crop, key in pending}
+            for group in self.stitch_groups:
+                items = [(name, by_name[name][0]) for name in group if name in by_name]
+                if not items:
+                    continue
+                tiers = {name: concurrent.futures.Future() for name, _ in items}
+                group_future = pool.submit(self.infer_group, items, save_dir, raise_errors, tiers)
+                for name, child in split_group_future(group_future, [n for n, _ in items]).items():
+                    futures[name] = child
+                    sources[name] = tiers[name]
+        else:
+            for name, crop, key in pending:
+                # 来源在推理完成时才知道（RapidOCR 或模型），先放一个Future
+                tier = concurrent.futures.Future()
+                futures[name] = pool.submit(self.infer_roi, name, crop, save_dir, raise_errors, tier)
+                sources[name] = tier
+        
+        if self.roi_cache is not None:
+            for name, crop, key in pending:
+                self.roi_cache.remember(key, crop, futures[name])
+        
+        # 保持roi.json顺序（写CSV/清单时按此顺序）
+        order = [name for name, *_ in self.rois]
+        return ({name: futures[name] for name in order},
+                {name: sources[name] for name in order})
+    
+    def print_stitch_stats(self):
+        """打印拼图模式统计"""
+        if STAGE0_INFERENCE_MODE == 'stitched':
+            with self.stitch_lock:
+                print(f"🧩 Stitched: {self.stitch_calls} group calls, "
+                      f"{self.stitch_fallbacks} per-ROI fallbacks")
+    
+    def reuse_key(self, save_dir, name):
+        """ROI复用的键：同一相机目录下的同一ROI"""
+        return (str(save_dir.parent), name)
+    
+    def reuse_roi(self, name, crop, save_dir, previous, show=True):
+        """复用上一帧的读数：不调用模型，但照常保存裁剪和文本（后续阶段按帧查找裁剪）"""
+        if crop is not None and get_artifact_writer().enabled('roi_crop', save_dir):
+            get_artifact_writer().write_image('roi_crop', save_dir / f"ROI_{name}.jpg", crop)
+        if get_artifact_writer().enabled('roi_text', save_dir):
+            text_path = save_dir / f"ROI_{name}.txt"
+            def write_text(future):
+                if future.exception() is None:
+                    get_artifact_writer().write_text('roi_text', text_path, future.result())
+            previous.add_done_callback(write_text)
+        if show:
+            with print_lock:
+                print("r", end="", flush=True)
+    
+    def adopt_duplicate_frame(self, img, save_dir, leader, prepared=None):
+        """
+        整帧重复：沿用上一帧的全部读数 {roi: Future}，不调用模型
+        只有需要保存ROI裁剪时才裁剪/上采样（后续阶段按帧目录查找裁剪）
+        返回 (futures, sources)
+        """
+        want_crops = get_artifact_writer().enabled('roi_crop', save_dir)
+        if prepared is not None:
+            crops = prepared.crops
+        else:
+            crops = self.roi_table.crop_all(img) if want_crops else {}
+        futures, sources = {}, {}
+        for name in self.roi_table.names:
+            crop = crops.get(name)
+            if crop is not None or not want_crops:
+                self.reuse_roi(name, crop, save_dir, leader[name], show=False)
+            futures[name] = leader[name]
+            sources[name] = 'frame_dup'
+        with print_lock:
+            print("=", end="", flush=True)
+        return futures, sources
+    
+    def process_single_roi(self, args):
+        """
+        并行处理单个已裁剪的ROI - Stage 0简化版，返回 (name, text, 来源, 是否失败)
+        模型调用失败的ROI读数为"NA"，不进入复用缓存
+        """
+        name, crop, save_dir = args
+        if crop is None:
+            return name, "NA", 'no_crop', False
+        
+        key = None
+        if self.roi_cache is not None:
+            key = self.reuse_key(save_dir, name)
+            previous = self.roi_cache.match(key, crop)
+            if previous is not None:
+                try:
+                    text_val = previous.result()
+                except Exception:
+                    pass  # 被复用的读数失败了：本帧自己推理
+                else:
+                    self.reuse_roi(name, crop, save_dir, previous)
+                    return name, text_val, 'reused', False
+        
+        text_val = self.classify_status(name, crop, save_dir)
+        source = 'color'
+        if text_val is None:
+            tier = concurrent.futures.Future()
+            try:
+                text_val = self.infer_roi(name, crop, save_dir, raise_errors=True, tier=tier)
+            except Exception as e:
+                with print_lock:
+                    print(f"\n  ❌ ROI_{name} error: {e}")
+                return name, "NA", 'model', True
+            source = tier.result()
+        if self.roi_cache is not None:
+            self.roi_cache.remember(key, crop, completed_future(text_val))
+        return name, text_val, source, False
+    
+    def debug_map_path(self, save_dir):
+        """该帧需要调试地图时返回保存路径，否则返回None"""
+        if get_artifact_writer().enabled('debug_map', save_dir):
+            return save_dir / "_DEBUG_MAP.jpg"
+        return None
+    
+    def write_debug_map(self, img, save_dir):
+        """绘制调试地图（ROI框+编号）- 复制和绘制都在后台线程完成"""
+        out_path = self.debug_map_path(save_dir)
+        if out_path is not None:
+            get_artifact_writer().submit('debug_map', render_debug_map, img, self.rois, out_path)
     
     def run_parallel_pipeline(self, img_path, save_dir, relative_parent):
-        """并行处理管道"""
+        """并行处理管道（单帧同步模式）"""
         img = cv2.imread(str(img_path))
         if img is None:
             print(f"  ❌ Cannot read image: {img_path}")
             return
         
         # 绘制调试地图
-        try:
-            vis_img = img.copy()
-            for name, x, y, w, h in self.rois:
-                cv2.rectangle(vis_img, (x, y), (x+w, y+h), (0, 0, 255), 2)
-                cv2.putText(vis_img, name, (x, y-5), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-            cv2.imwrite(str(save_dir / "_DEBUG_MAP.jpg"), vis_img)
-        except: 
-            pass
+        self.write_debug_map(img, save_dir)
+        
+        # 重试帧：清单中已成功的ROI直接复用，不再调用模型
+        known = self.manifest.load_ok_rois(img_path) if self.manifest is not None else {}
+        
+        # 整帧去重（重试帧除外）：与上一帧相同则直接沿用上一帧的读数
+        dedup_key = str(save_dir.parent)
+        fp = None
+        if self.frame_dedup is not None and not known:
+            fp = self.frame_dedup.fingerprint(img)
+            leader = self.frame_dedup.match(dedup_key, fp)
+            if leader is not None:
+                futures, sources = self.adopt_duplicate_frame(img, save_dir, leader)
+                print(f"\n  --> Duplicate frame, reused {len(futures)} ROIs")
+                collected_results = {name: f.result() for name, f in futures.items()}
+                token, _ = self.record_manifest(img_path, collected_results, set())
+                self.write_frame_results(img_path, collected_results, save_dir, relative_parent,
+                                         token, sources=sources)
+                return
         
-        print(f"  --> Processing {len(self.rois)} ROIs with {MAX_WORKERS_3B} workers...")
+        print(f"  --> Processing {len(self.rois)} ROIs with {INFERENCE_POOL_WORKERS} workers...")
         start_t = time.time()
         
         collected_results = {}
+        sources = {}
+        failed = set()  # 模型调用失败的ROI（读数记为"NA"）
+        pool = get_inference_pool()
         
-        # 准备并行任务
-        tasks = [(name, x, y, w, h, img, save_dir) for name, x, y, w, h in self.rois]
-        
-        # 并行执行
-        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS_3B) as executor:
-            results = executor.map(self.process_single_roi, tasks)
-            for name, text_val in results:
+        if STAGE0_INFERENCE_MODE == 'stitched':
+            # 拼图模式：每组一次调用（失败保留在Future中，复用缓存不会沿用）
+            futures, sources = self.submit_frame(img, save_dir, pool, known, raise_errors=True)
+            for name, future in futures.items():
+                try:
+                    collected_results[name] = future.result()
+                except Exception:
+                    collected_results[name] = "NA"
+                    failed.add(name)
+        else:
+            # 准备并行任务：在本线程一次裁剪全部ROI，推理线程只接收现成的裁剪
+            crops, dark = self.crop_frame(img, save_dir, skip=known)
+            for name, value in known.items():
+                collected_results[name], sources[name] = value, 'resumed'
+            for name in dark:
+                collected_results[name], sources[name] = self.settle_dark_roi(
+                    name, crops.get(name), save_dir)
+            tasks = [(name, crops[name], save_dir) for name in self.roi_table.names
+                     if name not in dark and name not in known]
+            
+            # 并行执行（进程级共享线程池，不再每张图像新建）
+            futures = [pool.submit(self.process_single_roi, task) for task in tasks]
+            for future in futures:
+                name, text_val, source, error = future.result()
                 collected_results[name] = text_val
+                sources[name] = source
+                if error:
+                    failed.add(name)
+            collected_results = {name: collected_results[name] for name in self.roi_table.names}
+        
+        # 有失败ROI的帧不作为整帧去重的参考
+        if fp is not None and not failed:
+            self.frame_dedup.remember(
+                dedup_key, fp, {name: completed_future(v) for name, v in collected_results.items()})
         
         duration = time.time() - start_t
         print(f"\n  --> Finished in {duration:.1f}s")
         
-        # 保存JSON结果
-        try:
-            with open(save_dir / "results.json", "w", encoding="utf-8") as f:
-                json.dump(collected_results, f, indent=2, ensure_ascii=False)
-        except: 
-            pass
+        token, deferred = self.record_manifest(img_path, collected_results, failed)
+        if deferred:
+            return
+        self.write_frame_results(img_path, collected_results, save_dir, relative_parent, token,
+                                 sources=sources)
+        
+        # 打印median统计（每10个图像）
+        if self.processed_count % 10 == 0:
+            self.print_median_stats()
+    
+    def record_manifest(self, img_path, results, failed):
+        """
+        在清单中记录一帧的结果，返回 (token, 是否推迟写CSV)
+        有失败ROI且 STAGE0_WRITE_FAILED_FRAMES = False 时推迟：
+        暂不写CSV，下次启动时只重试失败的ROI，避免写出半帧NA后无法修正
+        """
+        if self.manifest is None:
+            return None, False
+        self.manifest.record_frame(img_path, results, failed)
+        if failed and not STAGE0_WRITE_FAILED_FRAMES:
+            print(f"\n⚠️  {img_path.name}: {len(failed)} ROI(s) failed, deferred to next start")
+            return None, True
+        return img_path, False
+    
+    def write_frame_results(self, img_path, collected_results, save_dir, relative_parent,
+                            token=None, sources=None):
+        """
+        保存单帧的JSON结果并追加到各CSV
+        token 随该帧最后一行交给 csv_sink：该行刷盘即代表整帧已写入
+        sources: {roi: 读数来源}，写入 Stage0_Value_Source_Log.csv 供审计
+        """
+        # 保存JSON结果（后台写入）
+        if get_artifact_writer().enabled('results_json', save_dir):
+            get_artifact_writer().write_json('results_json', save_dir / "results.json",
+                                       dict(collected_results))
         
         # 解析元数据
         filename_utc = self.parse_filename_time(img_path.name)
@@ -431,29 +859,59 @@ class EnhancedGPUHandler(FileSystemEventHandler):
             raw_machine_time = collected_results.get("52", "")
         calc_machine_utc = self.parse_machine_time(raw_machine_time)
         
+        # 读数来源审计（在数据CSV之前写，token留给该帧最后一行）
+        if STAGE0_SOURCE_LOG and sources:
+            self.append_source_log(img_path.name, filename_utc, sources, relative_parent)
+        
         # 写入CSV
-        for csv_name, id_range in CSV_GROUPS.items():
+        last = len(CSV_GROUPS) - 1
+        for i, (csv_name, id_range) in enumerate(CSV_GROUPS.items()):
             self.append_to_summary_csv(
                 csv_name, id_range, collected_results,
                 img_path.name, filename_utc, raw_machine_time,
-                calc_machine_utc, relative_parent
+                calc_machine_utc, relative_parent,
+                token=token if i == last else None
             )
-        
-        # 打印median统计（每10个图像）
-        if self.processed_count % 10 == 0:
-            self.print_median_stats()
     
     def print_median_stats(self):
         """打印median统计信息"""
-        median_tracker.print_all_stats()
+        get_median_tracker().print_all_stats()
+    
+    def print_skip_stats(self):
+        """打印各类跳过模型调用的统计（ROI复用/整帧去重/颜色分类/RapidOCR/拼图）"""
+        if self.roi_cache is not None:
+            print(f"♻️  ROI reuse: {self.roi_cache.stats()}")
+        if self.frame_dedup is not None:
+            print(f"🪞 Frame dedup: {self.frame_dedup.stats()}")
+        if self.status_classifier is not None:
+            self.status_classifier.print_stats()
+        if self.cascade is not None:
+            self.cascade.print_stats()
+        self.print_stitch_stats()
+        audit = get_status_audit()
+        if audit is not None:
+            audit.print_stats()
+    
+    def append_source_log(self, filename, file_utc, sources, relative_parent):
+        """
+        每帧一行，记录每个ROI读数的来源
+        （rapidocr / model / stitched / color / dark / reused / frame_dup / resumed / no_crop）
+        文件名含 "_Log"，Stage 1 扫描CSV时会跳过
+        """
+        csv_path = STAGE_1_OCR / relative_parent / "CSV_Results" / "Stage0_Value_Source_Log.csv"
+        header = ["Filename", "File_UTC"] + [f"ROI_{name}" for name, *_ in self.rois]
+        row = [filename, file_utc] + [resolve_source(sources.get(name, "NA"))
+                                      for name, *_ in self.rois]
+        try:
+            get_csv_sink().write_row(csv_path, header, row)
+        except Exception as e:
+            print(f"  ❌ CSV Write Error: {e}")
     
     def append_to_summary_csv(self, csv_name, id_list, results_dict, 
                              filename, file_utc, raw_mach, calc_mach, 
-                             relative_parent):
-        """追加结果到CSV"""
-        target_folder = STAGE_1_OCR / relative_parent / "CSV_Results"
-        target_folder.mkdir(parents=True, exist_ok=True)
-        csv_path = target_folder / csv_name
+                             relative_parent, token=None):
+        """追加结果到CSV（经由缓冲写入器，不占用 print_lock）"""
+        csv_path = STAGE_1_OCR / relative_parent / "CSV_Results" / csv_name
         
         header = ["Filename", "File_UTC", "Machine_Text", "Machine_UTC"]
         target_ids = []
@@ -472,40 +930,24 @@ class EnhancedGPUHandler(FileSystemEventHandler):
             val = results_dict.get(tid, "NA").replace("\n", " ").replace(",", ".")
             row.append(val)
         
-        with print_lock:
-            try:
-                file_exists = csv_path.exists()
-                with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    if not file_exists: 
-                        writer.writerow(header)
-                    writer.writerow(row)
-            except Exception as e:
-                print(f"  ❌ CSV Write Error: {e}")
+        try:
+            get_csv_sink().write_row(csv_path, header, row, token)
+        except Exception as e:
+            print(f"  ❌ CSV Write Error: {e}")
 
 # ================= 辅助函数 =================
-def load_rois(roi_path: Path):
-    """加载ROI配置"""
-    if not roi_path.exists(): 
-        return []
-    try:
-        with open(roi_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        rois = []
-        data_list = data if isinstance(data, list) else [data]
-        for idx, item in enumerate(data_list):
-            name = item.get("name", str(idx))
-            rois.append((
-                str(name), 
-                int(item["x"]), 
-                int(item["y"]), 
-                int(item["w"]), 
-                int(item["h"])
-            ))
-        return rois
-    except Exception as e:
-        print(f"❌ Error loading ROI: {e}")
-        return []
+def set_tier(tier, value):
+    """设置读数层级Future（只设置一次，之后的调用忽略）"""
+    if tier is not None and not tier.done():
+        tier.set_result(value)
+
+
+def resolve_source(source):
+    """来源可能是层级Future（推理完成时设置）；写日志时帧已完成，直接取值"""
+    if isinstance(source, concurrent.futures.Future):
+        return source.result() if source.done() else "model"
+    return source
+
 
 def main():
     """主函数"""
@@ -527,30 +969,41 @@ def main():
     print("="*60)
     print("🚀 Enhanced OCR Server Started (3B Model)")
     print(f"   Model: {OLLAMA_MODEL_3B}")
-    print(f"   Workers: {MAX_WORKERS_3B} (Parallel)")
+    print(f"   Workers: {INFERENCE_POOL_WORKERS} (Shared inference pool)")
+    print(f"   Mode: {'Pipelined (cross-image)' if STAGE0_PIPELINED else 'Per-image'}")
     print(f"   ROIs: {len(rois)} configured")
     print(f"   Watch Folder: {SOURCE_DIR}")
     print(f"   Output: {STAGE_1_OCR}")
     print("="*60)
     
-    handler = EnhancedGPUHandler(rois)
+    # 进程级单例：median加载器（读取已有 _Final.csv）、CSV缓冲写入、产物写入线程
+    get_median_tracker()
+    csv_sink = get_csv_sink()
+    artifact_writer = get_artifact_writer()
+    
+    # 已处理帧清单：CSV行刷盘后才标记帧完成
+    manifest = None
+    if STAGE0_MANIFEST:
+        manifest = FrameManifest(STAGE0_MANIFEST)
+        csv_sink.on_flush = manifest.mark_done
+        print(f"📒 Manifest: {len(manifest.done)} frames done, "
+              f"{len(manifest.incomplete_keys())} with failed ROIs to retry")
+    
+    handler = EnhancedGPUHandler(rois, manifest=manifest)
+    from stage0_pipeline import PipelinedStage0Engine, SerialStage0Engine
+    engine_class = PipelinedStage0Engine if STAGE0_PIPELINED else SerialStage0Engine
+    handler.engine = engine_class(handler).start()
     
     # 1. 扫描现有文件
     print("\n📁 Scanning directory tree...")
-    all_files = list(SOURCE_DIR.rglob("*"))
-    
-    image_files = [
-        f for f in all_files
-        if f.suffix.lower() in {'.jpg', '.jpeg', '.png', '.bmp'}
-        and not f.name.startswith(".")
-    ]
-    image_files.sort()
+    image_files, sealed_dirs = scan_new_frames(SOURCE_DIR, manifest)
     
     total = len(image_files)
-    print(f"Found {total} images. Starting batch...\n")
+    done = len(manifest.done) if manifest is not None else 0
+    print(f"Found {total} new images ({done} already done, "
+          f"{sealed_dirs} finished directories skipped). Starting batch...\n")
     
-    for i, img_path in enumerate(image_files):
-        print(f"[{i+1}/{total}]", end=" ")
+    for img_path in image_files:
         try:
             handler.process_new_file(img_path)
         except KeyboardInterrupt:
@@ -560,8 +1013,20 @@ def main():
         except Exception as e:
             print(f"\n❌ Error processing {img_path.name}: {e}")
     
+    try:
+        handler.engine.wait_idle()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopped by user.")
+        handler.print_median_stats()
+        return
+    
+    csv_sink.flush()
     print("\n✅ Batch done. Monitoring for NEW files...")
     handler.print_median_stats()
+    artifact_writer.print_stats()
+    handler.engine.print_stats()
+    if get_inference_cache() is not None:
+        get_inference_cache().print_stats()
     
     # 2. 监控新文件
     observer = Observer()
@@ -576,6 +1041,12 @@ def main():
         print("\n🛑 Server stopped.")
         handler.print_median_stats()
     observer.join()
+    handler.engine.stop()
+    csv_sink.close()
+    artifact_writer.close()
+    artifact_writer.print_stats()
+    if manifest is not None:
+        manifest.close()
 
 if __name__ == "__main__":
     main()
@@ -4,7 +4,7 @@ import json
 import csv
 import shutil
 import cv2
-import ollama
+from ollama_router import get_router
 import os
 import numpy as np
 import concurrent.futures
@@ -219,8 +219,8 @@ class GPUHandler(FileSystemEventHandler):
     def ask_ollama_single(self, image_path):
         prompt = "Read the text in this image. Return ONLY the value. No extra words."
         try:
-            # If using custom port, use: client = ollama.Client(host=...)
-            response = ollama.chat(
+            # 端点/并发/重试见 config_pipeline.OLLAMA_ENDPOINTS 等配置
+            response = get_router().chat(
                 model=OLLAMA_MODEL,
                 messages=[{'role': 'user', 'content': prompt, 'images': [str(image_path)]}],
                 options={'num_predict': 20} 
@@ -4,7 +4,7 @@ import json
 import csv
 import shutil
 import cv2
-import ollama
+from ollama_router import get_router
 import os
 import re  # <--- NEW: Added regex for cleaning
 import numpy as np
@@ -212,7 +212,7 @@ class GPUHandler(FileSystemEventHandler):
         prompt = "Read the text or number in this image. Return ONLY the value. Do not repeat text. Do not output HTML."
         
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL,
                 messages=[{'role': 'user', 'content': prompt, 'images': [str(image_path)]}],
                 # 🌟 CRITICAL SETTINGS FOR ACCURACY 🌟
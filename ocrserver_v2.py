@@ -14,7 +14,7 @@ import json
 import csv
 import re
 import cv2
-import ollama
+from ollama_router import get_router
 import os
 import numpy as np
 import concurrent.futures
@@ -119,7 +119,7 @@ class OCRHandler(FileSystemEventHandler):
         prompt = STAGE0_PROMPTS.get(roi_type, "Read the text. Output only the value.")
         
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL_3B,
                 messages=[{
                     'role': 'user', 
@@ -4,7 +4,7 @@ import json
 import csv
 import shutil
 import cv2
-import ollama
+from ollama_router import get_router
 import os
 import re
 import numpy as np
@@ -192,7 +192,7 @@ class GPUHandler(FileSystemEventHandler):
     def ask_ollama_single(self, image_path):
         prompt = "Read the text or number in this image. Return ONLY the value. Do not repeat text. Do not output HTML."
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL,
                 messages=[{'role': 'user', 'content': prompt, 'images': [str(image_path)]}],
                 options={
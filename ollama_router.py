@@ -0,0 +1,369 @@
+"""
+共享推理客户端 - 多端点路由、连接池、重试、时限、熔断
+Shared Inference Client - Routing, Pooling, Retries, Deadlines, Circuit Breaker
+
+所有模型调用（Stage 0/2/5/6、拼图识别、校准工具、单机脚本）都经过这里，不再各自调用 ollama.chat：
+1. 最少在途请求路由：每次选当前在途请求最少的可用端点
+2. 每端点并发上限 + HTTP连接池（httpx keep-alive，连接数 = 并发上限），全部满载时调用方等待
+3. 有界重试：连接失败、超时、5xx/429 按指数退避+随机抖动重试（优先换端点），
+   模型返回的4xx错误（模型不存在、图像无效等）不重试
+4. 调用时限：deadline 覆盖排队、所有重试和退避等待，以及在途请求本身（每次请求的超时
+   取 OLLAMA_REQUEST_TIMEOUT 与剩余时限中较小的一个），超过后抛出 InferenceTimeout
+5. 熔断器：端点连续失败 OLLAMA_BREAKER_FAILURES 次后断开，冷却 OLLAMA_BREAKER_COOLDOWN 秒后
+   放行一个试探请求（成功则恢复，失败则继续断开）
+6. 健康检查：后台线程定期请求 /api/tags，失败的端点暂停分配直到恢复
+7. keep_alive：请求未指定时使用 OLLAMA_KEEP_ALIVE，模型不会在批次间隙被卸载
+8. 自适应并发：每个模型一个AIMD在途上限（adaptive_limiter.py），按p95延迟和错误自动增减
+
+服务短暂不可用（重启、加载模型）时调用方只是等待后重试，而不是把单元格写成 "NA"/"ERROR"。
+
+用法 Usage:
+    from ollama_router import get_router
+    response = get_router().chat(model=..., messages=..., options=...)
+    response = get_router().chat(model=..., messages=..., deadline=30.0)  # 本次调用的时限（秒）
+"""
+
+import time
+import random
+import threading
+
+import httpx
+import ollama
+
+from config_pipeline import *
+from adaptive_limiter import AimdLimiter
+
+
+# 当前线程本次请求的超时（秒）；由 OllamaRouter.chat 设置，None = 使用客户端默认超时
+_attempt = threading.local()
+
+
+def _clamp_timeout(request):
+    """httpx请求钩子：把单次请求的超时缩短到调用剩余的时限"""
+    timeout = getattr(_attempt, 'timeout', None)
+    if timeout is not None:
+        request.extensions['timeout'] = {'connect': timeout, 'read': timeout,
+                                         'write': timeout, 'pool': timeout}
+
+
+class InferenceTimeout(TimeoutError):
+    """调用在 deadline 内没有完成（排队 + 重试）"""
+
+
+class CircuitOpenError(ConnectionError):
+    """所有端点都处于熔断状态，且等待恢复会超过 deadline"""
+
+
+def is_retryable(error):
+    """连接失败、超时、服务端 5xx / 429 可以重试；其他错误原样抛出"""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500 or error.status_code == 429
+    return isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError))
+
+
+class Endpoint:
+    """单个Ollama实例的状态"""
+
+    def __init__(self, host, max_concurrency, timeout=OLLAMA_REQUEST_TIMEOUT):
+        self.host = host
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency)
+        self.client = ollama.Client(host=host, timeout=timeout, limits=limits,
+                                    event_hooks={'request': [_clamp_timeout]})
+        self.probe = ollama.Client(host=host, timeout=OLLAMA_HEALTH_TIMEOUT)
+        self.outstanding = 0
+        self.healthy = True
+        self.completed = 0
+        self.failed = 0
+        self.last_error = None
+
+        # 熔断器：consecutive_failures 达到阈值后 opened_at 记录断开时间
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial = False  # 半开状态下是否已有试探请求在途
+        self.trips = 0
+
+    def breaker_state(self, now=None):
+        if self.opened_at is None:
+            return 'closed'
+        now = time.monotonic() if now is None else now
+        return 'half_open' if now - self.opened_at >= OLLAMA_BREAKER_COOLDOWN else 'open'
+
+    def available(self, now):
+        """熔断器是否放行（不考虑并发上限）"""
+        state = self.breaker_state(now)
+        if state == 'closed':
+            return True
+        return state == 'half_open' and not self.trial
+
+    def stats(self):
+        return {
+            'healthy': self.healthy,
+            'breaker': self.breaker_state(),
+            'outstanding': self.outstanding,
+            'max': self.max_concurrency,
+            'completed': self.completed,
+            'failed': self.failed,
+            'trips': self.trips,
+            'last_error': self.last_error,
+        }
+
+
+class OllamaRouter:
+    """在多个Ollama端点之间按最少在途请求分配调用，失败时退避重试"""
+
+    def __init__(self, endpoints=None, health_interval=OLLAMA_HEALTH_INTERVAL,
+                 max_retries=OLLAMA_MAX_RETRIES, deadline=OLLAMA_CALL_DEADLINE,
+                 adaptive=OLLAMA_ADAPTIVE_CONCURRENCY):
+        endpoints = OLLAMA_ENDPOINTS if endpoints is None else endpoints
+        if not endpoints:
+            raise ValueError("OLLAMA_ENDPOINTS is empty")
+        self.endpoints = [Endpoint(e['host'], e.get('max_concurrency', MAX_WORKERS_3B))
+                          for e in endpoints]
+        self.max_retries = max(0, int(max_retries))
+        self.deadline = deadline
+        self.cond = threading.Condition()
+        self.next_index = 0  # 在途数相同时轮转，避免总是压在第一个端点
+        self.retries = 0
+        self.closed = False
+
+        # 每个模型一个AIMD在途上限（首次调用该模型时创建）
+        self.adaptive = adaptive
+        self.limiters = {}
+        self.limiter_max = OLLAMA_AIMD_MAX or sum(ep.max_concurrency for ep in self.endpoints)
+
+        self.health_interval = health_interval
+        self.checker = None
+        if health_interval and health_interval > 0:
+            self.checker = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+            self.checker.start()
+
+    # ---------- 调用 ----------
+    def chat(self, deadline=None, **kwargs):
+        """
+        与 ollama.chat 参数相同；失败时按退避重试（优先换一个端点）
+        deadline: 本次调用的总时限（秒），None = OLLAMA_CALL_DEADLINE
+        """
+        deadline = self.deadline if deadline is None else deadline
+        expires = None if not deadline else time.monotonic() + deadline
+        if OLLAMA_KEEP_ALIVE is not None:
+            kwargs.setdefault('keep_alive', OLLAMA_KEEP_ALIVE)
+
+        limiter = self.limiter(kwargs.get('model'))
+        tried = set()
+        attempt = 0
+        while True:
+            if limiter is not None and not limiter.acquire(expires):
+                raise InferenceTimeout(f"deadline exceeded waiting for a {limiter.name} concurrency slot")
+            try:
+                ep, trial = self._acquire(tried, expires)
+            except Exception:
+                if limiter is not None:
+                    limiter.release()
+                raise
+            start = time.monotonic()
+            clamped = _attempt.timeout = self._attempt_timeout(ep, expires)
+            try:
+                if clamped is not None and clamped <= 0:
+                    raise InferenceTimeout("deadline exceeded before the request was sent")
+                response = ep.client.chat(**kwargs)
+            except Exception as e:
+                if isinstance(e, InferenceTimeout) or (
+                        clamped is not None and isinstance(e, (httpx.TimeoutException, TimeoutError))):
+                    # 因调用时限而缩短的请求超时：不是端点故障，不计入熔断，也不再重试
+                    self._release(ep, ok=False, trial=trial, neutral=True)
+                    if limiter is not None:
+                        limiter.release()
+                    if isinstance(e, InferenceTimeout):
+                        raise
+                    raise InferenceTimeout(f"deadline exceeded during request after "
+                                           f"{attempt + 1} attempt(s): {e}") from e
+                retryable = is_retryable(e)
+                self._release(ep, ok=False, error=e if retryable else None, trial=trial)
+                if limiter is not None:
+                    limiter.release(error=retryable)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                tried.add(ep.host)
+                if len(tried) >= len(self.endpoints):
+                    tried.clear()  # 所有端点都试过：退避后从头再来
+                self._backoff(attempt, expires, e)
+                continue
+            finally:
+                _attempt.timeout = None
+            self._release(ep, ok=True, trial=trial)
+            if limiter is not None:
+                limiter.release(latency=time.monotonic() - start)
+            return response
+
+    @staticmethod
+    def _attempt_timeout(ep, expires):
+        """单次请求的超时：剩余时限比客户端超时短时用剩余时限，否则None（客户端默认）"""
+        if expires is None:
+            return None
+        remaining = expires - time.monotonic()
+        return remaining if ep.timeout is None or remaining < ep.timeout else None
+
+    def limiter(self, model):
+        """模型的AIMD上限；关闭自适应并发时返回None"""
+        if not self.adaptive or model is None:
+            return None
+        with self.cond:
+            limiter = self.limiters.get(model)
+            if limiter is None:
+                limiter = self.limiters[model] = AimdLimiter(model, maximum=self.limiter_max)
+            return limiter
+
+    def _backoff(self, attempt, expires, error):
+        """指数退避 + 完全随机抖动；剩余时间不够时直接超时"""
+        with self.cond:
+            self.retries += 1
+        delay = random.uniform(0, min(OLLAMA_RETRY_BACKOFF_MAX,
+                                      OLLAMA_RETRY_BACKOFF * (2 ** (attempt - 1))))
+        if expires is not None:
+            remaining = expires - time.monotonic()
+            if remaining <= delay:
+                raise InferenceTimeout(f"deadline exceeded after {attempt} attempt(s): {error}") from error
+        time.sleep(delay)
+
+    def _acquire(self, tried=(), expires=None):
+        """
+        选择在途请求最少的可用端点（优先未试过的）；全部满载或熔断时等待（不超过 deadline）
+        返回 (endpoint, 是否为半开试探请求)
+        """
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                candidates = [ep for ep in self.endpoints if ep.available(now)]
+                # 没有健康端点：仍然尝试熔断器放行的端点（健康检查可能滞后）
+                candidates = [ep for ep in candidates if ep.healthy] or candidates
+                free = [ep for ep in candidates if ep.outstanding < ep.max_concurrency]
+                if free:
+                    n = len(self.endpoints)
+                    order = {id(ep): (self.endpoints.index(ep) - self.next_index) % n
+                             for ep in free}
+                    ep = min(free, key=lambda e: (e.host in tried, e.outstanding, order[id(e)]))
+                    self.next_index = (self.endpoints.index(ep) + 1) % n
+                    ep.outstanding += 1
+                    trial = ep.breaker_state(now) == 'half_open'
+                    if trial:
+                        ep.trial = True
+                    return ep, trial
+
+                timeout = None
+                if not candidates:
+                    # 全部熔断：等到最早的端点进入半开状态（半开试探在途时等它结束的通知）
+                    reopen = [ep.opened_at + OLLAMA_BREAKER_COOLDOWN - now
+                              for ep in self.endpoints if ep.breaker_state(now) == 'open']
+                    timeout = min(reopen) if reopen else None
+                if expires is not None:
+                    remaining = expires - now
+                    if remaining <= 0:
+                        raise InferenceTimeout("deadline exceeded while waiting for an Ollama endpoint")
+                    if timeout is not None and timeout > remaining:
+                        raise CircuitOpenError(
+                            "all Ollama endpoints are circuit-broken: "
+                            + "; ".join(f"{ep.host}: {ep.last_error}" for ep in self.endpoints))
+                    timeout = remaining if timeout is None else timeout
+                self.cond.wait(timeout)
+
+    def _release(self, ep, ok, error=None, trial=False, neutral=False):
+        """
+        ok=False 且 error 为空：模型返回的错误，端点本身正常，不计入熔断
+        neutral=True：请求因调用时限被中止，无法判断端点状态，熔断器保持不变
+        """
+        with self.cond:
+            ep.outstanding -= 1
+            if trial:
+                ep.trial = False
+            if neutral:
+                self.cond.notify_all()
+                return
+            if ok:
+                ep.completed += 1
+            else:
+                ep.failed += 1
+            if error is None:
+                ep.consecutive_failures = 0
+                if ep.opened_at is not None:
+                    print(f"\n  ✅ Ollama circuit closed: {ep.host}")
+                ep.opened_at = None
+            else:
+                ep.last_error = str(error)
+                ep.consecutive_failures += 1
+                if ep.opened_at is not None or ep.consecutive_failures >= OLLAMA_BREAKER_FAILURES:
+                    if ep.opened_at is None:
+                        ep.trips += 1
+                        print(f"\n  ⚠️  Ollama circuit open: {ep.host} ({error})")
+                    # 半开试探失败：重新计时
+                    ep.opened_at = time.monotonic()
+            self.cond.notify_all()
+
+    # ---------- 健康检查 ----------
+    def check_health(self):
+        """探测所有端点（GET /api/tags），返回 {host: healthy}"""
+        results = {}
+        for ep in self.endpoints:
+            try:
+                ep.probe.list()
+                ok, err = True, None
+            except Exception as e:
+                ok, err = False, str(e)
+            with self.cond:
+                if ok and not ep.healthy:
+                    print(f"\n  ✅ Ollama endpoint back online: {ep.host}")
+                elif not ok and ep.healthy:
+                    print(f"\n  ⚠️  Ollama endpoint unhealthy: {ep.host} ({err})")
+                ep.healthy = ok
+                if err:
+                    ep.last_error = err
+                self.cond.notify_all()
+            results[ep.host] = ok
+        return results
+
+    def _health_loop(self):
+        while not self.closed:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+    # ---------- 统计 ----------
+    def stats(self):
+        with self.cond:
+            return {ep.host: ep.stats() for ep in self.endpoints}
+
+    def concurrency_stats(self):
+        """每个模型当前的自适应在途上限 {model: {...}}"""
+        with self.cond:
+            limiters = dict(self.limiters)
+        return {model: limiter.stats() for model, limiter in limiters.items()}
+
+    def print_stats(self):
+        for host, s in self.stats().items():
+            state = "✅" if s['healthy'] and s['breaker'] == 'closed' else "❌"
+            print(f"  {state} {host}: outstanding={s['outstanding']}/{s['max']}, "
+                  f"completed={s['completed']}, failed={s['failed']}, "
+                  f"breaker={s['breaker']} (trips={s['trips']})")
+        print(f"  🔁 Retries: {self.retries}")
+        for model, s in self.concurrency_stats().items():
+            print(f"  🎚️  {model}: limit={s['limit']} (inflight={s['inflight']}, p95={s['p95_ms']}ms, "
+                  f"baseline={s['baseline_ms']}ms, +{s['increases']}/-{s['decreases']})")
+
+    def close(self):
+        self.closed = True
+
+
+# ================= 进程级共享路由器 =================
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """返回进程级共享的路由器（首次调用时按 OLLAMA_ENDPOINTS 创建）"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = OllamaRouter()
+        return _router
@@ -0,0 +1,171 @@
+"""
+按ROI类型约束模型输出 - Ollama 结构化输出（format = JSON schema）
+Schema-constrained Decoding for Typed ROI Reads
+
+原来每次调用都让模型自由生成（num_predict 30），再用 clean_output / clean_model_output /
+post_process_number 的正则修补：特殊token、HTML、重复数字、多余小数位仍会漏到最终数据，
+Stage 6 的 fix_format_issues_with_7b / audit_final_output 为此再调用7B。
+
+STRUCTURED_OUTPUT_ENABLED = True 时，Stage 0 / 2 / 5 的调用带上按 ROI_TYPE_MAP 类型生成的
+JSON schema，服务端用语法约束解码，模型只能输出 {"value": "<符合类型的读数>"}：
+- STATUS  : 枚举 OK / NG / NA
+- INTEGER : -?数字
+- FLOAT   : -?数字，最多 MAX_DECIMALS 位小数，只有一个小数点
+- TIME    : H:MM:SS / HH:MM:SS
+- 其他    : 单行短文本
+- 未配置  : ROI_CONFIGS 中没有类型的ROI（例如机器时间戳 51、ROI 0）不加约束
+所有类型都允许 "NA"（看不清时不强迫模型猜）。
+
+解析失败（例如旧版Ollama忽略schema）时按原样返回文本，仍由原有清理函数处理。
+
+取舍 Trade-off（STATUS）：
+枚举约束后，模型在 STATUS ROI 上读到数字（ROI偏移、画面切换等）时也只能答 OK/NG/NA，
+clean_output 原来会把这种数字原样暴露出来，现在看不到了。
+StatusAudit 按 STRUCTURED_STATUS_AUDIT_RATE 抽样，对同一裁剪再做一次不带schema的调用，
+统计约束答案与自由答案不一致的次数（其中自由答案是数字的单独计数）并打印警告。
+"""
+
+import json
+import random
+import threading
+
+from config_pipeline import *
+
+
+VALUE_PATTERNS = {
+    'INTEGER': r'^(-?[0-9]{1,9}|NA)$',
+    'FLOAT': r'^(-?[0-9]{1,6}(\.[0-9]{1,%d})?|NA)$' % MAX_DECIMALS,
+    'TIME': r'^([0-9]{1,2}:[0-9]{2}:[0-9]{2}|NA)$',
+}
+
+FORMAT_HINT = 'Respond in JSON: {"value": "<what you read>"}'
+
+
+def value_schema(roi_type):
+    """单个读数的schema（字符串，按类型约束；roi_type=None 表示未配置，不加约束）"""
+    if roi_type is None:
+        return {'type': 'string'}
+    if roi_type == 'STATUS':
+        return {'type': 'string', 'enum': ['OK', 'NG', 'NA']}
+    if roi_type in VALUE_PATTERNS:
+        return {'type': 'string', 'pattern': VALUE_PATTERNS[roi_type]}
+    return {'type': 'string', 'pattern': r'^[^\n]{1,40}$'}
+
+
+def roi_schema(roi_type):
+    """单ROI调用的 format：{"value": ...}"""
+    return {
+        'type': 'object',
+        'properties': {'value': value_schema(roi_type)},
+        'required': ['value'],
+    }
+
+
+def group_schema(ids):
+    """拼图调用的 format：{"<id>": ...}，每个ID按自己的类型约束"""
+    return {
+        'type': 'object',
+        'properties': {rid: value_schema(get_roi_type(rid, default=None)) for rid in ids},
+        'required': list(ids),
+    }
+
+
+def value_request(prompt, roi_type):
+    """
+    返回 (prompt, chat关键字参数)
+    关闭时或ROI类型未配置（roi_type=None）时原样返回 (prompt, {})，请求与缓存键都与原来相同
+    """
+    if not STRUCTURED_OUTPUT_ENABLED or roi_type is None:
+        return prompt, {}
+    return f"{prompt}\n{FORMAT_HINT}", {'format': roi_schema(roi_type)}
+
+
+def parse_value(raw):
+    """从 {"value": ...} 中取出读数；不是这种JSON时返回原文本"""
+    if not raw:
+        return raw
+    try:
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        return raw
+    if not isinstance(data, dict) or 'value' not in data:
+        return raw
+    value = data['value']
+    if value is None or isinstance(value, (bool, dict, list)):
+        return raw
+    return str(value).strip()
+
+
+# ================= STATUS 约束/自由答案抽样对比 =================
+class StatusAudit:
+    """抽样比较 STATUS 的约束答案和不带schema的重试答案"""
+
+    def __init__(self, rate=STRUCTURED_STATUS_AUDIT_RATE, keep=20):
+        self.rate = rate
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.checked = 0
+        self.disagreed = 0
+        self.numeric = 0      # 自由答案是数字（约束把误读强行归为 OK/NG/NA）
+        self.errors = 0
+        self.recent = []      # 最近的不一致 (roi_id, 约束答案, 自由答案)
+
+    def should_check(self):
+        return self.rate > 0 and random.random() < self.rate
+
+    def record(self, roi_id, constrained, free):
+        """记录一次对比；不一致时返回True"""
+        numeric = is_number(free)
+        with self.lock:
+            self.checked += 1
+            if free == constrained:
+                return False
+            self.disagreed += 1
+            if numeric:
+                self.numeric += 1
+            self.recent = (self.recent + [(roi_id, constrained, free)])[-self.keep:]
+        return True
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'checked': self.checked,
+                'disagreed': self.disagreed,
+                'numeric': self.numeric,
+                'errors': self.errors,
+                'disagree_rate': round(self.disagreed / self.checked, 3) if self.checked else 0.0,
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        if not s['checked'] and not s['errors']:
+            return
+        print(f"🔎 STATUS schema audit: {s['disagreed']}/{s['checked']} disagreed "
+              f"({s['numeric']} numeric misreads hidden by the enum, {s['errors']} errors)")
+
+
+def is_number(text):
+    try:
+        float(text)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+_status_audit = None
+_status_audit_lock = threading.Lock()
+
+
+def get_status_audit():
+    """返回进程级共享的 STATUS 对比统计；未开启结构化输出或抽样率为0时返回None"""
+    global _status_audit
+    if not STRUCTURED_OUTPUT_ENABLED or STRUCTURED_STATUS_AUDIT_RATE <= 0:
+        return None
+    with _status_audit_lock:
+        if _status_audit is None:
+            _status_audit = StatusAudit()
+        return _status_audit
@@ -4,7 +4,7 @@ import shutil
 import cv2
 import numpy as np
 import sys
-import ollama
+from ollama_router import get_router
 from pathlib import Path
 
 # ================= Configuration =================
@@ -63,7 +63,7 @@ def prepare_image_for_llm(img, save_path):
 
 def run_ollama_inference(image_path, model_name):
     try:
-        response = ollama.chat(
+        response = get_router().chat(
             model=model_name,
             messages=[{
                 'role': 'user',
@@ -122,12 +122,10 @@ def main():
 
     print("--------------------------------")
     print(f"Initializing connection to Ollama ({OLLAMA_MODEL})...")
-    try:
-        ollama.list()
-        print("✅ Connected to Ollama.")
-    except Exception as e:
+    if not any(get_router().check_health().values()):
         print("❌ CRITICAL: Ollama app is not running.")
         return
+    print("✅ Connected to Ollama.")
 
     rois = load_rois(ROI_JSON)
     if not rois: return
@@ -4,7 +4,7 @@ import json
 import csv
 import shutil
 import cv2
-import ollama
+from ollama_router import get_router
 import math
 import re
 from datetime import datetime, timedelta
@@ -260,7 +260,7 @@ class GroupedBatchHandler(FileSystemEventHandler):
             f"Output ONLY JSON."
         )
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL,
                 messages=[{'role': 'user', 'content': prompt, 'images': [str(image_path)]}]
             )
@@ -4,7 +4,7 @@ import json
 import csv
 import shutil
 import cv2
-import ollama
+from ollama_router import get_router
 import os
 import numpy as np
 from datetime import datetime, timedelta
@@ -193,7 +193,7 @@ class SerialHandler(FileSystemEventHandler):
     def ask_ollama_single(self, image_path):
         prompt = "Read the text in this image. Return ONLY the value. No extra words."
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL,
                 messages=[{'role': 'user', 'content': prompt, 'images': [str(image_path)]}],
                 options={'num_predict': 20} 
@@ -5,6 +5,8 @@ import os
 import shutil
 from pathlib import Path
 
+from config_pipeline import get_roi_pad, get_roi_upscale
+
 # ================= USER CONFIGURATION =================
 
 # 1. Source Directory: Where the ORIGINAL full images are located
@@ -46,7 +48,7 @@ def load_rois(json_path):
         
     return roi_map
 
-def perform_crop(img_path, roi_coords, save_path):
+def perform_crop(img_path, roi_coords, save_path, roi_id=None):
     """Reads source image, crops ROI, and saves it."""
     if not img_path.exists():
         print(f"  ❌ Source image missing: {img_path.name}")
@@ -60,16 +62,20 @@ def perform_crop(img_path, roi_coords, save_path):
         H, W = img.shape[:2]
 
         # Padding
-        x0, y0 = max(0, x - ROI_PAD), max(0, y - ROI_PAD)
-        x1, y1 = min(W, x + w + ROI_PAD), min(H, y + h + ROI_PAD)
+        # Per-ROI pad/upscale shared with Stage 0 (roi_upscale_table.json); falls back to the settings above
+        pad = get_roi_pad(roi_id, ROI_PAD) if roi_id is not None else ROI_PAD
+        scale = get_roi_upscale(roi_id, UPSCALE) if roi_id is not None else UPSCALE
+
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(W, x + w + pad), min(H, y + h + pad)
 
         crop = img[y0:y1, x0:x1]
         
         if crop.size == 0: return False
 
         # Upscale
-        if UPSCALE != 1.0:
-            crop = cv2.resize(crop, None, fx=UPSCALE, fy=UPSCALE, interpolation=cv2.INTER_CUBIC)
+        if scale != 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
 
         # Ensure directory exists
         save_path.parent.mkdir(parents=True, exist_ok=True)
@@ -155,7 +161,7 @@ def main():
                 target_path = RECOVERED_CROPS_DIR / csv_folder_name / parent_stem / f"{roi_id_str}.jpg"
 
                 # Execute Crop
-                if perform_crop(src_img_path, roi_map[roi_key], target_path):
+                if perform_crop(src_img_path, roi_map[roi_key], target_path, roi_key):
                     print(f"    ✅ Restored: {target_path.name}")
                     total_recovered += 1
                 else:
@@ -16,7 +16,9 @@ from tqdm import tqdm
 from config_pipeline import (
     DEBUG_CROPS_BASE, 
     CSV_INPUT_DIR,
-    PROJECT_ROOT
+    PROJECT_ROOT,
+    get_roi_pad,
+    get_roi_upscale
 )
 
 # ================= 配置 / Configuration =================
@@ -54,22 +56,26 @@ def load_rois(json_path):
     print(f"✅ Loaded {len(roi_map)} ROIs from JSON.")
     return roi_map
 
-def perform_crop(img, roi_coords, save_path):
+def perform_crop(img, roi_coords, save_path, roi_id=None):
     """执行裁剪并保存"""
     try:
         x, y, w, h = roi_coords
         H, W = img.shape[:2]
 
-        x0, y0 = max(0, x - ROI_PAD), max(0, y - ROI_PAD)
-        x1, y1 = min(W, x + w + ROI_PAD), min(H, y + h + ROI_PAD)
+        # 与 Stage 0 相同的按ROI边距/上采样（roi_upscale_table.json），表中没有时用本文件的设置
+        pad = get_roi_pad(roi_id, ROI_PAD) if roi_id is not None else ROI_PAD
+        scale = get_roi_upscale(roi_id, UPSCALE) if roi_id is not None else UPSCALE
+
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(W, x + w + pad), min(H, y + h + pad)
 
         crop = img[y0:y1, x0:x1]
         
         if crop.size == 0:
             return False
 
-        if UPSCALE != 1.0:
-            crop = cv2.resize(crop, None, fx=UPSCALE, fy=UPSCALE, interpolation=cv2.INTER_CUBIC)
+        if scale != 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
 
         save_path.parent.mkdir(parents=True, exist_ok=True)
         cv2.imwrite(str(save_path), crop)
@@ -137,7 +143,7 @@ def crop_all_rois_for_image(img_path, roi_map, roi_ids):
         coords = roi_map[roi_key]
         save_path = output_folder / f"ROI_{roi_id}.jpg"
         
-        if perform_crop(img, coords, save_path):
+        if perform_crop(img, coords, save_path, roi_key):
             cropped += 1
         else:
             skipped += 1
@@ -5,6 +5,8 @@ import os
 import shutil
 from pathlib import Path
 
+from config_pipeline import get_roi_pad, get_roi_upscale
+
 # ================= USER CONFIGURATION =================
 
 # 1. Input: The Audit Report
@@ -45,20 +47,24 @@ def load_rois(json_path):
     print(f"✅ Loaded {len(roi_map)} ROIs from JSON (IDs: {list(roi_map.keys())[:5]} ... {list(roi_map.keys())[-1]})")
     return roi_map
 
-def perform_crop(img, roi_coords, save_path):
+def perform_crop(img, roi_coords, save_path, roi_id=None):
     try:
         x, y, w, h = roi_coords
         H, W = img.shape[:2]
 
-        x0, y0 = max(0, x - ROI_PAD), max(0, y - ROI_PAD)
-        x1, y1 = min(W, x + w + ROI_PAD), min(H, y + h + ROI_PAD)
+        # Per-ROI pad/upscale shared with Stage 0 (roi_upscale_table.json); falls back to the settings above
+        pad = get_roi_pad(roi_id, ROI_PAD) if roi_id is not None else ROI_PAD
+        scale = get_roi_upscale(roi_id, UPSCALE) if roi_id is not None else UPSCALE
+
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(W, x + w + pad), min(H, y + h + pad)
 
         crop = img[y0:y1, x0:x1]
         
         if crop.size == 0: return False
 
-        if UPSCALE != 1.0:
-            crop = cv2.resize(crop, None, fx=UPSCALE, fy=UPSCALE, interpolation=cv2.INTER_CUBIC)
+        if scale != 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
 
         save_path.parent.mkdir(parents=True, exist_ok=True)
         cv2.imwrite(str(save_path), crop)
@@ -137,7 +143,7 @@ def main():
             target_name = f"ROI_{roi_key}.jpg"
             target_path = RECOVERED_CROPS_DIR / img_folder_base / target_name
             
-            if perform_crop(img, coords, target_path):
+            if perform_crop(img, coords, target_path, roi_key):
                 crops_done += 1
         
         print(f"Generated {crops_done} ROIs.")
@@ -0,0 +1,186 @@
+"""
+ROI像素差分短路 - 相邻帧相同的ROI复用上一次读数
+Per-ROI Pixel-diff Short-circuit Across Consecutive Frames
+
+Stage 4/6 的统计显示大量帧是 "Time Frozen" / "Redundant" 重复帧，
+但 Stage 0 仍然把每帧每个ROI都送进模型。
+
+每个 (相机目录, ROI) 保存最近一次真正送入模型的裁剪：
+- 新裁剪与其逐像素最大绝对差 <= ROI_REUSE_PIXEL_THRESHOLD（默认0 = 完全相同）时直接复用那次的读数
+- 参考裁剪只在真正推理时更新（复用不更新），避免缓慢漂移被一直放过
+- 连续复用 ROI_REUSE_MAX_CONSECUTIVE 次后强制重新推理一次
+
+读数以 Future 保存：流水线模式下上一帧的推理还没结束时也能复用（等待同一个结果）。
+失败的读数不复用：已失败的Future不匹配，仍在进行的Future之后失败时条目被立即移除。
+
+整帧去重 FrameDedup：HMI画面没有刷新时，连续截图在所有ROI区域内逐像素相同。
+在裁剪/上采样之前对ROI并集计算精确哈希，与上一帧相同时整帧沿用上一帧的全部读数。
+"""
+
+import hashlib
+import threading
+import concurrent.futures
+
+import cv2
+import numpy as np
+
+from config_pipeline import *
+
+
+class RoiDiffCache:
+    """按 (相机目录, ROI) 保存参考裁剪和对应读数"""
+
+    def __init__(self, threshold=ROI_REUSE_PIXEL_THRESHOLD,
+                 max_consecutive=ROI_REUSE_MAX_CONSECUTIVE):
+        self.threshold = threshold
+        self.max_consecutive = max_consecutive
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> [参考裁剪, Future, 连续复用次数]
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def match(self, key, crop):
+        """
+        裁剪与参考足够接近时返回参考读数的 Future，否则返回 None
+        失败的读数不会被复用
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or crop is None:
+            return self._miss()
+        ref, future, count = entry
+        if ref.shape != crop.shape:
+            return self._miss()
+        if self.max_consecutive and count >= self.max_consecutive:
+            return self._miss()
+        if is_failed(future):
+            return self._miss()
+        diff = cv2.absdiff(ref, crop)
+        if self.threshold <= 0:
+            same = not diff.any()
+        else:
+            # 最大差而不是平均差：任何一个像素变化超过阈值都重新推理
+            same = int(diff.max()) <= self.threshold
+        if not same:
+            return self._miss()
+        with self.lock:
+            entry[2] += 1
+            self.hits += 1
+        return future
+
+    def _miss(self):
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def remember(self, key, crop, future):
+        """记录一次真正的推理（裁剪作为新的参考）"""
+        if crop is None:
+            return
+        if crop.base is not None:
+            crop = crop.copy()  # 不要通过视图持有整帧图像
+        entry = [crop, future, 0]
+        with self.lock:
+            self.entries[key] = entry
+        future.add_done_callback(lambda f: self._forget_failed(key, entry, f))
+
+    def _forget_failed(self, key, entry, future):
+        """读数失败时移除条目（之后相同的裁剪重新推理）"""
+        if not is_failed(future):
+            return
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+                self.evicted += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'reused': self.hits,
+                'inferred': self.misses,
+                'reuse_rate': round(self.hits / total, 3) if total else 0.0,
+                'evicted_failed': self.evicted,
+            }
+
+
+class FrameDedup:
+    """按相机目录记录上一帧的ROI并集指纹和全部读数"""
+
+    def __init__(self, table, max_consecutive=FRAME_DEDUP_MAX_CONSECUTIVE):
+        self.table = table  # RoiTable（与裁剪共用同一张边界表）
+        self.max_consecutive = max_consecutive
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> [指纹, {roi: Future}, 连续复用次数]
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def fingerprint(self, img):
+        """ROI并集（含padding）的精确哈希；不在ROI内的像素（如屏幕时钟以外的区域）不参与"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr(img.shape).encode())
+        for _, b in self.table.bounds(img.shape):
+            if b is not None:
+                h.update(np.ascontiguousarray(img[b[0]:b[1], b[2]:b[3]]).data)
+        return h.digest()
+
+    def match(self, key, fp):
+        """指纹与上一帧相同时返回上一帧的 {roi: Future}，否则返回None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is None or entry[0] != fp
+                    or (self.max_consecutive and entry[2] >= self.max_consecutive)):
+                self.misses += 1
+                return None
+            futures = entry[1]
+        # 上一帧有失败的ROI时不沿用（让该帧重新推理）
+        for future in futures.values():
+            if is_failed(future):
+                with self.lock:
+                    self.misses += 1
+                return None
+        with self.lock:
+            entry[2] += 1
+            self.hits += 1
+        return futures
+
+    def remember(self, key, fp, futures):
+        """记录一帧真正处理过的读数"""
+        entry = [fp, dict(futures), 0]
+        with self.lock:
+            self.entries[key] = entry
+        for future in entry[1].values():
+            future.add_done_callback(lambda f: self._forget_failed(key, entry, f))
+
+    def _forget_failed(self, key, entry, future):
+        """任一ROI失败时移除整帧条目（之后相同的帧重新推理）"""
+        if not is_failed(future):
+            return
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+                self.evicted += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'duplicate_frames': self.hits,
+                'processed_frames': self.misses,
+                'dup_rate': round(self.hits / total, 3) if total else 0.0,
+                'evicted_failed': self.evicted,
+            }
+
+
+def is_failed(future):
+    """Future已完成且失败（异常或取消）"""
+    return future.done() and (future.cancelled() or future.exception() is not None)
+
+
+def completed_future(value):
+    """已知读数包装成Future，和推理结果走同一条写入路径"""
+    future = concurrent.futures.Future()
+    future.set_result(value)
+    return future
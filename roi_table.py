@@ -0,0 +1,115 @@
+"""
+预编译ROI裁剪表 - 每种帧尺寸只计算一次边界
+Precompiled ROI Slicing Table
+
+原来每个ROI在推理线程里各自计算带padding的边界、切片、INTER_CUBIC上采样。
+RoiTable 把 roi.json 编译成 NumPy 边界表（每种帧尺寸向量化计算一次并缓存），
+一帧的全部ROI在裁剪阶段（stage0_pipeline 的裁剪线程 / 单帧模式的调用线程）
+一次性裁剪+上采样，推理线程池只接收现成的图像缓冲。
+
+裁剪结果与逐个ROI裁剪完全相同（推理缓存按图像内容哈希，不会失效）。
+每个ROI的边距/上采样倍数来自 roi_upscale_table.json（calibrate_upscale.py），没有则用全局值。
+
+暗ROI筛查：整帧只转一次灰度，建两张积分图（灰度和、亮像素计数），
+每个ROI的"太暗"判断是O(1)查表，在裁剪/上采样之前完成，暗ROI不必分配裁剪。
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+from config_pipeline import *
+
+
+class RoiTable:
+    """roi.json 的 (name, x, y, w, h) 列表 -> 每种帧尺寸一张边界表"""
+
+    def __init__(self, rois, pad=None, upscale=None):
+        """
+        pad / upscale: None = 按ROI查 roi_upscale_table.json（get_roi_pad / get_roi_upscale），
+        给定数值则所有ROI统一使用
+        """
+        self.names = [str(name) for name, *_ in rois]
+        self.boxes = np.array([box for _, *box in rois], dtype=np.int64).reshape(-1, 4)
+        self.pads = np.array([get_roi_pad(n) if pad is None else pad for n in self.names],
+                             dtype=np.int64)
+        self.upscales = {n: get_roi_upscale(n) if upscale is None else float(upscale)
+                         for n in self.names}
+        self.lock = threading.Lock()
+        # (H, W) -> ([(name, (y0, y1, x0, x1) 或 None), ...], 边界数组 (y0, y1, x0, x1, valid))
+        self.compiled = {}
+
+    def bounds(self, shape):
+        """返回该帧尺寸的边界表；越界/空裁剪的ROI边界为None"""
+        return self._compiled(shape)[0]
+
+    def _compiled(self, shape):
+        key = tuple(shape[:2])
+        table = self.compiled.get(key)
+        if table is None:
+            table = self._compile(*key)
+            with self.lock:
+                self.compiled[key] = table
+        return table
+
+    def _compile(self, H, W):
+        x, y, w, h = self.boxes.T
+        # 全部裁到 [0, W] / [0, H]：越界ROI的边界也能安全地查积分图（valid 为False）
+        pad = self.pads
+        x0, y0 = np.clip(x - pad, 0, W), np.clip(y - pad, 0, H)
+        x1, y1 = np.clip(x + w + pad, 0, W), np.clip(y + h + pad, 0, H)
+        valid = (x < W) & (y < H) & (x1 > x0) & (y1 > y0)
+        rows = np.stack([y0, y1, x0, x1], axis=1).tolist()
+        entries = [(name, tuple(r) if ok else None)
+                   for name, r, ok in zip(self.names, rows, valid.tolist())]
+        return entries, (y0, y1, x0, x1, valid)
+
+    def dark_rois(self, img, threshold=DARKNESS_THRESHOLD):
+        """
+        返回太暗的ROI名称集合（规则同原 is_image_too_dark）：
+        平均灰度 < threshold 且 亮像素(>100)数 < 像素数 × 1% × 通道数
+        （原规则按上采样后的裁剪计算 img.size * 0.01，这里按原始分辨率的同一比例）
+        """
+        y0, y1, x0, x1, valid = self._compiled(img.shape)[1]
+        if not valid.any():
+            return set()
+        # 只在全部ROI的外接矩形内转灰度、建积分图
+        top, left = int(y0[valid].min()), int(x0[valid].min())
+        bottom, right = int(y1[valid].max()), int(x1[valid].max())
+        region = img[top:bottom, left:right]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY) if channels == 3 else region
+        _, bright = cv2.threshold(gray, 100, 1, cv2.THRESH_BINARY)
+        # CV_64F 积分图：大区域的灰度和可能超过 int32
+        sums = cv2.integral(gray, sdepth=cv2.CV_64F)
+        counts = cv2.integral(bright, sdepth=cv2.CV_64F)
+
+        ry0, ry1 = np.clip(y0 - top, 0, bottom - top), np.clip(y1 - top, 0, bottom - top)
+        rx0, rx1 = np.clip(x0 - left, 0, right - left), np.clip(x1 - left, 0, right - left)
+
+        def box(ii):
+            return ii[ry1, rx1] - ii[ry0, rx1] - ii[ry1, rx0] + ii[ry0, rx0]
+
+        area = np.maximum((y1 - y0) * (x1 - x0), 1)
+        dark = valid & (box(sums) / area < threshold) & (box(counts) < area * 0.01 * channels)
+        return {name for name, d in zip(self.names, dark.tolist()) if d}
+
+    def crop_all(self, img, skip=()):
+        """
+        一次裁剪+上采样一帧的全部ROI，返回 {name: crop 或 None}（按roi.json顺序）
+        skip: 不需要裁剪的ROI（例如清单中已有读数的ROI）
+        """
+        crops = {}
+        for name, b in self.bounds(img.shape):
+            if name in skip:
+                continue
+            if b is None:
+                crops[name] = None
+                continue
+            crop = img[b[0]:b[1], b[2]:b[3]]
+            scale = self.upscales[name]
+            if scale != 1.0:
+                crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+            crops[name] = crop
+        return crops
@@ -30,22 +30,23 @@ def check_prerequisites():
         print("   Please create roi.json with your ROI configuration")
         return False
     
-    # 检查Ollama模型
-    try:
-        import ollama
-        models = ollama.list()
-        model_names = [m['name'] for m in models.get('models', [])]
-        
-        if OLLAMA_MODEL_3B not in model_names:
-            print(f"⚠️  Warning: {OLLAMA_MODEL_3B} not found in Ollama")
-            print(f"   Run: ollama pull {OLLAMA_MODEL_3B}")
-        
-        if OLLAMA_MODEL_7B not in model_names:
-            print(f"⚠️  Warning: {OLLAMA_MODEL_7B} not found in Ollama")
-            print(f"   Run: ollama pull {OLLAMA_MODEL_7B}")
-        
-    except Exception as e:
-        print(f"⚠️  Warning: Could not check Ollama models: {e}")
+    # 检查Ollama模型（每个配置的端点）
+    from ollama_router import get_router
+    for ep in get_router().endpoints:
+        try:
+            models = ep.probe.list()
+            model_names = [m['name'] for m in models.get('models', [])]
+            
+            if OLLAMA_MODEL_3B not in model_names:
+                print(f"⚠️  Warning: {OLLAMA_MODEL_3B} not found in Ollama ({ep.host})")
+                print(f"   Run: OLLAMA_HOST={ep.host} ollama pull {OLLAMA_MODEL_3B}")
+            
+            if OLLAMA_MODEL_7B not in model_names:
+                print(f"⚠️  Warning: {OLLAMA_MODEL_7B} not found in Ollama ({ep.host})")
+                print(f"   Run: OLLAMA_HOST={ep.host} ollama pull {OLLAMA_MODEL_7B}")
+            
+        except Exception as e:
+            print(f"⚠️  Warning: Could not check Ollama models at {ep.host}: {e}")
     
     # 创建目录
     create_directories()
@@ -136,6 +137,11 @@ def run_full_pipeline(skip_ocr=False):
     print(f"   - Stage 5 7B Verified: {STAGE_5_7B_VERIFIED}")
     print(f"   - Stage 6 Final Dataset: {STAGE_6_FINAL}")
     
+    from inference_cache import get_inference_cache
+    cache = get_inference_cache()
+    if cache is not None:
+        cache.print_stats()
+    
     return True
 
 def run_specific_stage(stage_number):
@@ -0,0 +1,356 @@
+"""
+Stage 0 流水线引擎 - 跨图像并行处理
+Pipelined Stage 0 Engine - Cross-image Pipelining
+
+四个阶段由有界队列连接 Four stages joined by bounded queues:
+0. 接收 Ingest:    watchdog/批量扫描 → IngestQueue（去重 + 就绪检查 + 背压）
+1. 解码 Decode:    路径 → cv2.imread
+2. 裁剪 Crop:      整帧 → 每个ROI的上采样裁剪 + 调试地图
+   （STAGE0_DECODE_PROCESSES > 0 时1-2在子进程完成，裁剪经共享内存传回，见 frame_decoder.py）
+3. 推理 Inference: ROI裁剪 → 3B模型（进程级共享线程池 inference_pool）
+4. 写入 Sink:      按提交顺序写 results.json 和 CSV
+
+第N帧的慢ROI还在推理时，第N+1帧已经在解码/裁剪/推理，GPU不再空等。
+CSV行顺序与就绪顺序一致（写入阶段按序号重排）。
+
+配合 FrameManifest：推理失败的ROI会被记录，重试时只对这些ROI调用模型。
+配合 RoiDiffCache：与上一帧相同的ROI直接复用上一帧的Future，不再调用模型。
+配合 FrameDedup：ROI并集与上一帧完全相同的整帧直接沿用上一帧的全部Future。
+
+单帧模式（STAGE0_PIPELINED = False）使用 SerialStage0Engine：同样经过 IngestQueue
+（去重 + 就绪检查 + 背压），由一个线程逐帧调用 EnhancedGPUHandler.process_frame。
+"""
+
+import time
+import queue
+import threading
+import concurrent.futures
+from pathlib import Path
+
+import cv2
+
+from config_pipeline import *
+from inference_pool import get_inference_pool
+from frame_decoder import ProcessFrameDecoder
+from ingest_queue import IngestQueue
+
+_STOP = object()
+print_lock = threading.Lock()
+
+
+class FrameJob:
+    """单帧在流水线中的状态"""
+
+    def __init__(self, seq, img_path):
+        self.seq = seq
+        self.img_path = Path(img_path)
+        self.save_dir = None
+        self.relative_parent = None
+        self.img = None
+        self.prepared = None  # 子进程解码时的 PreparedFrame（此时 img 为None）
+        self.futures = {}  # roi_name -> Future（按roi.json顺序）
+        self.sources = {}  # roi_name -> 读数来源（见 EnhancedGPUHandler.append_source_log）
+        self.start_t = time.time()
+
+    def collect_results(self):
+        """
+        等待所有ROI完成，按roi.json顺序返回 ({name: text}, 失败的ROI名集合)
+        失败的ROI值记为"NA"
+        """
+        concurrent.futures.wait(list(self.futures.values()))
+        results = {}
+        failed = set()
+        for name, future in self.futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                with print_lock:
+                    print(f"\n  ❌ ROI_{name} error: {e}")
+                results[name] = "NA"
+                failed.add(name)
+        return results, failed
+
+
+class IngestingEngine:
+    """
+    两种引擎共用的接收部分：IngestQueue + 已提交未写完的帧计数（wait_idle）
+    子类在帧处理完（写出、推迟或出错）后调用 _frame_finished
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.manifest = handler.manifest
+        self.ingest = IngestQueue(on_discard=self._on_discard)
+        self.idle = threading.Condition()
+        self.outstanding = 0
+        self.threads = []
+        self.running = False
+
+    def _spawn(self, target, count, name):
+        for i in range(count):
+            t = threading.Thread(target=target, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, img_path, ready=False):
+        """
+        提交一帧（积压满时阻塞，形成背压）
+        重复路径或清单中已完成的帧返回False；ready=True 跳过文件就绪检查
+        """
+        if self.manifest is not None and self.manifest.is_done(img_path):
+            return False
+        with self.idle:
+            self.outstanding += 1
+        accepted = self.ingest.offer(img_path, ready=ready)
+        if not accepted:
+            self._release_outstanding()
+        return accepted
+
+    def _on_discard(self, img_path, reason):
+        """接收队列放弃了一个路径（文件消失或一直不稳定）"""
+        self._release_outstanding()
+
+    def _frame_finished(self, img_path):
+        self.ingest.done(img_path)
+        self._release_outstanding()
+
+    def _release_outstanding(self):
+        with self.idle:
+            self.outstanding -= 1
+            self.idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """等待所有已提交的帧写完"""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.outstanding == 0, timeout)
+
+    def stop(self):
+        """写完所有已提交的帧后停止线程"""
+        if not self.running:
+            return
+        self.wait_idle()
+        self.ingest.close()
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        self._close()
+        self.running = False
+
+    def _close(self):
+        pass
+
+
+class SerialStage0Engine(IngestingEngine):
+    """
+    单帧模式：一个线程按就绪顺序逐帧处理（帧内ROI仍并行推理）
+    watchdog 回调只负责入队，不再在回调线程里处理图像
+    """
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self._spawn(self._process_loop, 1, "s0-serial")
+        return self
+
+    def _process_loop(self):
+        while True:
+            item = self.ingest.get()
+            if item is None:
+                return
+            _, img_path = item
+            try:
+                self.handler.process_frame(img_path)
+            except Exception as e:
+                with print_lock:
+                    print(f"\n❌ Error processing {img_path.name}: {e}")
+            finally:
+                self._frame_finished(img_path)
+
+    def print_stats(self):
+        print(f"📥 Ingest: {self.ingest.stats()}")
+        self.handler.print_skip_stats()
+
+
+class PipelinedStage0Engine(IngestingEngine):
+    """
+    Stage 0 流水线引擎
+    复用 EnhancedGPUHandler 的裁剪/推理/写CSV方法，只负责调度
+    """
+
+    def __init__(self, handler, decode_workers=STAGE0_DECODE_WORKERS,
+                 pool=None, max_inflight_frames=STAGE0_MAX_INFLIGHT_FRAMES):
+        super().__init__(handler)
+        # 多进程解码：每个解码线程等待一个子进程的结果
+        self.decoder = None
+        if STAGE0_DECODE_PROCESSES > 0:
+            self.decoder = ProcessFrameDecoder(handler.rois, STAGE0_DECODE_PROCESSES,
+                                               table=handler.roi_table)
+            decode_workers = self.decoder.processes
+        self.decode_workers = decode_workers
+        self.pool = pool if pool is not None else get_inference_pool()
+        self.reused_rois = 0
+        self.deferred_frames = 0
+
+        self.frame_queue = queue.Queue(maxsize=max(1, decode_workers))
+        self.sink_queue = queue.Queue(maxsize=max(1, max_inflight_frames))
+        self.decoders_done = 0
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        """启动所有阶段线程"""
+        if self.running:
+            return self
+        self.running = True
+        self._spawn(self._decode_loop, self.decode_workers, "s0-decode")
+        self._spawn(self._crop_loop, 1, "s0-crop")
+        self._spawn(self._sink_loop, 1, "s0-sink")
+        return self
+
+    def _close(self):
+        if self.decoder is not None:
+            self.decoder.close()
+
+    def print_stats(self):
+        """打印接收队列和推理线程池统计"""
+        print(f"📥 Ingest: {self.ingest.stats()}")
+        print(f"🧮 Inference pool: {self.pool.stats()}")
+        self.handler.print_skip_stats()
+        if self.manifest is not None:
+            print(f"📒 Manifest: {self.reused_rois} ROIs reused, "
+                  f"{self.deferred_frames} frames deferred (failed ROIs)")
+
+    # ---------- 阶段1: 解码 ----------
+    def _decode_loop(self):
+        while True:
+            item = self.ingest.get()
+            if item is None:
+                # 最后一个解码线程退出时通知下游
+                with self.idle:
+                    self.decoders_done += 1
+                    last = self.decoders_done == self.decode_workers
+                if last:
+                    self.frame_queue.put(_STOP)
+                return
+
+            seq, img_path = item
+            job = FrameJob(seq, img_path)
+            try:
+                job.save_dir, job.relative_parent = self.handler.prepare_output_dirs(img_path)
+                if self.decoder is not None:
+                    job.prepared = self.decoder.decode(
+                        img_path, self.handler.debug_map_path(job.save_dir),
+                        self.handler.dark_crops_needed(job.save_dir))
+                else:
+                    job.img = cv2.imread(str(img_path))
+            except Exception as e:
+                with print_lock:
+                    print(f"\n  ❌ Decode error {img_path.name}: {e}")
+                job.img = job.prepared = None
+            self.frame_queue.put(job)
+
+    # ---------- 阶段2: 裁剪 + 阶段3: 提交推理 ----------
+    def _crop_loop(self):
+        while True:
+            job = self.frame_queue.get()
+            if job is _STOP:
+                self.sink_queue.put(_STOP)
+                return
+
+            if job.img is None and job.prepared is None:
+                with print_lock:
+                    print(f"\n  ❌ Cannot read image: {job.img_path}")
+                self.sink_queue.put(job)
+                continue
+
+            try:
+                self._submit_job(job)
+            except Exception as e:
+                # 不能让唯一的裁剪线程退出：该帧不写出（清单中也不标记完成），照常交给写入阶段释放计数
+                with print_lock:
+                    print(f"\n  ❌ Crop/submit error {job.img_path.name}: {e}")
+                job.futures, job.sources = {}, {}
+                job.img = job.prepared = None
+
+            # 登记到写入阶段（有界 → 限制在途帧数）
+            self.sink_queue.put(job)
+
+    def _submit_job(self, job):
+        """裁剪一帧并提交推理（或沿用重复帧的读数），结果Future写入 job.futures"""
+        # 子进程解码时调试地图已在子进程中写出
+        if job.prepared is None:
+            self.handler.write_debug_map(job.img, job.save_dir)
+
+        # 重试帧：清单中已成功的ROI直接复用，不再调用模型
+        known = {}
+        if self.manifest is not None:
+            known = self.manifest.load_ok_rois(job.img_path)
+            self.reused_rois += len(known)
+
+        # 整帧去重（重试帧除外）：与上一帧完全相同则沿用全部读数，不裁剪/不推理
+        img, prepared = job.img, job.prepared
+        dedup = self.handler.frame_dedup
+        fp = None
+        if dedup is not None and not known:
+            dedup_key = str(job.save_dir.parent)
+            fp = prepared.fingerprint if prepared is not None else dedup.fingerprint(img)
+            leader = dedup.match(dedup_key, fp)
+            if leader is not None:
+                job.futures, job.sources = self.handler.adopt_duplicate_frame(
+                    img, job.save_dir, leader, prepared=prepared)
+                job.img = job.prepared = None
+                return
+
+        # 每个ROI（拼图模式下每个组）一个Future，线程池积压满时这里阻塞
+        # 调用失败总是以异常留在Future中（collect_results 记为"NA"），复用缓存不会沿用失败的读数
+        job.futures, job.sources = self.handler.submit_frame(
+            img, job.save_dir, self.pool, known, raise_errors=True, prepared=prepared)
+        if fp is not None:
+            dedup.remember(dedup_key, fp, job.futures)
+        job.img = job.prepared = None  # 裁剪已完成，释放整帧内存
+
+    # ---------- 阶段4: 写入 ----------
+    def _sink_loop(self):
+        next_seq = 0
+        waiting = {}  # seq -> FrameJob（多个解码线程可能乱序到达）
+        stopping = False
+        while True:
+            if not stopping:
+                job = self.sink_queue.get()
+                if job is _STOP:
+                    stopping = True
+                else:
+                    waiting[job.seq] = job
+
+            while next_seq in waiting:
+                job = waiting.pop(next_seq)
+                self._finish_frame(job)
+                next_seq += 1
+
+            if stopping and not waiting:
+                return
+
+    def _finish_frame(self, job):
+        """按原顺序写出一帧的结果"""
+        try:
+            if job.save_dir is not None and job.futures:
+                ordered, failed = job.collect_results()
+                token, deferred = self.handler.record_manifest(job.img_path, ordered, failed)
+                if deferred:
+                    self.deferred_frames += 1
+                    return
+                self.handler.write_frame_results(job.img_path, ordered,
+                                                 job.save_dir, job.relative_parent, token,
+                                                 sources=job.sources)
+                self.handler.processed_count += 1
+                duration = time.time() - job.start_t
+                print(f"\n✅ [{self.handler.processed_count}] {job.img_path.name}: "
+                      f"{len(ordered)} ROIs in {duration:.1f}s "
+                      f"(ingest: {self.ingest.depth()}, ROI queue: {self.pool.queue_depth()})")
+                if self.handler.processed_count % 10 == 0:
+                    self.handler.print_median_stats()
+        except Exception as e:
+            print(f"\n  ❌ Sink error {job.img_path.name}: {e}")
+        finally:
+            self._frame_finished(job.img_path)
+
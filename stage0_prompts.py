@@ -0,0 +1,114 @@
+"""
+Stage 0 的Prompt、输出清理和ROI加载 - 无副作用，可被工具脚本直接导入
+Stage 0 Prompts, Output Cleaning and ROI Loading (side-effect free)
+
+calibrate_upscale.py 等工具只需要这几样东西，不必导入 ocrserver_enhanced
+（服务器模块会创建Median加载器、CSV/产物写入线程等）。
+"""
+
+import re
+import json
+from pathlib import Path
+
+
+# ================= Stage 0 专用简单Prompts =================
+# Simple prompts for Stage 0 OCR - based only on data field type
+# These are separate from Stage 1-6 prompts in config_pipeline.py
+STAGE0_PROMPTS = {
+    'STATUS': "What text do you see in this image? Reply with exactly one word: OK or NG or NA",
+    'INTEGER': "What integer number is shown? Reply with only the number, nothing else.",
+    'FLOAT': "What decimal number is shown? Reply with only the number (like 1.234), nothing else.",
+    'TIME': "What time is shown? Reply with only HH:MM:SS format, nothing else.",
+    'DATE': "What date/time is shown? Reply with only the text, nothing else.",
+}
+
+
+def clean_output(raw_text, roi_type):
+    """
+    清理模型输出 - 仅移除特殊tokens，严格解析
+    Clean model output - remove special tokens, strict parsing
+    """
+    if not raw_text:
+        return "NA"
+    
+    # 移除模型特殊tokens
+    special_tokens = [
+        r'<\|im_start\|>', r'<\|im_end\|>', r'<\|endoftext\|>',
+        r'<\|pad\|>', r'<\|assistant\|>', r'<\|user\|>', r'<\|system\|>',
+    ]
+    text = raw_text
+    for token in special_tokens:
+        text = re.sub(token, '', text)
+    
+    # 移除HTML标签和markdown
+    text = re.sub(r'<[^>]+>', '', text)
+    text = text.replace('```', '').replace('`', '').strip()
+    
+    # 只取第一行第一个词
+    text = text.split('\n')[0].strip()
+    text = text.split()[0] if text.split() else text
+    
+    # 根据类型处理 - 严格解析
+    if roi_type == 'STATUS':
+        upper = text.upper().strip()
+        # 严格匹配：只有当文本就是OK或NG时才返回
+        if upper == 'OK':
+            return 'OK'
+        if upper == 'NG':
+            return 'NG'
+        if upper == 'NA':
+            return 'NA'
+        # 检查是否是数字（说明这不是STATUS字段的图像）
+        if re.match(r'^-?\d+\.?\d*$', text.strip()):
+            return text  # 返回数字本身，不是OK
+        # 如果文本包含NG（严格一点）
+        if upper.startswith('NG') or upper == 'N':
+            return 'NG'
+        # 如果文本包含OK（严格一点）  
+        if upper.startswith('OK') or upper == 'O':
+            return 'OK'
+        return text  # 返回原始文本
+    
+    elif roi_type == 'INTEGER':
+        match = re.search(r'-?\d+', text)
+        return match.group(0) if match else text
+    
+    elif roi_type == 'FLOAT':
+        match = re.search(r'-?\d+\.?\d*', text)
+        if match:
+            try:
+                val = float(match.group(0))
+                return f"{val:.3f}".rstrip('0').rstrip('.')
+            except:
+                pass
+        return text
+    
+    elif roi_type == 'TIME':
+        match = re.search(r'\d{1,2}:\d{2}:\d{2}', text)
+        return match.group(0) if match else text
+    
+    return text
+
+
+def load_rois(roi_path: Path):
+    """加载ROI配置"""
+    if not roi_path.exists(): 
+        return []
+    try:
+        with open(roi_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rois = []
+        data_list = data if isinstance(data, list) else [data]
+        for idx, item in enumerate(data_list):
+            name = item.get("name", str(idx))
+            rois.append((
+                str(name), 
+                int(item["x"]), 
+                int(item["y"]), 
+                int(item["w"]), 
+                int(item["h"])
+            ))
+        return rois
+    except Exception as e:
+        print(f"❌ Error loading ROI: {e}")
+        return []
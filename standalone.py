@@ -1,6 +1,6 @@
 import cv2
 import json
-import ollama
+from ollama_router import get_router
 import time
 import os
 from pathlib import Path
@@ -76,7 +76,7 @@ def run_serial_test():
         
         start_t = time.time()
         try:
-            response = ollama.chat(
+            response = get_router().chat(
                 model=OLLAMA_MODEL,
                 messages=[{'role': 'user', 'content': prompt, 'images': [temp_crop_path]}],
                 options={'num_predict': 20} # Limit output to 20 tokens for speed
@@ -0,0 +1,119 @@
+"""
+STATUS ROI 颜色分类快速通道
+Color-classifier Fast Path for STATUS ROIs
+
+HMI 上 STATUS 字段的 OK/NG 用绿色/红色文字显示（见 DARK_BACKGROUND_ENHANCEMENT.md）。
+高置信度的裁剪直接在CPU上判定，只有不确定的才送去 qwen2.5vl:3b：
+
+1. HSV 颜色掩码（cv2.inRange，向量化）：红色 H 0-10/170-180，绿色 H 40-80，S/V >= 50
+2. 文字形状检查：有色像素占比在合理范围内（不是空白也不是整块色块），
+   连通域数量像几个字符
+3. 置信度 = 颜色纯度（主色占红+绿的比例）× 有色文字占全部亮文字的比例
+4. 置信度 >= 阈值（可按ROI单独设置）才判定，否则返回None交给模型
+"""
+
+import threading
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from config_pipeline import *
+
+# HSV 范围（与 DARK_BACKGROUND_ENHANCEMENT.md 相同）
+RED_RANGES = [((0, 50, 50), (10, 255, 255)), ((170, 50, 50), (180, 255, 255))]
+GREEN_RANGE = ((40, 50, 50), (80, 255, 255))
+WHITE_RANGE = ((0, 0, 200), (180, 30, 255))
+
+
+class StatusColorClassifier:
+    """按颜色和文字形状判定 STATUS 裁剪的 OK/NG"""
+
+    def __init__(self, min_confidence=STATUS_CLASSIFIER_MIN_CONFIDENCE,
+                 roi_thresholds=None,
+                 min_coverage=STATUS_CLASSIFIER_MIN_COVERAGE,
+                 max_coverage=STATUS_CLASSIFIER_MAX_COVERAGE,
+                 max_components=STATUS_CLASSIFIER_MAX_COMPONENTS):
+        self.min_confidence = min_confidence
+        self.roi_thresholds = dict(STATUS_CLASSIFIER_ROI_THRESHOLDS if roi_thresholds is None
+                                   else roi_thresholds)
+        self.min_coverage = min_coverage
+        self.max_coverage = max_coverage
+        self.max_components = max_components
+
+        self.lock = threading.Lock()
+        self.decided = defaultdict(lambda: {'OK': 0, 'NG': 0})
+        self.ambiguous = defaultdict(int)
+
+    def threshold(self, roi_id):
+        return self.roi_thresholds.get(str(roi_id), self.min_confidence)
+
+    # ---------- 特征 ----------
+    def features(self, crop):
+        """返回颜色占比、纯度和连通域数量"""
+        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        red = cv2.inRange(hsv, *RED_RANGES[0]) | cv2.inRange(hsv, *RED_RANGES[1])
+        green = cv2.inRange(hsv, *GREEN_RANGE)
+        white = cv2.inRange(hsv, *WHITE_RANGE)
+
+        total = float(hsv.shape[0] * hsv.shape[1])
+        n_red = cv2.countNonZero(red)
+        n_green = cv2.countNonZero(green)
+        n_white = cv2.countNonZero(white)
+        n_color = n_red + n_green
+
+        # 文字形状：主色掩码的连通域（忽略极小的噪点）
+        mask = red if n_red >= n_green else green
+        components = 0
+        if n_color:
+            count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+            min_area = max(4, int(total * 0.002))
+            components = int(np.count_nonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area))
+
+        return {
+            'coverage': n_color / total,
+            'purity': max(n_red, n_green) / n_color if n_color else 0.0,
+            'color_share': n_color / (n_color + n_white) if n_color else 0.0,
+            'dominant': 'NG' if n_red >= n_green else 'OK',
+            'components': components,
+        }
+
+    # ---------- 判定 ----------
+    def classify(self, roi_id, crop):
+        """
+        高置信度时返回 ('OK' | 'NG', confidence)，否则返回 (None, confidence)
+        """
+        f = self.features(crop)
+        confidence = 0.0
+        if (self.min_coverage <= f['coverage'] <= self.max_coverage
+                and 1 <= f['components'] <= self.max_components):
+            confidence = f['purity'] * f['color_share']
+
+        label = f['dominant'] if confidence >= self.threshold(roi_id) else None
+        with self.lock:
+            if label is None:
+                self.ambiguous[str(roi_id)] += 1
+            else:
+                self.decided[str(roi_id)][label] += 1
+        return label, confidence
+
+    # ---------- 统计 ----------
+    def stats(self):
+        """节省的模型调用数（已判定）和送去模型的数量（不确定）"""
+        with self.lock:
+            saved = sum(d['OK'] + d['NG'] for d in self.decided.values())
+            sent = sum(self.ambiguous.values())
+            return {
+                'saved_calls': saved,
+                'sent_to_model': sent,
+                'save_rate': round(saved / (saved + sent), 3) if saved + sent else 0.0,
+                'per_roi': {roi: {**self.decided.get(roi, {'OK': 0, 'NG': 0}),
+                                  'ambiguous': self.ambiguous.get(roi, 0)}
+                            for roi in sorted(set(self.decided) | set(self.ambiguous),
+                                              key=lambda r: int(r) if r.isdigit() else r)},
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"🚦 STATUS color classifier: saved {s['saved_calls']} calls, "
+              f"{s['sent_to_model']} sent to model (save rate {s['save_rate']})")
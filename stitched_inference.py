@@ -0,0 +1,151 @@
+"""
+Stage 0 拼图批量识别 - 每个CSV组一次模型调用
+Stitched Multi-ROI Batch Inference for Stage 0
+
+qwenocrbatch.py 的拼图方式（带 ID 标签的网格画布 + JSON 输出）在这里成为
+ocrserver_enhanced 的正式模式（STAGE0_INFERENCE_MODE = 'stitched'）：
+1. 按 CSV_GROUPS 分组拼图（不在任何组内的ROI，如时间戳51/52，单独成组）
+2. 要求模型输出 {"ID": "Text"} JSON，并按期望ID逐个校验
+3. 缺失或格式不对的ID才回退到单ROI调用
+
+每帧模型调用数从约50次降到组数（4-5次）+ 少量回退。
+"""
+
+import re
+import json
+import math
+import concurrent.futures
+
+import cv2
+import numpy as np
+
+from config_pipeline import *
+
+
+def build_stitch_groups(roi_names, max_rois=STAGE0_STITCH_MAX_ROIS):
+    """
+    按 CSV_GROUPS 划分拼图组，只保留 roi.json 中存在的ROI
+    其余ROI单独成组；超过 max_rois 的组按顺序拆分
+    """
+    names = [str(n) for n in roi_names]
+    present = set(names)
+    groups = []
+    covered = set()
+    for ids in CSV_GROUPS.values():
+        group = [str(i) for i in ids if str(i) in present]
+        covered.update(group)
+        if group:
+            groups.append(group)
+    rest = [n for n in names if n not in covered]
+    if rest:
+        groups.append(rest)
+
+    if max_rois and max_rois > 0:
+        groups = [g[i:i + max_rois] for g in groups for i in range(0, len(g), max_rois)]
+    return groups
+
+
+def create_stitched_image(crops, cols=STAGE0_STITCH_COLS):
+    """
+    把 [(name, crop), ...] 拼成带 "ID:name" 标签的网格画布
+    与 qwenocrbatch.create_stitched_image 的布局相同
+    """
+    if not crops:
+        return None
+    rows = math.ceil(len(crops) / cols)
+
+    max_h = max(c.shape[0] for _, c in crops)
+    max_w = max(c.shape[1] for _, c in crops)
+    cell_w, cell_h = max_w + 20, max_h + 40
+    canvas = np.full((rows * cell_h, cols * cell_w, 3), 255, dtype=np.uint8)
+
+    for idx, (name, img) in enumerate(crops):
+        r, c = idx // cols, idx % cols
+        x_off, y_off = c * cell_w, r * cell_h
+        h, w = img.shape[:2]
+        x_pos = x_off + (cell_w - w) // 2
+        y_pos = y_off + 35
+        canvas[y_pos:y_pos + h, x_pos:x_pos + w] = img
+        cv2.putText(canvas, f"ID:{name}", (x_off + 5, y_off + 25),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        cv2.rectangle(canvas, (x_off, y_off), (x_off + cell_w, y_off + cell_h), (200, 200, 200), 1)
+
+    return canvas
+
+
+def build_batch_prompt(expected_ids):
+    """拼图识别prompt：列出期望ID，要求只输出JSON"""
+    ids_str = ", ".join(expected_ids)
+    return (
+        f"Each cell is labelled ID:<number>. Read the text for IDs: {ids_str}. "
+        f"Return a JSON object {{\"ID\": \"Text\"}} with exactly these IDs as keys. "
+        f"Copy numbers and dates like 'Dec/16/25' exactly. "
+        f"Output ONLY JSON."
+    )
+
+
+def parse_batch_json(raw, expected_ids):
+    """
+    解析模型输出的JSON，只返回期望ID中格式正确的条目 {id: text}
+    键允许 "12" / "ID:12" / "ID 12"；值必须是非空字符串或数字
+    """
+    clean = re.sub(r'```(?:json)?\s*|\s*```', '', raw or '').replace("`", "").strip()
+    # 模型有时在JSON前后加说明：取第一个 { 到最后一个 }
+    start, end = clean.find('{'), clean.rfind('}')
+    if start < 0 or end <= start:
+        return {}
+    try:
+        data = json.loads(clean[start:end + 1])
+    except (ValueError, TypeError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    expected = set(expected_ids)
+    parsed = {}
+    for key, value in data.items():
+        rid = re.sub(r'^\s*ID\s*[:_ ]?\s*', '', str(key), flags=re.IGNORECASE).strip()
+        if rid not in expected or rid in parsed:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            continue
+        text = str(value).strip()
+        if text:
+            parsed[rid] = text
+    return parsed
+
+
+def is_well_formed(text, roi_type):
+    """清理后的拼图读数是否符合字段类型；不符合的ID回退到单ROI调用"""
+    if text == "NA":
+        return True
+    if roi_type == 'INTEGER':
+        return re.fullmatch(r'-?\d+', text) is not None
+    if roi_type == 'FLOAT':
+        return re.fullmatch(r'-?\d+(\.\d+)?', text) is not None
+    if roi_type == 'STATUS':
+        return text in ('OK', 'NG')
+    return bool(text)
+
+
+def split_group_future(group_future, names):
+    """
+    把一组ROI的Future（结果为 {name: text 或 Exception}）拆成每个ROI一个Future
+    与单ROI模式的Future用法相同（可复用、可等待、失败时抛出异常）
+    """
+    children = {name: concurrent.futures.Future() for name in names}
+
+    def resolve(future):
+        try:
+            results = future.result()
+        except Exception as e:
+            results = {name: e for name in names}
+        for name, child in children.items():
+            value = results.get(name, "NA")
+            if isinstance(value, Exception):
+                child.set_exception(value)
+            else:
+                child.set_result(value)
+
+    group_future.add_done_callback(resolve)
+    return children